@@ -1,7 +1,10 @@
 from typing import List, Optional, Type
 
+from history_window import ConversationHistoryManager, ConversationHistoryMixin
+from lazy_mixins import add_lazy_mixin
 from pydantic import Field
 from pydantic.main import BaseModel
+from request_coalescing import RequestCoalescer, RequestCoalescingMixin
 from steamship.agents.functional import FunctionsBasedAgent
 from steamship.agents.llms.openai import ChatOpenAI
 from steamship.agents.mixins.transports.slack import (
@@ -13,7 +16,7 @@ from steamship.agents.mixins.transports.telegram import (
     TelegramTransport,
     TelegramTransportConfig,
 )
-from steamship.agents.schema import Tool
+from steamship.agents.schema import Agent, AgentContext, Tool
 from steamship.agents.service.agent_service import AgentService
 from steamship.invocable import Config, post
 from steamship.utils.kv_store import KeyValueStore
@@ -97,7 +100,13 @@ class BasicAgentServiceWithDynamicPrompt(AgentService):
     - Web Embeds
     """
 
-    USED_MIXIN_CLASSES = [SteamshipWidgetTransport, TelegramTransport, SlackTransport]
+    USED_MIXIN_CLASSES = [
+        SteamshipWidgetTransport,
+        TelegramTransport,
+        SlackTransport,
+        ConversationHistoryMixin,
+        RequestCoalescingMixin,
+    ]
     """USED_MIXIN_CLASSES tells Steamship what additional HTTP endpoints to register on your AgentService."""
 
     class BasicAgentServiceWithDynamicPromptConfig(Config):
@@ -106,6 +115,20 @@ class BasicAgentServiceWithDynamicPrompt(AgentService):
         telegram_bot_token: str = Field(
             "", description="[Optional] Secret token for connecting to Telegram"
         )
+        history_window_tokens: int = Field(
+            0,
+            description="How many tokens of the most recent conversation to send to the LLM with each message. 0 sends "
+            "none, as by default.",
+        )
+        history_summary_enabled: bool = Field(
+            True,
+            description="With a history window, summarize the conversation before it, in the background, and send the "
+            "summary with each message.",
+        )
+        request_coalescing_enabled: bool = Field(
+            True,
+            description="Run the agent only once for a Slack or Telegram message that is delivered more than once, such as when a webhook is retried.",
+        )
 
     config: BasicAgentServiceWithDynamicPromptConfig
     """The configuration block that users who create an instance of this agent will provide."""
@@ -113,6 +136,12 @@ class BasicAgentServiceWithDynamicPrompt(AgentService):
     tools: List[Tool]
     """The list of Tools that this agent is capable of using."""
 
+    history_manager: ConversationHistoryManager
+    """Chooses the part of each conversation to send to the LLM, and keeps conversations' summaries and token metrics."""
+
+    request_coalescer: RequestCoalescer
+    """Keeps retried deliveries of a Slack or Telegram message from running the agent again."""
+
     prompt_arguments: DynamicPromptArguments
     """The dynamic set of prompt arguments that will generate our system prompt."""
 
@@ -166,37 +195,80 @@ class BasicAgentServiceWithDynamicPrompt(AgentService):
         agent.PROMPT = self.prompt_arguments.to_system_prompt()
         self.set_default_agent(agent)
 
+        # Conversation History Setup
+        # --------------------------
+
+        # By default the agent sends the LLM no earlier messages of the conversation. With `history_window_tokens` set,
+        # each message is sent with the most recent `history_window_tokens` tokens of the conversation, and a summary
+        # of everything before them, which is brought up to date in the background by the `/summarize_history`
+        # endpoint. `/history_stats` reports how many tokens each conversation has sent, and how many more that is
+        # than without the window. See history_window.py.
+        self.history_manager = ConversationHistoryManager(
+            self,
+            window_tokens=self.config.history_window_tokens,
+            summary_enabled=self.config.history_summary_enabled,
+            baseline_selector=self.get_default_agent().message_selector,
+        )
+        if self.history_manager.enabled:
+            self.get_default_agent().message_selector = self.history_manager.selector()
+        self.add_mixin(ConversationHistoryMixin(self.history_manager))
+
+        # Request Coalescing Setup
+        # ------------------------
+
+        # Slack and Telegram deliver a message again when the agent is slow to respond. Runs of the agent are keyed by
+        # the message's id, so a retried delivery waits for or reuses the original run rather than answering twice.
+        # `/request_coalescing_stats` reports how many duplicate runs were avoided. See request_coalescing.py.
+        self.request_coalescer = RequestCoalescer(
+            self.client, enabled=self.config.request_coalescing_enabled
+        )
+        self.add_mixin(RequestCoalescingMixin(self.request_coalescer))
+
         # Communication Transport Setup
         # -----------------------------
 
+        # Each transport's endpoints are registered now, but the transport itself is only constructed when a request
+        # arrives on one of those endpoints. See lazy_mixins.py.
+
         # Support Steamship's web client
-        self.add_mixin(
-            SteamshipWidgetTransport(
+        add_lazy_mixin(
+            self,
+            SteamshipWidgetTransport,
+            lambda: SteamshipWidgetTransport(
                 client=self.client,
                 agent_service=self,
-            )
+            ),
         )
 
         # Support Slack
-        self.add_mixin(
-            SlackTransport(
+        add_lazy_mixin(
+            self,
+            SlackTransport,
+            lambda: SlackTransport(
                 client=self.client,
                 config=SlackTransportConfig(),
                 agent_service=self,
-            )
+            ),
         )
 
         # Support Telegram
-        self.add_mixin(
-            TelegramTransport(
+        add_lazy_mixin(
+            self,
+            TelegramTransport,
+            lambda: TelegramTransport(
                 client=self.client,
                 config=TelegramTransportConfig(
                     bot_token=self.config.telegram_bot_token
                 ),
                 agent_service=self,
-            )
+            ),
         )
 
+    def run_agent(self, agent: Agent, context: AgentContext):
+        """Run the agent, unless the message is a duplicate delivery of one it has already run for."""
+        run_agent = super().run_agent
+        return self.request_coalescer.run(context, lambda: run_agent(agent, context))
+
     @post("/set_prompt_arguments")
     def set_prompt_arguments(
         self,
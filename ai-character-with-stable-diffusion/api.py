@@ -1,6 +1,12 @@
-from typing import List, Type
+from typing import Any, List, Type, Union
 
+from history_window import ConversationHistoryManager, ConversationHistoryMixin
+from image_cache import ImageCache, with_image_cache
+from image_jobs import ImageJobs, ImageJobsMixin, run_image_tool, with_image_jobs
+from lazy_mixins import add_lazy_mixin
 from pydantic import Field
+from request_coalescing import RequestCoalescer, RequestCoalescingMixin
+from steamship import Block, Task
 from steamship.agents.functional import FunctionsBasedAgent
 from steamship.agents.llms.openai import ChatOpenAI
 from steamship.agents.mixins.transports.slack import (
@@ -12,10 +18,11 @@ from steamship.agents.mixins.transports.telegram import (
     TelegramTransport,
     TelegramTransportConfig,
 )
-from steamship.agents.schema import Tool
+from steamship.agents.schema import Agent, AgentContext, Tool
 from steamship.agents.service.agent_service import AgentService
 from steamship.agents.tools.image_generation.stable_diffusion import StableDiffusionTool
-from steamship.invocable import Config
+from steamship.invocable import Config, get
+from steamship.utils.kv_store import KeyValueStore
 
 DEFAULT_NAME = "Picard"
 DEFAULT_BYLINE = "captain of the Starship Enterprise"
@@ -53,6 +60,31 @@ Here is the image you requested: Block(288A2CA1-4753-4298-9716-53C1E42B726B).
 
 Only use the functions you have been provided with."""
 
+IMAGE_JOB_ACKNOWLEDGEMENT = (
+    "The image is being generated, and will be sent to the user in a separate message as soon as it is ready. "
+    "Let the user know it is on its way."
+)
+
+
+class BackgroundStableDiffusionTool(StableDiffusionTool):
+    """StableDiffusionTool that reuses cached images, and generates in the background on Slack and Telegram, when the
+    context has an ImageCache or ImageJobs.
+
+    See image_cache.py and image_jobs.py.
+    """
+
+    def run(
+        self, tool_input: List[Block], context: AgentContext
+    ) -> Union[List[Block], Task[Any]]:
+        run = super().run
+        return run_image_tool(
+            self,
+            tool_input,
+            context,
+            IMAGE_JOB_ACKNOWLEDGEMENT,
+            lambda: run(tool_input, context),
+        )
+
 
 class BasicAgentServiceWithPersonality(AgentService):
     """Deployable Multimodal Bot that lets you generate Stable Diffusion images.
@@ -64,7 +96,14 @@ class BasicAgentServiceWithPersonality(AgentService):
 
     """
 
-    USED_MIXIN_CLASSES = [SteamshipWidgetTransport, TelegramTransport, SlackTransport]
+    USED_MIXIN_CLASSES = [
+        SteamshipWidgetTransport,
+        TelegramTransport,
+        SlackTransport,
+        ConversationHistoryMixin,
+        RequestCoalescingMixin,
+        ImageJobsMixin,
+    ]
     """USED_MIXIN_CLASSES tells Steamship what additional HTTP endpoints to register on your AgentService."""
 
     class BasicAgentServiceWithPersonalityConfig(Config):
@@ -87,6 +126,43 @@ class BasicAgentServiceWithPersonality(AgentService):
         behavior: str = Field(
             DEFAULT_BEHAVIOR, description="The behavior of your companion"
         )
+        history_window_tokens: int = Field(
+            0,
+            description="How many tokens of the most recent conversation to send to the LLM with each message. 0 sends "
+            "none, as by default.",
+        )
+        history_summary_enabled: bool = Field(
+            True,
+            description="With a history window, summarize the conversation before it, in the background, and send the "
+            "summary with each message.",
+        )
+        request_coalescing_enabled: bool = Field(
+            True,
+            description="Run the agent only once for a Slack or Telegram message that is delivered more than once, such as when a webhook is retried.",
+        )
+        async_image_generation_enabled: bool = Field(
+            False,
+            description="On Slack and Telegram, reply straight away when asked for an image, and send the image once it has been generated.",
+        )
+        max_concurrent_image_jobs: int = Field(
+            2,
+            description="How many images may be generated in the background at once in this workspace.",
+        )
+        image_cache_enabled: bool = Field(
+            False,
+            description="Reuse images generated earlier for the same Stable Diffusion prompt, instead of always generating a new one.",
+        )
+        image_cache_ttl_seconds: int = Field(
+            86400,
+            description="How long a cached image may be reused, in seconds.",
+        )
+        image_cache_max_entries: int = Field(
+            500, description="How many prompts to keep cached images for."
+        )
+        image_cache_max_variants: int = Field(
+            3,
+            description="How many different images to generate for a prompt before reusing them, for variety.",
+        )
 
     config: BasicAgentServiceWithPersonalityConfig
     """The configuration block that users who create an instance of this agent will provide."""
@@ -94,6 +170,18 @@ class BasicAgentServiceWithPersonality(AgentService):
     tools: List[Tool]
     """The list of Tools that this agent is capable of using."""
 
+    history_manager: ConversationHistoryManager
+    """Chooses the part of each conversation to send to the LLM, and keeps conversations' summaries and token metrics."""
+
+    request_coalescer: RequestCoalescer
+    """Keeps retried deliveries of a Slack or Telegram message from running the agent again."""
+
+    image_cache: ImageCache
+    """Remembers the images generated for each Stable Diffusion prompt, so repeated requests can reuse them."""
+
+    image_jobs: ImageJobs
+    """Generates images in the background for Slack and Telegram, and delivers them when they are ready."""
+
     @classmethod
     def config_cls(cls) -> Type[Config]:
         """Return the Configuration class so that Steamship can auto-generate a web UI upon agent creation time."""
@@ -109,7 +197,7 @@ class BasicAgentServiceWithPersonality(AgentService):
         # they can be stateful -- using Key-Valued storage and conversation history.
         #
         # See https://docs.steamship.com for a full list of supported Tools.
-        self.tools = [StableDiffusionTool()]
+        self.tools = [BackgroundStableDiffusionTool()]
 
         # Agent Setup
         # ---------------------
@@ -130,33 +218,115 @@ class BasicAgentServiceWithPersonality(AgentService):
         )
         self.set_default_agent(agent)
 
+        # Conversation History Setup
+        # --------------------------
+
+        # By default the agent sends the LLM no earlier messages of the conversation. With `history_window_tokens` set,
+        # each message is sent with the most recent `history_window_tokens` tokens of the conversation, and a summary
+        # of everything before them, which is brought up to date in the background by the `/summarize_history`
+        # endpoint. `/history_stats` reports how many tokens each conversation has sent, and how many more that is
+        # than without the window. See history_window.py.
+        self.history_manager = ConversationHistoryManager(
+            self,
+            window_tokens=self.config.history_window_tokens,
+            summary_enabled=self.config.history_summary_enabled,
+            baseline_selector=self.get_default_agent().message_selector,
+        )
+        if self.history_manager.enabled:
+            self.get_default_agent().message_selector = self.history_manager.selector()
+        self.add_mixin(ConversationHistoryMixin(self.history_manager))
+
+        # Request Coalescing Setup
+        # ------------------------
+
+        # Slack and Telegram deliver a message again when the agent is slow to respond. Runs of the agent are keyed by
+        # the message's id, so a retried delivery waits for or reuses the original run rather than answering twice.
+        # `/request_coalescing_stats` reports how many duplicate runs were avoided. See request_coalescing.py.
+        self.request_coalescer = RequestCoalescer(
+            self.client, enabled=self.config.request_coalescing_enabled
+        )
+        self.add_mixin(RequestCoalescingMixin(self.request_coalescer))
+
+        # Image Cache Setup
+        # -----------------
+
+        # Generated images are remembered in the workspace's KeyValueStore, keyed by the Stable Diffusion prompt and
+        # settings. Once `image_cache_max_variants` images have been generated for a prompt, requests for it are
+        # answered with them in turn. `/image_cache_stats` reports the hit ratio. See image_cache.py.
+        self.image_cache = ImageCache(
+            KeyValueStore(self.client, store_identifier="image-cache"),
+            ttl_seconds=self.config.image_cache_ttl_seconds,
+            max_entries=self.config.image_cache_max_entries,
+            max_variants=self.config.image_cache_max_variants,
+        )
+
+        # Image Jobs Setup
+        # ----------------
+
+        # On Slack and Telegram, the image tool starts generating and replies straight away, and the image is sent
+        # once it is ready, so the webhook isn't held open (and retried) while Stable Diffusion runs. About
+        # `max_concurrent_image_jobs` images are generated at once. `/image_job_stats` reports how jobs went. See
+        # image_jobs.py.
+        self.image_jobs = ImageJobs(
+            self,
+            max_concurrent_jobs=self.config.max_concurrent_image_jobs,
+            image_cache=self.image_cache if self.config.image_cache_enabled else None,
+        )
+        self.add_mixin(ImageJobsMixin(self.image_jobs))
+
         # Communication Transport Setup
         # -----------------------------
 
+        # Each transport's endpoints are registered now, but the transport itself is only constructed when a request
+        # arrives on one of those endpoints. See lazy_mixins.py.
+
         # Support Steamship's web client
-        self.add_mixin(
-            SteamshipWidgetTransport(
+        add_lazy_mixin(
+            self,
+            SteamshipWidgetTransport,
+            lambda: SteamshipWidgetTransport(
                 client=self.client,
                 agent_service=self,
-            )
+            ),
         )
 
         # Support Slack
-        self.add_mixin(
-            SlackTransport(
+        add_lazy_mixin(
+            self,
+            SlackTransport,
+            lambda: SlackTransport(
                 client=self.client,
                 config=SlackTransportConfig(),
                 agent_service=self,
-            )
+            ),
         )
 
         # Support Telegram
-        self.add_mixin(
-            TelegramTransport(
+        add_lazy_mixin(
+            self,
+            TelegramTransport,
+            lambda: TelegramTransport(
                 client=self.client,
                 config=TelegramTransportConfig(
                     bot_token=self.config.telegram_bot_token
                 ),
                 agent_service=self,
-            )
+            ),
         )
+
+    def run_agent(self, agent: Agent, context: AgentContext):
+        """Run the agent, unless the message is a duplicate delivery of one it has already run for.
+
+        The image tools are given the image cache and image jobs on the context, if they are enabled.
+        """
+        if self.config.image_cache_enabled:
+            with_image_cache(self.image_cache, context)
+        if self.config.async_image_generation_enabled:
+            with_image_jobs(self.image_jobs, context)
+        run_agent = super().run_agent
+        return self.request_coalescer.run(context, lambda: run_agent(agent, context))
+
+    @get("/image_cache_stats")
+    def image_cache_stats(self) -> dict:
+        """Return hit/miss counters, and the hit ratio, for the generated image cache."""
+        return self.image_cache.stats()
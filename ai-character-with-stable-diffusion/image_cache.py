@@ -0,0 +1,183 @@
+"""Cache of generated images, keyed by the Stable Diffusion prompt that produced them.
+
+Users ask for the same pictures again and again ("show me Fido swimming"), and each request would otherwise start a
+new, slow Stable Diffusion generation. The ImageCache remembers the image Blocks generated for a normalized prompt and
+generator configuration, and hands them back to later requests for the same prompt.
+
+So that a repeated request doesn't always get the very same picture, up to `max_variants` images are generated for
+each prompt before the cache starts answering; after that, requests are served the cached variants in turn.
+
+Entries expire `ttl_seconds` after they were generated, and the least recently used prompts are evicted beyond
+`max_entries`. Like SpeechCache, the cache stores Block references (not image bytes) in a KeyValueStore.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, Optional
+
+from steamship import Block, Tag
+from steamship.agents.schema import AgentContext
+
+INDEX_KEY = "__image-cache-index__"
+"""The store key under which the LRU order and hit/miss counters are saved."""
+
+BLOCK_FIELDS = {"id", "file_id", "mime_type", "public_data", "url", "content_url"}
+"""The Block fields needed to hand a cached image Block back to a transport."""
+
+CACHE_TAG_KIND = "cache"
+CACHE_TAG_NAME = "image-cache"
+
+_IMAGE_CACHE_KEY = "image_cache"
+
+_CACHE_LOCK = threading.Lock()
+
+
+def normalize_image_prompt(prompt: str) -> str:
+    """Normalize a prompt so that trivially different renderings of it share a cache entry."""
+    return (
+        re.sub(r"\s+", " ", unicodedata.normalize("NFC", prompt or "")).strip().lower()
+    )
+
+
+def with_image_cache(image_cache: "ImageCache", context: AgentContext) -> AgentContext:
+    """Let the image tools run for `context` reuse images from `image_cache`."""
+    context.metadata[_IMAGE_CACHE_KEY] = image_cache
+    return context
+
+
+def get_image_cache(context: AgentContext) -> Optional["ImageCache"]:
+    """Retrieve the ImageCache set on `context` with `with_image_cache`, if any."""
+    return context.metadata.get(_IMAGE_CACHE_KEY)
+
+
+class ImageCache:
+    """A size-bounded, least-recently-used cache from Stable Diffusion prompts to up to `max_variants` images each.
+
+    Entries are keyed by a hash of the normalized prompt and the generator configuration, so changing any generator
+    setting never returns a stale image.
+    """
+
+    def __init__(
+        self,
+        store,
+        ttl_seconds: int = 86400,
+        max_entries: int = 500,
+        max_variants: int = 3,
+    ):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_variants = max_variants
+
+    @staticmethod
+    def key_for(
+        prompt: str,
+        generator_plugin_handle: str,
+        generator_plugin_config: Optional[dict] = None,
+    ) -> str:
+        """Return the content address for generating `prompt` with the given generator."""
+        material = json.dumps(
+            {
+                "prompt": normalize_image_prompt(prompt),
+                "generator": generator_plugin_handle,
+                "config": generator_plugin_config or {},
+            },
+            sort_keys=True,
+        )
+        return f"image-{hashlib.sha256(material.encode('utf-8')).hexdigest()}"
+
+    def _load_index(self) -> Dict[str, Any]:
+        index = self.store.get(INDEX_KEY) or {}
+        return {
+            "keys": index.get("keys", []),
+            "hits": index.get("hits", 0),
+            "misses": index.get("misses", 0),
+        }
+
+    def _entry(self, key: str, index: Dict[str, Any]) -> Dict[str, Any]:
+        """Return the unexpired variants cached for `key`, and how many times they have been served."""
+        entry = (self.store.get(key) if key in index["keys"] else None) or {}
+        now = time.time()
+        return {
+            "variants": [
+                variant
+                for variant in entry.get("variants", [])
+                if variant["created_at"] + self.ttl_seconds > now
+            ],
+            "served": entry.get("served", 0),
+        }
+
+    def get(self, key: str) -> Optional[Block]:
+        """Return the next cached image for `key`, or None if another variant should be generated.
+
+        Counts the hit or miss. The returned Block is tagged with the cache status (see `cache_tag`).
+        """
+        with _CACHE_LOCK:
+            index = self._load_index()
+            entry = self._entry(key, index)
+            if len(entry["variants"]) < self.max_variants:
+                index["misses"] += 1
+                self.store.set(INDEX_KEY, index)
+                return None
+
+            variant = entry["variants"][entry["served"] % len(entry["variants"])]
+            entry["served"] += 1
+            self.store.set(key, entry)
+            index["hits"] += 1
+            index["keys"].remove(key)
+            index["keys"].append(key)
+            self.store.set(INDEX_KEY, index)
+
+        block = Block.parse_obj(variant["block"])
+        block.tags = [self.cache_tag("HIT", time.time() - variant["created_at"])]
+        return block
+
+    def put(self, key: str, block: Block):
+        """Remember `block` as an image for `key`, evicting the least recently used prompts beyond `max_entries`."""
+        with _CACHE_LOCK:
+            index = self._load_index()
+            entry = self._entry(key, index)
+            entry["variants"].append(
+                {
+                    "block": block.dict(include=BLOCK_FIELDS, exclude_none=True),
+                    "created_at": time.time(),
+                }
+            )
+            entry["variants"] = entry["variants"][-self.max_variants :]
+            self.store.set(key, entry)
+            if key in index["keys"]:
+                index["keys"].remove(key)
+            index["keys"].append(key)
+            while len(index["keys"]) > self.max_entries:
+                self.store.delete(index["keys"].pop(0))
+            self.store.set(INDEX_KEY, index)
+
+    def cache_tag(self, status: str, age_seconds: float = 0) -> Tag:
+        """A tag carrying HTTP-style cache headers for an image: whether it came from the cache, and for how long it
+        may be reused."""
+        return Tag(
+            kind=CACHE_TAG_KIND,
+            name=CACHE_TAG_NAME,
+            value={
+                "X-Cache": status,
+                "Age": str(int(age_seconds)),
+                "Cache-Control": f"public, max-age={self.ttl_seconds}",
+            },
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the hit/miss counters and current size of the cache."""
+        index = self._load_index()
+        lookups = index["hits"] + index["misses"]
+        return {
+            "entries": len(index["keys"]),
+            "max_entries": self.max_entries,
+            "max_variants": self.max_variants,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": index["hits"],
+            "misses": index["misses"],
+            "hit_ratio": index["hits"] / lookups if lookups else 0.0,
+        }
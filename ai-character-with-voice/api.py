@@ -1,6 +1,16 @@
-from typing import List, Type
-
+import contextvars
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import TYPE_CHECKING, Iterator, List, Type
+
+from history_window import ConversationHistoryManager, ConversationHistoryMixin
+from lazy_mixins import add_lazy_mixin
 from pydantic import Field
+from request_coalescing import RequestCoalescer, RequestCoalescingMixin
+from speech_cache import SpeechCache
 from steamship import Block
 from steamship.agents.functional import FunctionsBasedAgent
 from steamship.agents.llms.openai import ChatOpenAI
@@ -13,11 +23,22 @@ from steamship.agents.mixins.transports.telegram import (
     TelegramTransport,
     TelegramTransportConfig,
 )
-from steamship.agents.schema import Agent, AgentContext, EmitFunc, Metadata, Tool
+from steamship.agents.schema import (
+    Action,
+    Agent,
+    AgentContext,
+    EmitFunc,
+    Metadata,
+    Tool,
+)
 from steamship.agents.service.agent_service import AgentService
 from steamship.agents.tools.image_generation.stable_diffusion import StableDiffusionTool
-from steamship.agents.tools.speech_generation import GenerateSpeechTool
-from steamship.invocable import Config
+from steamship.invocable import Config, get
+from steamship.utils.kv_store import KeyValueStore
+from tracing import JSONL_FORMAT, TracedLLM, Tracer, recent_traces, span, traced_emit
+
+if TYPE_CHECKING:
+    from steamship.agents.tools.speech_generation import GenerateSpeechTool
 
 SYSTEM_PROMPT = """You are Picard, captain of the Starship Enterprise.
 
@@ -57,7 +78,13 @@ class BasicAgentServiceWithPersonalityAndVoice(AgentService):
 
     """
 
-    USED_MIXIN_CLASSES = [SteamshipWidgetTransport, TelegramTransport, SlackTransport]
+    USED_MIXIN_CLASSES = [
+        SteamshipWidgetTransport,
+        TelegramTransport,
+        SlackTransport,
+        ConversationHistoryMixin,
+        RequestCoalescingMixin,
+    ]
     """USED_MIXIN_CLASSES tells Steamship what additional HTTP endpoints to register on your AgentService."""
 
     class BasicAgentServiceConfig(Config):
@@ -70,6 +97,36 @@ class BasicAgentServiceWithPersonalityAndVoice(AgentService):
             "pNInz6obpgDQGcFmaJgB",
             description="[Optional] ElevenLabs voice ID (default: Adam)",
         )
+        stream_speech: bool = Field(
+            False,
+            description="[Optional] Speak long replies sentence by sentence, sending the first audio as soon as it is ready. Each sentence is sent as a message of its own, so this suits the web widget better than Slack or Telegram.",
+        )
+        history_window_tokens: int = Field(
+            0,
+            description="How many tokens of the most recent conversation to send to the LLM with each message. 0 sends "
+            "none, as by default.",
+        )
+        history_summary_enabled: bool = Field(
+            True,
+            description="With a history window, summarize the conversation before it, in the background, and send the "
+            "summary with each message.",
+        )
+        request_coalescing_enabled: bool = Field(
+            True,
+            description="Run the agent only once for a Slack or Telegram message that is delivered more than once, such as when a webhook is retried.",
+        )
+        tracing_sample_rate: float = Field(
+            0.01,
+            description="The fraction of messages to trace: to time the planning steps, tools, LLM calls and replies (including speech generation), and count the LLM calls' tokens.",
+        )
+        trace_export_path: str = Field(
+            "",
+            description="[Optional] A file to append traces to. The most recent traces are also reported by /recent_traces.",
+        )
+        trace_export_format: str = Field(
+            JSONL_FORMAT,
+            description="How to export traces: `jsonl` for one JSON object per span, or `otlp` for one OpenTelemetry OTLP/JSON request per trace.",
+        )
 
     config: BasicAgentServiceConfig
     """The configuration block that users who create an instance of this agent will provide."""
@@ -77,6 +134,34 @@ class BasicAgentServiceWithPersonalityAndVoice(AgentService):
     tools: List[Tool]
     """The list of Tools that this agent is capable of using."""
 
+    history_manager: ConversationHistoryManager
+    """Chooses the part of each conversation to send to the LLM, and keeps conversations' summaries and token metrics."""
+
+    request_coalescer: RequestCoalescer
+    """Keeps retried deliveries of a Slack or Telegram message from running the agent again."""
+
+    tracer: Tracer
+    """Traces a sample of messages, timing the planner, tools, LLM calls and replies of each."""
+
+    SPEECH_MAX_WORKERS = 4
+    """Maximum number of text blocks from a single emit that are converted to speech concurrently."""
+
+    SPEECH_EMIT_DEADLINE_SECONDS = 30.0
+    """How long an emit waits for the speech of all its blocks, together, before sending those not ready as text.
+
+    The deadline is shared by the emit's blocks rather than given to each: it runs from when the emit starts generating
+    speech, so a block queued behind others (see SPEECH_MAX_WORKERS) has less than this to be generated in.
+    """
+
+    SPEECH_CACHE_MAX_ENTRIES = 500
+    """How many distinct phrases to remember generated speech for before evicting the least recently used."""
+
+    SPEECH_MIN_CHUNK_CHARS = 40
+    """When streaming speech, sentences shorter than this are merged with the next one to avoid tiny audio clips."""
+
+    speech_cache: SpeechCache
+    """Remembers generated speech so that repeated phrases aren't synthesized again."""
+
     @classmethod
     def config_cls(cls) -> Type[Config]:
         """Return the Configuration class so that Steamship can auto-generate a web UI upon agent creation time."""
@@ -100,7 +185,7 @@ class BasicAgentServiceWithPersonalityAndVoice(AgentService):
         # This agent's planner is responsible for making decisions about what to do for a given input.
         agent = FunctionsBasedAgent(
             tools=self.tools,
-            llm=ChatOpenAI(self.client, model_name="gpt-4"),
+            llm=TracedLLM(llm=ChatOpenAI(self.client, model_name="gpt-4")),
         )
 
         # Here is where we override the agent's prompt to set its personality. It is very important that
@@ -108,58 +193,273 @@ class BasicAgentServiceWithPersonalityAndVoice(AgentService):
         agent.PROMPT = SYSTEM_PROMPT
         self.set_default_agent(agent)
 
+        # Speech Cache Setup
+        # ------------------
+
+        # Generated audio is remembered in the workspace's KeyValueStore, keyed by the text and voice, so that
+        # greetings and catchphrases the character repeats are only synthesized once.
+        self.speech_cache = SpeechCache(
+            KeyValueStore(self.client, store_identifier="speech-cache"),
+            max_entries=self.SPEECH_CACHE_MAX_ENTRIES,
+            cache_key=f"{self.client.config.workspace_id}/speech-cache",
+        )
+
+        # Tracing Setup
+        # -------------
+
+        # A `tracing_sample_rate` fraction of messages are traced: each planning step, tool, LLM call (with its tokens)
+        # and reply, including the speech generated for it, is timed as a span of the message's trace.
+        # `/recent_traces` reports the most recent traces, which are also appended to `trace_export_path`, if it is
+        # set. See tracing.py.
+        self.tracer = Tracer(
+            type(self).__name__,
+            sample_rate=self.config.tracing_sample_rate,
+            export_path=self.config.trace_export_path,
+            export_format=self.config.trace_export_format,
+        )
+
+        # Conversation History Setup
+        # --------------------------
+
+        # By default the agent sends the LLM no earlier messages of the conversation. With `history_window_tokens` set,
+        # each message is sent with the most recent `history_window_tokens` tokens of the conversation, and a summary
+        # of everything before them, which is brought up to date in the background by the `/summarize_history`
+        # endpoint. `/history_stats` reports how many tokens each conversation has sent, and how many more that is
+        # than without the window. See history_window.py.
+        self.history_manager = ConversationHistoryManager(
+            self,
+            window_tokens=self.config.history_window_tokens,
+            summary_enabled=self.config.history_summary_enabled,
+            baseline_selector=self.get_default_agent().message_selector,
+        )
+        if self.history_manager.enabled:
+            self.get_default_agent().message_selector = self.history_manager.selector()
+        self.add_mixin(ConversationHistoryMixin(self.history_manager))
+
+        # Request Coalescing Setup
+        # ------------------------
+
+        # Slack and Telegram deliver a message again when the agent is slow to respond. Runs of the agent are keyed by
+        # the message's id, so a retried delivery waits for or reuses the original run rather than answering twice.
+        # `/request_coalescing_stats` reports how many duplicate runs were avoided. See request_coalescing.py.
+        self.request_coalescer = RequestCoalescer(
+            self.client, enabled=self.config.request_coalescing_enabled
+        )
+        self.add_mixin(RequestCoalescingMixin(self.request_coalescer))
+
         # Communication Transport Setup
         # -----------------------------
 
+        # Each transport's endpoints are registered now, but the transport itself is only constructed when a request
+        # arrives on one of those endpoints. See lazy_mixins.py.
+
         # Support Steamship's web client
-        self.add_mixin(
-            SteamshipWidgetTransport(
+        add_lazy_mixin(
+            self,
+            SteamshipWidgetTransport,
+            lambda: SteamshipWidgetTransport(
                 client=self.client,
                 agent_service=self,
-            )
+            ),
         )
 
         # Support Slack
-        self.add_mixin(
-            SlackTransport(
+        add_lazy_mixin(
+            self,
+            SlackTransport,
+            lambda: SlackTransport(
                 client=self.client,
                 config=SlackTransportConfig(),
                 agent_service=self,
-            )
+            ),
         )
 
         # Support Telegram
-        self.add_mixin(
-            TelegramTransport(
+        add_lazy_mixin(
+            self,
+            TelegramTransport,
+            lambda: TelegramTransport(
                 client=self.client,
                 config=TelegramTransportConfig(
                     bot_token=self.config.telegram_bot_token
                 ),
                 agent_service=self,
-            )
+            ),
         )
 
+    def to_speech(
+        self, block: Block, speech: "GenerateSpeechTool", context: AgentContext
+    ) -> Block:
+        """Convert a text block to speech, reusing previously generated audio for the same text and voice."""
+        key = SpeechCache.key_for(
+            block.text,
+            self.config.eleven_labs_voice_id,
+            speech.generator_plugin_handle,
+            speech.generator_plugin_config,
+        )
+        with span(
+            "Tool.run", tool=speech.name, characters=len(block.text or "")
+        ) as generation:
+            cached_block = self.speech_cache.get(key)
+            generation.set(cached=cached_block is not None)
+            if cached_block is not None:
+                return cached_block
+
+            audio_block = speech.run([block], context)[0]
+            self.speech_cache.put(key, audio_block)
+            return audio_block
+
+    def split_into_sentences(self, block: Block) -> List[Block]:
+        """Split a text block into sentence-sized text blocks suitable for streaming speech."""
+        sentences = [
+            sentence
+            for sentence in re.split(r"(?<=[.!?])\s+|\n\s*\n", block.text or "")
+            if sentence.strip()
+        ]
+        chunks = []
+        for sentence in sentences:
+            if chunks and len(chunks[-1]) < self.SPEECH_MIN_CHUNK_CHARS:
+                chunks[-1] = f"{chunks[-1]} {sentence}"
+            else:
+                chunks.append(sentence)
+        return [Block(text=chunk) for chunk in chunks] or [block]
+
+    def to_speech_in_order(
+        self, blocks: List[Block], speech: "GenerateSpeechTool", context: AgentContext
+    ) -> Iterator[Block]:
+        """Convert every text block to speech concurrently, yielding results in the original block order.
+
+        Each block is yielded as soon as it and all blocks before it are ready, so callers can start sending audio
+        while later blocks are still being generated. Any block whose speech isn't ready by the deadline,
+        SPEECH_EMIT_DEADLINE_SECONDS after the first block starts, is yielded as its original text instead.
+        """
+        text_indices = [i for i, block in enumerate(blocks) if block.is_text()]
+        if not text_indices:
+            yield from blocks
+            return
+
+        executor = ThreadPoolExecutor(
+            max_workers=min(self.SPEECH_MAX_WORKERS, len(text_indices))
+        )
+        # Each block is converted in a copy of this thread's context, so that its span joins the turn's trace.
+        futures = {
+            i: executor.submit(
+                contextvars.copy_context().run,
+                self.to_speech,
+                blocks[i],
+                speech,
+                context,
+            )
+            for i in text_indices
+        }
+        deadline = time.monotonic() + self.SPEECH_EMIT_DEADLINE_SECONDS
+        try:
+            for i, block in enumerate(blocks):
+                if i not in futures:
+                    yield block
+                    continue
+                try:
+                    remaining = max(0.0, deadline - time.monotonic())
+                    block = futures[i].result(timeout=remaining)
+                except FutureTimeoutError:
+                    logging.warning(
+                        f"Speech generation for block {i} wasn't ready by the emit's deadline of "
+                        f"{self.SPEECH_EMIT_DEADLINE_SECONDS}s. Sending text instead."
+                    )
+                yield block
+        finally:
+            # Don't hold the reply on speech we've given up waiting for.
+            for future in futures.values():
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def to_speech_in_parallel(
+        self, blocks: List[Block], speech: "GenerateSpeechTool", context: AgentContext
+    ) -> List[Block]:
+        """Convert every text block to speech concurrently, keeping the original block order.
+
+        Multi-block replies wait on the slowest block rather than the sum of all of them.
+        """
+        return list(self.to_speech_in_order(blocks, speech, context))
+
     def run_agent(self, agent: Agent, context: AgentContext):
-        """Override run-agent to patch in audio generation as a finishing step for text output."""
+        """Run the agent with speech, unless the message is a duplicate delivery of one it has already run for."""
+        return self.request_coalescer.run(
+            context, lambda: self.run_agent_with_speech(agent, context)
+        )
 
-        speech = GenerateSpeechTool()
-        speech.generator_plugin_config = {"voice_id": self.config.eleven_labs_voice_id}
+    def run_agent_with_speech(self, agent: Agent, context: AgentContext):
+        """Override run-agent to patch in audio generation as a finishing step for text output.
+
+        A sample of runs are traced, with the speech generated for each emit in the emit's span.
+        """
 
-        def to_speech_if_text(block: Block):
-            nonlocal speech
-            if not block.is_text():
-                return block
+        # Deferred so that requests which never run the agent don't import the speech tool.
+        from steamship.agents.tools.speech_generation import GenerateSpeechTool
 
-            output_blocks = speech.run([block], context)
-            return output_blocks[0]
+        speech = GenerateSpeechTool()
+        speech.generator_plugin_config = {"voice_id": self.config.eleven_labs_voice_id}
+        started_at = time.monotonic()
+
+        def record_time_to_first_audio(blocks: List[Block]):
+            """Record how long the first audio took, once a block of it is sent (rather than text it fell back to)."""
+            if "time_to_first_audio_seconds" not in context.metadata and any(
+                block.is_audio() for block in blocks
+            ):
+                context.metadata["time_to_first_audio_seconds"] = (
+                    time.monotonic() - started_at
+                )
+                logging.info(
+                    f"Time to first audio: {context.metadata['time_to_first_audio_seconds']:.2f}s"
+                )
 
         # Note: EmitFunc is Callable[[List[Block], Metadata], None]
         def wrap_emit(emit_func: EmitFunc):
             def wrapper(blocks: List[Block], metadata: Metadata):
-                blocks = [to_speech_if_text(block) for block in blocks]
-                return emit_func(blocks, metadata)
+                if not self.config.stream_speech:
+                    blocks = self.to_speech_in_parallel(blocks, speech, context)
+                    record_time_to_first_audio(blocks)
+                    return emit_func(blocks, metadata)
+
+                # Stream the reply one sentence at a time so the user hears the first sentence while the rest
+                # are still being generated.
+                chunks = [
+                    chunk
+                    for block in blocks
+                    for chunk in (
+                        self.split_into_sentences(block) if block.is_text() else [block]
+                    )
+                ]
+                for chunk in self.to_speech_in_order(chunks, speech, context):
+                    record_time_to_first_audio([chunk])
+                    emit_func([chunk], metadata)
 
             return wrapper
 
         context.emit_funcs = [wrap_emit(emit_func) for emit_func in context.emit_funcs]
-        super().run_agent(agent, context)
+        with self.tracer.trace() as trace:
+            if trace.recording:
+                context.emit_funcs = [traced_emit(f) for f in context.emit_funcs]
+            super().run_agent(agent, context)
+
+    def next_action(
+        self, agent: Agent, input_blocks: List[Block], context: AgentContext
+    ) -> Action:
+        with span("next_action", step=len(context.completed_steps)) as step:
+            action = super().next_action(agent, input_blocks, context)
+            step.set(tool=action.tool)
+            return action
+
+    def run_action(self, agent: Agent, action: Action, context: AgentContext):
+        with span("Tool.run", tool=action.tool):
+            super().run_action(agent, action, context)
+
+    @get("/recent_traces")
+    def recent_traces(self, export_format: str = JSONL_FORMAT) -> dict:
+        """Return the most recent traces of this process, as JSON lines' spans or OpenTelemetry OTLP/JSON requests."""
+        return {"traces": recent_traces(export_format)}
+
+    @get("/speech_cache_stats")
+    def speech_cache_stats(self) -> dict:
+        """Return hit/miss counters for the generated speech cache."""
+        return self.speech_cache.stats()
@@ -0,0 +1,328 @@
+"""Send the LLM a window of the conversation's recent messages, within a budget of tokens, and a summary of the rest.
+
+FunctionsBasedAgent sends earlier messages of the conversation along with each new one, as chosen by its message
+selector. The SDK's default selector, NoMessages, sends none (besides the few the agent finds by semantic search when
+the history is searchable), so the agent doesn't remember what was just said. The HistoryWindowSelector sends the most
+recent messages that fit in `window_tokens`, preceded by a summary of the messages before them, so that the agent can
+follow the conversation while each turn's cost stays bounded.
+
+This adds tokens to every LLM call, compared with the default selector, and a background LLM call to summarize every
+few messages, so it is opt-in: a window of 0 tokens leaves the agent's selector as it was. Metrics compare the tokens
+sent with what the replaced selector would have sent.
+
+Summaries are updated incrementally, and never on the request path: once enough messages have fallen out of the window,
+the ConversationHistoryMixin's `/summarize_history` endpoint is scheduled to fold them into the summary. Until it has
+run, those messages are left out of the history sent to the LLM.
+"""
+import logging
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from steamship import Block, File
+from steamship.agents.llms import OpenAI
+from steamship.agents.schema import LLM
+from steamship.agents.schema.message_selectors import (
+    MessageSelector,
+    NoMessages,
+    is_assistant_message,
+    is_user_message,
+)
+from steamship.data.tags.tag_constants import RoleTag
+from steamship.invocable import PackageService, get, post
+from steamship.invocable.package_mixin import PackageMixin
+from steamship.utils.kv_store import KeyValueStore
+
+HISTORY_STORE_IDENTIFIER = "conversation-history"
+
+_WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def count_tokens(text: str) -> int:
+    """Count the tokens in `text` with tiktoken, or estimate them if its vocabulary can't be downloaded."""
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            try:
+                import tiktoken
+
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                logging.warning(f"Token counts will be estimated: {e}")
+            _encoding_loaded = True
+    if _encoding is not None:
+        return len(_encoding.encode(text or "", disallowed_special=()))
+    return max(len(_WORD_PATTERN.findall(text or "")), len(text or "") // 4)
+
+
+def conversation_messages(messages: List[Block]) -> List[Block]:
+    """The user and assistant messages of a chat history."""
+    return [
+        message
+        for message in messages
+        if is_user_message(message) or is_assistant_message(message)
+    ]
+
+
+class ConversationHistoryManager:
+    """Chooses the window of each conversation to send to the LLM, and keeps its summary and token metrics.
+
+    Conversations are identified by the id of their ChatHistory file. For each, `HISTORY_STORE_IDENTIFIER` holds a
+    summary of its first `summarized_count` messages, and counters of how many tokens were sent, and how many
+    `baseline_selector` (the selector the window replaces) would have sent instead.
+    """
+
+    SUMMARIZE_AFTER_MESSAGES = 4
+    """How many messages must have fallen out of the window, unsummarized, before a summary is scheduled."""
+
+    SUMMARY_MAX_TOKENS = 256
+
+    SUMMARY_PROMPT = """Below is a summary of a conversation between a user and an assistant, followed by the messages that came after it.
+
+Rewrite the summary so that it also covers the new messages, in at most {max_words} words. Keep names, facts, preferences and requests the assistant may need to refer back to, and leave out small talk.
+
+SUMMARY:
+{summary}
+
+NEW MESSAGES:
+{messages}
+
+UPDATED SUMMARY:"""
+
+    def __init__(
+        self,
+        service: PackageService,
+        window_tokens: int,
+        summary_enabled: bool = True,
+        llm_factory: Optional[Callable[[], LLM]] = None,
+        baseline_selector: Optional[MessageSelector] = None,
+    ):
+        self.service = service
+        self.window_tokens = window_tokens
+        self.summary_enabled = summary_enabled
+        self.baseline_selector = baseline_selector or NoMessages()
+        self.llm_factory = llm_factory or (
+            lambda: OpenAI(self.service.client, max_tokens=self.SUMMARY_MAX_TOKENS)
+        )
+        self._store: Optional[KeyValueStore] = None
+        self._recorded: Dict[str, int] = {}
+        """The conversation length at which each conversation's metrics were last recorded by this process."""
+
+        self._scheduled: Dict[str, int] = {}
+        """How far each conversation had fallen out of the window when this process last scheduled its summary."""
+
+    @property
+    def store(self) -> KeyValueStore:
+        if self._store is None:
+            self._store = KeyValueStore(
+                self.service.client, store_identifier=HISTORY_STORE_IDENTIFIER
+            )
+        return self._store
+
+    @property
+    def enabled(self) -> bool:
+        """Whether there is a window to send; with none, the agent keeps its own selector."""
+        return self.window_tokens > 0
+
+    def selector(self) -> "HistoryWindowSelector":
+        """A message selector for FunctionsBasedAgent that selects with this manager."""
+        return HistoryWindowSelector(manager=self)
+
+    def _load(self, file_id: str) -> Tuple[dict, dict]:
+        """Return the summary and the metrics of a conversation, with one read of the store."""
+        entries = dict(
+            self.store.items(filter_keys=[f"summary:{file_id}", f"metrics:{file_id}"])
+        )
+        return (
+            entries.get(f"summary:{file_id}") or {},
+            entries.get(f"metrics:{file_id}") or {},
+        )
+
+    def window_start(self, conversation: List[Block], summarized_count: int) -> int:
+        """Return the index of the first message of `conversation` to send, counting back from the newest.
+
+        Messages already summarized are never sent.
+        """
+        tokens, start = 0, len(conversation)
+        while start > summarized_count:
+            message_tokens = count_tokens(conversation[start - 1].text)
+            if tokens + message_tokens > self.window_tokens:
+                break
+            tokens += message_tokens
+            start -= 1
+        return start
+
+    def select(self, messages: List[Block]) -> List[Block]:
+        """Select the summary and the window of recent messages to send to the LLM with the newest message.
+
+        Like the SDK's selectors, this leaves out the newest message itself, which the agent adds after the history.
+        """
+        conversation = conversation_messages(messages[:-1])
+        if not conversation:
+            return []
+        file_id = conversation[0].file_id
+        summary, metrics = self._load(file_id)
+        summarized_count = min(summary.get("summarized_count", 0), len(conversation))
+        if not self.summary_enabled:
+            summary, summarized_count = {}, 0
+        start = self.window_start(conversation, summarized_count)
+
+        selected = conversation[start:]
+        if summary.get("text"):
+            summary_block = Block(
+                text=f"Summary of the conversation so far: {summary['text']}"
+            )
+            summary_block.set_chat_role(RoleTag.SYSTEM)
+            selected = [summary_block] + selected
+
+        self._record(file_id, messages, conversation, selected, metrics)
+        if (
+            self.summary_enabled
+            and start - summarized_count >= self.SUMMARIZE_AFTER_MESSAGES
+        ):
+            self.schedule_summary(file_id, start)
+        return selected
+
+    def _record(
+        self,
+        file_id: str,
+        messages: List[Block],
+        conversation: List[Block],
+        selected: List[Block],
+        metrics: dict,
+    ):
+        """Count the tokens of this turn, and those the baseline selector would have sent, once per turn."""
+        if self._recorded.get(file_id) == len(conversation):
+            return
+        self._recorded[file_id] = len(conversation)
+
+        counted = min(metrics.get("messages", 0), len(conversation))
+        history_tokens = metrics.get("history_tokens", 0) + sum(
+            count_tokens(message.text) for message in conversation[counted:]
+        )
+        sent_tokens = sum(count_tokens(message.text) for message in selected)
+        baseline_tokens = sum(
+            count_tokens(message.text)
+            for message in self.baseline_selector.get_messages(messages)
+        )
+        metrics = {
+            "turns": metrics.get("turns", 0) + 1,
+            "messages": len(conversation),
+            "history_tokens": history_tokens,
+            "last_turn_tokens_sent": sent_tokens,
+            "tokens_sent": metrics.get("tokens_sent", 0) + sent_tokens,
+            "baseline_tokens_sent": metrics.get("baseline_tokens_sent", 0)
+            + baseline_tokens,
+        }
+        self.store.set(f"metrics:{file_id}", metrics)
+        logging.info(
+            f"Sending {sent_tokens} of {history_tokens} tokens of conversation history for {file_id}, against "
+            f"{baseline_tokens} without the window",
+            extra={"conversation_history": {"file_id": file_id, **metrics}},
+        )
+
+    def schedule_summary(self, file_id: str, window_start: int):
+        """Arrange for `summarize` to run for a conversation after this request, unless it already has been."""
+        if self._scheduled.get(file_id, -1) >= window_start:
+            return
+        self._scheduled[file_id] = window_start
+        context = self.service.context
+        if context is not None and context.invocable_instance_handle is not None:
+            self.service.invoke_later(
+                "summarize_history", arguments={"file_id": file_id}
+            )
+        else:
+            # Outside a deployed instance (e.g. when running locally), there is no task queue to schedule on.
+            threading.Thread(
+                target=self.summarize, args=(file_id,), daemon=True
+            ).start()
+
+    def summarize(self, file_id: str) -> dict:
+        """Fold the messages of a conversation that have fallen out of the window into its summary."""
+        conversation = conversation_messages(
+            File.get(self.service.client, _id=file_id).blocks
+        )
+        summary, _ = self._load(file_id)
+        summarized_count = min(summary.get("summarized_count", 0), len(conversation))
+        start = self.window_start(conversation, summarized_count)
+        if start == summarized_count:
+            return summary
+
+        transcript = "\n".join(
+            f"{'User' if is_user_message(message) else 'Assistant'}: {message.text}"
+            for message in conversation[summarized_count:start]
+        )
+        prompt = self.SUMMARY_PROMPT.format(
+            max_words=self.SUMMARY_MAX_TOKENS * 3 // 4,
+            summary=summary.get("text") or "(none yet)",
+            messages=transcript,
+        )
+        text = self.llm_factory().complete(prompt)[0].text.strip()
+        summary = {
+            "text": text,
+            "summarized_count": start,
+            "tokens": count_tokens(text),
+        }
+        self.store.set(f"summary:{file_id}", summary)
+        return summary
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the token metrics and summary size of each conversation, and totals across them.
+
+        `tokens_added` is how many more tokens of history the window sent than the baseline selector would have.
+        """
+        entries = dict(self.store.items())
+        conversations = {}
+        for key, metrics in entries.items():
+            if key.startswith("metrics:"):
+                file_id = key[len("metrics:") :]
+                summary = entries.get(f"summary:{file_id}") or {}
+                conversations[file_id] = {
+                    "baseline_tokens_sent": 0,
+                    **metrics,
+                    "summarized_messages": summary.get("summarized_count", 0),
+                    "summary_tokens": summary.get("tokens", 0),
+                }
+        tokens_sent = sum(c["tokens_sent"] for c in conversations.values())
+        baseline_tokens_sent = sum(
+            c["baseline_tokens_sent"] for c in conversations.values()
+        )
+        return {
+            "window_tokens": self.window_tokens,
+            "summary_enabled": self.summary_enabled,
+            "baseline_selector": type(self.baseline_selector).__name__,
+            "tokens_sent": tokens_sent,
+            "baseline_tokens_sent": baseline_tokens_sent,
+            "tokens_added": tokens_sent - baseline_tokens_sent,
+            "conversations": conversations,
+        }
+
+
+class HistoryWindowSelector(MessageSelector):
+    """Selects the window of recent messages and the summary chosen by a ConversationHistoryManager."""
+
+    manager: Any
+
+    def get_messages(self, messages: List[Block]) -> List[Block]:
+        return self.manager.select(messages)
+
+
+class ConversationHistoryMixin(PackageMixin):
+    """Provides the endpoint that summarizes conversations in the background, and one that reports token metrics."""
+
+    def __init__(self, manager: ConversationHistoryManager):
+        self.manager = manager
+
+    @post("summarize_history")
+    def summarize_history(self, file_id: str) -> dict:
+        """Fold the messages of a conversation that have fallen out of the history window into its summary."""
+        return self.manager.summarize(file_id)
+
+    @get("history_stats")
+    def history_stats(self) -> dict:
+        """Return how many tokens of conversation history were sent to the LLM, and how many more than without the window."""
+        return self.manager.stats()
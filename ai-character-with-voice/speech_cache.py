@@ -0,0 +1,186 @@
+"""Content-addressed cache for generated speech.
+
+Characters tend to repeat themselves: greetings, refusals and catchphrases come up again and again. Rather than paying
+for a new ElevenLabs generation each time, we remember the audio Block produced for a given piece of text and hand it
+back the next time the same text is spoken with the same voice.
+
+The cache stores Block references (not audio bytes) in any store that offers the `get` / `set` / `delete` / `items`
+methods of Steamship's KeyValueStore. `LocalKeyValueStore` provides the same methods on top of a JSON file so that the cache can be
+exercised without a Steamship workspace.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, List, Optional, Tuple
+
+from steamship import Block
+
+INDEX_KEY = "__speech-cache-index__"
+"""The store key under which the cached keys, least recently used first, are saved."""
+
+BLOCK_FIELDS = {"id", "file_id", "mime_type", "public_data", "url", "content_url"}
+"""The Block fields needed to hand a cached audio Block back to a transport."""
+
+
+_COUNTERS: Dict[str, Dict[str, int]] = {}
+_HITS: Dict[str, Dict[str, float]] = {}
+_LOCK = threading.Lock()
+
+
+def normalize_speech_text(text: str) -> str:
+    """Normalize text so that trivially different renderings of the same phrase share a cache entry."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text or "")).strip()
+
+
+class LocalKeyValueStore:
+    """A KeyValueStore look-alike that keeps its entries in a JSON file on local disk.
+
+    Useful for developing and testing offline. Each write rewrites the whole file, so it is not meant for large data.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def _save(self, data: Dict[str, Dict[str, Any]]):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Get the value represented by `key`."""
+        return self._load().get(key)
+
+    def delete(self, key: str) -> bool:
+        """Delete the entry represented by `key`"""
+        data = self._load()
+        if key not in data:
+            return False
+        del data[key]
+        self._save(data)
+        return True
+
+    def set(self, key: str, value: Dict[str, Any]):
+        """Set the entry (key, value)."""
+        data = self._load()
+        data[key] = value
+        self._save(data)
+
+    def items(
+        self, filter_keys: Optional[List[str]] = None
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        """Return all key-value entries as a list of (key, value) tuples."""
+        return [
+            (key, value)
+            for key, value in self._load().items()
+            if filter_keys is None or key in filter_keys
+        ]
+
+    def reset(self):
+        """Delete all key-values."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class SpeechCache:
+    """A size-bounded cache from spoken text to generated audio Blocks, which evicts the least recently used.
+
+    Entries are keyed by a hash of the normalized text, the voice, and the generator configuration, so changing
+    the voice or any generator setting never returns stale audio.
+
+    Each entry is stored under its own key, and an index entry keeps the keys in least recently used order, so that
+    the cache's size and what to evict are known without reading every entry. A lookup is a single read of its entry.
+    Hits are remembered in the process, and moved to the end of the LRU order by the process's next `put`, which
+    writes the index anyway, so that a hit costs no write. Hit and miss counters are kept per process. The process lock
+    only guards that local state, never a call to the store, so speech workers don't wait on each other's lookups.
+    """
+
+    def __init__(self, store, max_entries: int = 500, cache_key: Optional[str] = None):
+        self.store = store
+        self.max_entries = max_entries
+        self.cache_key = cache_key or str(getattr(store, "store_identifier", id(store)))
+        """Names this cache's counters and hits in the process, so that they outlive the service instance."""
+
+    @staticmethod
+    def key_for(
+        text: str,
+        voice_id: str,
+        generator_plugin_handle: str,
+        generator_plugin_config: Optional[dict] = None,
+    ) -> str:
+        """Return the content address for speaking `text` with the given voice and generator."""
+        material = json.dumps(
+            {
+                "text": normalize_speech_text(text),
+                "voice_id": voice_id,
+                "generator": generator_plugin_handle,
+                "config": generator_plugin_config or {},
+            },
+            sort_keys=True,
+        )
+        return f"speech-v2-{hashlib.sha256(material.encode('utf-8')).hexdigest()}"
+
+    def _count(self, counter: str):
+        with _LOCK:
+            counters = _COUNTERS.setdefault(self.cache_key, {"hits": 0, "misses": 0})
+            counters[counter] += 1
+
+    def _load_index(self) -> Dict[str, Any]:
+        """Read the index. A store written before it was kept is indexed from its entries, oldest first."""
+        entries = dict(self.store.items(filter_keys=[INDEX_KEY]))
+        if INDEX_KEY in entries:
+            return {"keys": entries[INDEX_KEY].get("keys", [])}
+        entries = sorted(
+            self.store.items(), key=lambda item: item[1].get("used_at", 0.0)
+        )
+        return {"keys": [key for key, _ in entries]}
+
+    def get(self, key: str) -> Optional[Block]:
+        """Return the cached audio Block for `key`, or None on a miss. Counts the hit or miss."""
+        entry = self.store.get(key)
+        if entry is None:
+            self._count("misses")
+            return None
+        self._count("hits")
+        with _LOCK:
+            _HITS.setdefault(self.cache_key, {})[key] = time.time()
+        return Block.parse_obj(entry["block"])
+
+    def put(self, key: str, block: Block):
+        """Remember `block` as the audio for `key`, evicting the least recently used entries beyond `max_entries`."""
+        self.store.set(
+            key, {"block": block.dict(include=BLOCK_FIELDS, exclude_none=True)}
+        )
+        index = self._load_index()
+        with _LOCK:
+            hits = _HITS.pop(self.cache_key, {})
+        cached = set(index["keys"])
+        used = [hit for hit in sorted(hits, key=hits.get) if hit in cached] + [key]
+        index["keys"] = [k for k in index["keys"] if k not in used] + used
+        while len(index["keys"]) > self.max_entries:
+            self.store.delete(index["keys"].pop(0))
+        self.store.set(INDEX_KEY, index)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return this process's hit/miss counters, and the current size of the cache."""
+        with _LOCK:
+            counters = dict(_COUNTERS.get(self.cache_key) or {"hits": 0, "misses": 0})
+        lookups = counters["hits"] + counters["misses"]
+        index = dict(self.store.items(filter_keys=[INDEX_KEY])).get(INDEX_KEY) or {}
+        return {
+            "entries": len(index.get("keys", [])),
+            "max_entries": self.max_entries,
+            "hits": counters["hits"],
+            "misses": counters["misses"],
+            "hit_rate": counters["hits"] / lookups if lookups else 0.0,
+        }
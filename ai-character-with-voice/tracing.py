@@ -0,0 +1,315 @@
+"""Time each turn of the agent as a tree of spans, so that a slow turn shows where its time went.
+
+A sampled turn is traced with a root span for the run of the agent, and spans beneath it for:
+
+- next_action: each planning step, including the planner's LLM call
+- Tool.run: each tool the agent runs (and each speech generation of the voice example), including the tool's LLM calls
+- llm.chat and llm.complete: each LLM call, with its model and its prompt and completion token counts
+- emit: each call of an emit function, including any work it does on the reply, such as generating speech
+
+Whether a turn is traced is decided when it starts, with probability `sample_rate`. In a turn that isn't traced, `span`
+returns a shared no-op span, so tracing costs a context variable lookup per instrumented call. The current span is kept
+in a context variable rather than on the AgentContext, since LLMs aren't given the AgentContext. Work handed to another
+thread joins the trace only if it runs in a copy of the caller's context (`contextvars.copy_context().run`).
+
+The most recent RECENT_TRACES_MAX traces are kept in memory for `recent_traces`. If the Tracer has an export path, each
+trace is also appended to it, in one of two formats:
+
+- JSONL_FORMAT: one JSON object per span
+- OTLP_FORMAT: one OpenTelemetry OTLP/JSON ExportTraceServiceRequest per trace, one per line, as read by the
+  OpenTelemetry Collector's `otlpjsonfile` receiver
+"""
+import contextvars
+import functools
+import json
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from history_window import count_tokens
+from steamship import Block
+from steamship.agents.schema import LLM, ChatLLM, EmitFunc, Metadata, Tool
+
+JSONL_FORMAT = "jsonl"
+OTLP_FORMAT = "otlp"
+EXPORT_FORMATS = (JSONL_FORMAT, OTLP_FORMAT)
+
+RECENT_TRACES_MAX = 50
+
+_CURRENT_SPAN: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+_RECENT_TRACES: Deque["Trace"] = deque(maxlen=RECENT_TRACES_MAX)
+_EXPORT_LOCK = threading.Lock()
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class Trace:
+    """The spans of one turn, which are exported with `export` when its root span ends."""
+
+    def __init__(self, service_name: str, export: Callable[["Trace"], None]):
+        self.trace_id = _new_id(128)
+        self.service_name = service_name
+        self.spans: List[Span] = []
+        self.finished = False
+        self._export = export
+        self._lock = threading.Lock()
+
+    def add(self, span: "Span"):
+        """Add a span that has ended. Spans that end after the turn (such as a discarded rewrite's) are dropped."""
+        with self._lock:
+            if not self.finished:
+                self.spans.append(span)
+
+    def finish(self):
+        with self._lock:
+            self.finished = True
+        self._export(self)
+
+
+class Span:
+    """A timed step of a traced turn, with attributes such as the tool's name or the tokens of an LLM call.
+
+    Use as a context manager: the span is the current span, and the parent of spans opened, until the block ends.
+    """
+
+    recording = True
+
+    def __init__(
+        self,
+        trace: Trace,
+        name: str,
+        parent_id: Optional[str],
+        attributes: Dict[str, Any],
+    ):
+        self.trace = trace
+        self.name = name
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = 0
+        self.end_ns = 0
+        self._token: Optional[contextvars.Token] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self) -> "Span":
+        self._token = _CURRENT_SPAN.set(self)
+        self.start_ns = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        self.end_ns = time.time_ns()
+        _CURRENT_SPAN.reset(self._token)
+        if exc_value is not None:
+            self.attributes["error"] = repr(exc_value)
+        self.trace.add(self)
+        if self.parent_id is None:
+            self.trace.finish()
+        return False
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "service": self.trace.service_name,
+            "start_time_unix_nano": self.start_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+        }
+
+
+class _NoSpan:
+    """The span of a turn that isn't traced: does nothing."""
+
+    recording = False
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self) -> "_NoSpan":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+def span(name: str, **attributes):
+    """Open a span named `name` beneath the current span, or return NO_SPAN if the turn isn't traced."""
+    parent = _CURRENT_SPAN.get()
+    if parent is None:
+        return NO_SPAN
+    return Span(parent.trace, name, parent.span_id, attributes)
+
+
+def traced_emit(emit_func: EmitFunc) -> EmitFunc:
+    """Wrap an emit function so that each call of it is an `emit` span.
+
+    The wrapper keeps the emit function's `__module__` and `__name__`, which image_jobs.push_target reads to tell which
+    transport a reply goes to.
+    """
+
+    @functools.wraps(emit_func)
+    def emit(blocks: List[Block], metadata: Metadata):
+        with span("emit", blocks=len(blocks)):
+            return emit_func(blocks, metadata)
+
+    return emit
+
+
+def _model_name(llm: Any) -> str:
+    return getattr(llm, "model_name", None) or type(llm).__name__
+
+
+def _text(blocks: List[Block]) -> str:
+    return "\n".join(block.text or "" for block in blocks)
+
+
+class TracedLLM(ChatLLM, LLM):
+    """Wraps an LLM (or ChatLLM) so that each call of it is an `llm.complete` (or `llm.chat`) span."""
+
+    llm: Any
+
+    def complete(
+        self, prompt: str, stop: Optional[str] = None, **kwargs
+    ) -> List[Block]:
+        with span("llm.complete", model=_model_name(self.llm)) as call:
+            blocks = self.llm.complete(prompt, stop=stop, **kwargs)
+            if call.recording:
+                call.set(
+                    prompt_tokens=count_tokens(prompt),
+                    completion_tokens=count_tokens(_text(blocks)),
+                )
+            return blocks
+
+    def chat(
+        self, messages: List[Block], tools: Optional[List[Tool]], **kwargs
+    ) -> List[Block]:
+        with span("llm.chat", model=_model_name(self.llm)) as call:
+            blocks = self.llm.chat(messages, tools, **kwargs)
+            if call.recording:
+                call.set(
+                    prompt_tokens=count_tokens(_text(messages)),
+                    completion_tokens=count_tokens(_text(blocks)),
+                )
+            return blocks
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        {"key": key, "value": _otlp_value(value)}
+        for key, value in attributes.items()
+        if value is not None
+    ]
+
+
+def to_otlp(trace: Trace) -> Dict[str, Any]:
+    """Return `trace` as an OTLP/JSON ExportTraceServiceRequest."""
+    spans = []
+    for traced in trace.spans:
+        otlp_span = {
+            "traceId": trace.trace_id,
+            "spanId": traced.span_id,
+            "parentSpanId": traced.parent_id or "",
+            "name": traced.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(traced.start_ns),
+            "endTimeUnixNano": str(traced.end_ns),
+            "attributes": _otlp_attributes(traced.attributes),
+        }
+        if "error" in traced.attributes:
+            otlp_span["status"] = {"code": 2, "message": traced.attributes["error"]}
+        spans.append(otlp_span)
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": _otlp_attributes({"service.name": trace.service_name})
+                },
+                "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}],
+            }
+        ]
+    }
+
+
+def to_json_lines(trace: Trace) -> List[Dict[str, Any]]:
+    """Return the spans of `trace` as JSON objects, in the order they ended."""
+    return [traced.to_dict() for traced in trace.spans]
+
+
+def recent_traces(export_format: str = JSONL_FORMAT) -> List[Any]:
+    """Return the most recent traces of this process, oldest first, each as `to_json_lines` or `to_otlp` would."""
+    with _EXPORT_LOCK:
+        traces = list(_RECENT_TRACES)
+    if export_format == OTLP_FORMAT:
+        return [to_otlp(trace) for trace in traces]
+    return [to_json_lines(trace) for trace in traces]
+
+
+class Tracer:
+    """Traces a `sample_rate` fraction of turns, and exports them to `export_path` (if set) in `export_format`."""
+
+    def __init__(
+        self,
+        service_name: str,
+        sample_rate: float = 0.0,
+        export_path: str = "",
+        export_format: str = JSONL_FORMAT,
+    ):
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(
+                f"Unknown trace export format {export_format!r}; use one of {EXPORT_FORMATS}"
+            )
+        self.service_name = service_name
+        self.sample_rate = sample_rate
+        self.export_path = export_path
+        self.export_format = export_format
+
+    def trace(self, name: str = "run_agent", **attributes):
+        """Open the root span of a turn, if the turn is sampled, or return NO_SPAN.
+
+        A turn that is already being traced (such as a run of the agent from within another) isn't traced again.
+        """
+        if _CURRENT_SPAN.get() is not None or random.random() >= self.sample_rate:
+            return NO_SPAN
+        return Span(Trace(self.service_name, self.export), name, None, attributes)
+
+    def export(self, trace: Trace):
+        """Keep `trace` as one of the recent traces, and append it to the export path, if there is one."""
+        with _EXPORT_LOCK:
+            _RECENT_TRACES.append(trace)
+            if not self.export_path:
+                return
+            if self.export_format == OTLP_FORMAT:
+                lines = [to_otlp(trace)]
+            else:
+                lines = to_json_lines(trace)
+            with open(self.export_path, "a") as f:
+                for line in lines:
+                    f.write(json.dumps(line) + "\n")
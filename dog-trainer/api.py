@@ -8,18 +8,47 @@ This AgentService provides an example of how a single agent can:
 Its intended behavior is to:
 
 1) Chat with you, in general, about your dogs.
-2) Accept, via API, a list of your dogs in the form: [{name, breed, description}]
+2) Accept, via API, a list of your dogs in the form: [{name, breed, description, aliases}]
 3) Answer questions about particular dog breeds using their name ("How much should Fido eat?")
 4) Generate simulated photos of your dogs using their name ("Show me a picture of Buster swimming in a lake")
 """
-import json
 import logging
-from typing import List, Optional, Type
+import uuid
+from typing import Dict, List, NamedTuple, Optional, Type
 
 from dog import Dog
 from dog_picture_tool import DogPictureTool
 from dog_question_tool import DogQuestionTool
+from dog_registry import DogRegistry
+from dog_roster import DogRoster
+from history_window import ConversationHistoryManager, ConversationHistoryMixin
+from image_cache import ImageCache, with_image_cache
+from image_jobs import ImageJobs, ImageJobsMixin, with_image_jobs
+from lazy_mixins import add_lazy_mixin
+from model_router import (
+    PLANNING_ROUTE,
+    REWRITE_ROUTE,
+    SMALL_TALK_ROUTE,
+    ModelRouter,
+    following_planned_turn,
+    model_routing_stats,
+    with_model_router,
+)
+from parallel_actions import (
+    ConcurrentActionExecutor,
+    ParallelAction,
+    ParallelFunctionsOutputParser,
+    with_held_final_output,
+)
 from pydantic.main import BaseModel, Field
+from request_coalescing import RequestCoalescer, RequestCoalescingMixin
+from speculation import (
+    PICTURE_REQUEST_PATTERN,
+    discard_unless_chosen,
+    get_speculative_rewrite,
+    speculation_stats,
+    start_speculative_rewrite,
+)
 from steamship import Block
 from steamship.agents.functional import FunctionsBasedAgent
 from steamship.agents.llms.openai import ChatOpenAI
@@ -35,8 +64,10 @@ from steamship.agents.mixins.transports.telegram import (
 from steamship.agents.schema import Action, Agent, AgentContext, Tool
 from steamship.agents.schema.action import FinishAction
 from steamship.agents.service.agent_service import AgentService
-from steamship.invocable import Config, post
+from steamship.data.tags.tag_constants import RoleTag
+from steamship.invocable import Config, get, post
 from steamship.utils.kv_store import KeyValueStore
+from tracing import JSONL_FORMAT, TracedLLM, Tracer, recent_traces, span, traced_emit
 
 DEFAULT_NAME = "Trainer"
 DEFAULT_BYLINE = "an expert dog trainer"
@@ -102,17 +133,85 @@ class DynamicPromptArguments(BaseModel):
     dogs: List[dict] = Field(
         default=None, description="List of dogs the AI dog trainer helps train."
     )
+    dog_roster: Optional[dict] = Field(
+        default=None,
+        description="The dogs, already serialized for prompts, with a version hash. See DogRoster.",
+    )
+    version: Optional[str] = Field(
+        default=None,
+        description="Changes every time the prompt arguments are set. Used to cache what is built from them.",
+    )
 
-    def to_system_prompt(self, dogs: List[Dog] = []) -> str:
+    def to_system_prompt(self, roster: Optional[DogRoster] = None) -> str:
         return SYSTEM_PROMPT.format(
             name=self.name,
             byline=self.byline,
             identity=self.identity,
             behavior=self.behavior,
-            dogs="\n".join([f"- {json.dumps(dog.dict())}" for dog in dogs]),
+            dogs=roster.bullets() if roster else "",
         )
 
 
+class PreparedPrompt(NamedTuple):
+    """Everything DogTrainer builds from a given version of its stored prompt arguments."""
+
+    version: Optional[str]
+    prompt_arguments: DynamicPromptArguments
+    dogs: List[Dog]
+    dog_registry: DogRegistry
+    tools: List[Tool]
+    system_prompt: str
+
+
+PREPARED_PROMPTS: Dict[str, PreparedPrompt] = {}
+"""Process-level cache of the latest PreparedPrompt for each workspace.
+
+Warm instances whose stored prompt arguments haven't changed reuse the parsed dogs, tools and system prompt instead of
+rebuilding them. Calling /set_prompt_arguments stores a new version, which invalidates the entry.
+"""
+
+
+def prepare_prompt(stored_arguments: dict) -> PreparedPrompt:
+    """Parse the stored prompt arguments and build the dogs, tools and system prompt from them."""
+    prompt_arguments = DynamicPromptArguments.parse_obj(stored_arguments)
+
+    # Dog Loading
+    # -----------
+    #
+    # WOOF! WOOF! Load the list of dogs we know about.
+    dogs = []
+
+    try:
+        if prompt_arguments.dogs:
+            dogs = [Dog.parse_obj(dog) for dog in prompt_arguments.dogs]
+    except Exception as e:
+        logging.error(f"Got exception parsing out dog names. {e}")
+
+    # Tools Setup
+    # -----------
+
+    # Tools can return text, audio, video, and images. They can store & retrieve information from vector DBs, and
+    # they can be stateful -- using Key-Valued storage and conversation history.
+    #
+    # See https://docs.steamship.com for a full list of supported Tools.
+    dog_registry = DogRegistry(
+        dogs, roster=DogRoster.from_dict(prompt_arguments.dog_roster)
+    )
+    tools = [
+        DogPictureTool(dogs=dogs, registry=dog_registry),
+        DogQuestionTool(dogs=dogs, registry=dog_registry),
+    ]
+
+    return PreparedPrompt(
+        version=prompt_arguments.version,
+        prompt_arguments=prompt_arguments,
+        dogs=dogs,
+        dog_registry=dog_registry,
+        tools=tools,
+        system_prompt=prompt_arguments.to_system_prompt(dog_registry.roster),
+    )
+
+
 class DogTrainer(AgentService):
     """Example agent which implements a dog trainer who knows about your dogs.
 
@@ -124,15 +223,105 @@ class DogTrainer(AgentService):
     Intended to be paired with the Vercel template here.
     """
 
-    USED_MIXIN_CLASSES = [SteamshipWidgetTransport, TelegramTransport, SlackTransport]
+    USED_MIXIN_CLASSES = [
+        SteamshipWidgetTransport,
+        TelegramTransport,
+        SlackTransport,
+        ConversationHistoryMixin,
+        RequestCoalescingMixin,
+        ImageJobsMixin,
+    ]
     """USED_MIXIN_CLASSES tells Steamship what additional HTTP endpoints to register on your AgentService."""
 
+    TOOL_CONCURRENCY = {"PictureTool": 2, "QuestionTool": 4}
+    """How many calls of each tool may run at once in this process, when tools run in parallel."""
+
     class DogTrainerConfig(Config):
         """Pydantic definition of the user-settable Configuration of this Agent."""
 
         telegram_bot_token: str = Field(
             "", description="[Optional] Secret token for connecting to Telegram"
         )
+        history_window_tokens: int = Field(
+            0,
+            description="How many tokens of the most recent conversation to send to the LLM with each message. 0 sends "
+            "none, as by default.",
+        )
+        history_summary_enabled: bool = Field(
+            True,
+            description="With a history window, summarize the conversation before it, in the background, and send the "
+            "summary with each message.",
+        )
+        request_coalescing_enabled: bool = Field(
+            True,
+            description="Run the agent only once for a Slack or Telegram message that is delivered more than once, such as when a webhook is retried.",
+        )
+        async_image_generation_enabled: bool = Field(
+            False,
+            description="On Slack and Telegram, reply straight away when asked for a picture, and send the picture once it has been generated.",
+        )
+        max_concurrent_image_jobs: int = Field(
+            2,
+            description="How many pictures may be generated in the background at once in this workspace.",
+        )
+        image_cache_enabled: bool = Field(
+            False,
+            description="Reuse pictures generated earlier for the same Stable Diffusion prompt, instead of always generating a new one.",
+        )
+        image_cache_ttl_seconds: int = Field(
+            86400,
+            description="How long a cached picture may be reused, in seconds.",
+        )
+        image_cache_max_entries: int = Field(
+            500, description="How many prompts to keep cached pictures for."
+        )
+        image_cache_max_variants: int = Field(
+            3,
+            description="How many different pictures to generate for a prompt before reusing them, for variety.",
+        )
+        parallel_tools_enabled: bool = Field(
+            False,
+            description="Run the tools the agent asks for in one step at the same time. Inert with the SDK's ChatOpenAI, which offers the model only the legacy `functions`, so the model asks for one tool per step.",
+        )
+        max_parallel_tools: int = Field(
+            4, description="How many tools the agent may run at the same time."
+        )
+        speculative_rewrite_enabled: bool = Field(
+            False,
+            description="While the agent decides what to do, start rewriting a message that mentions a dog for the tool it will most likely use. The rewrite is thrown away if the agent does something else.",
+        )
+        model_routing_enabled: bool = Field(
+            True,
+            description="Use the planning model only to plan with tools, and the cheaper models below for small talk and for rewriting requests.",
+        )
+        planning_model: str = Field(
+            "gpt-4",
+            description="The model that decides which tools to use, and answers with their results.",
+        )
+        small_talk_model: str = Field(
+            "gpt-3.5-turbo",
+            description="The model that answers short messages which don't mention any of the dogs.",
+        )
+        rewrite_model: str = Field(
+            "gpt-3.5-turbo",
+            description="The model that rewrites questions and picture requests with the breed and description of the dogs they mention.",
+        )
+        small_talk_max_words: int = Field(
+            4,
+            description="The longest message, in words, that may be answered as small talk.",
+        )
+        tracing_sample_rate: float = Field(
+            0.01,
+            description="The fraction of messages to trace: to time the planning steps, tools, LLM calls and replies, and count the LLM calls' tokens.",
+        )
+        trace_export_path: str = Field(
+            "",
+            description="[Optional] A file to append traces to. The most recent traces are also reported by /recent_traces.",
+        )
+        trace_export_format: str = Field(
+            JSONL_FORMAT,
+            description="How to export traces: `jsonl` for one JSON object per span, or `otlp` for one OpenTelemetry OTLP/JSON request per trace.",
+        )
 
     config: DogTrainerConfig
     """The configuration block that users who create an instance of this agent will provide."""
@@ -140,11 +329,35 @@ class DogTrainer(AgentService):
     tools: List[Tool]
     """The list of Tools that this agent is capable of using."""
 
+    history_manager: ConversationHistoryManager
+    """Chooses the part of each conversation to send to the LLM, and keeps conversations' summaries and token metrics."""
+
+    request_coalescer: RequestCoalescer
+    """Keeps retried deliveries of a Slack or Telegram message from running the agent again."""
+
+    image_cache: ImageCache
+    """Remembers the pictures generated for each Stable Diffusion prompt, so repeated requests can reuse them."""
+
+    image_jobs: ImageJobs
+    """Generates pictures in the background for Slack and Telegram, and delivers them when they are ready."""
+
+    action_executor: ConcurrentActionExecutor
+    """Runs the tools the agent asks for in a single planning step concurrently."""
+
+    model_router: ModelRouter
+    """Chooses the model for planning, small talk and the tools' rewrites, and accounts for their latency and cost."""
+
+    tracer: Tracer
+    """Traces a sample of messages, timing the planner, tools, LLM calls and replies of each."""
+
     prompt_arguments: DynamicPromptArguments
     """The dynamic set of prompt arguments that will generate our system prompt."""
 
     dogs: List[Dog]
 
+    dog_registry: DogRegistry
+    """Index of `dogs` by name and alias, shared by the tools so they only look up the dogs a request mentions."""
+
     @classmethod
     def config_cls(cls) -> Type[Config]:
         """Return the Configuration class so that Steamship can auto-generate a web UI upon agent creation time."""
@@ -166,30 +379,30 @@ class DogTrainer(AgentService):
         # Here is where we load the stored prompt arguments. Then see below where we set agent.PROMPT with them.
 
         self.kv_store = KeyValueStore(self.client, store_identifier="my-kv-store")
-        self.prompt_arguments = DynamicPromptArguments.parse_obj(
+        prepared = self.load_prepared_prompt(
             self.kv_store.get("prompt-arguments") or {}
         )
-
-        # Dog Loading
-        # -----------
-        #
-        # WOOF! WOOF! Load the list of dogs we know about.
-        self.dogs = []
-
-        try:
-            if self.prompt_arguments.dogs:
-                self.dogs = [Dog.parse_obj(dog) for dog in self.prompt_arguments.dogs]
-        except Exception as e:
-            logging.error(f"Got exception parsing out dog names. {e}")
-
-        # Tools Setup
-        # -----------
-
-        # Tools can return text, audio, video, and images. They can store & retrieve information from vector DBs, and
-        # they can be stateful -- using Key-Valued storage and conversation history.
-        #
-        # See https://docs.steamship.com for a full list of supported Tools.
-        self.tools = [DogPictureTool(dogs=self.dogs), DogQuestionTool(dogs=self.dogs)]
+        self.prompt_arguments = prepared.prompt_arguments
+        self.dogs = prepared.dogs
+        self.dog_registry = prepared.dog_registry
+        self.tools = list(prepared.tools)
+
+        # Model Routing Setup
+        # -------------------
+
+        # The planning model is only used to plan with tools. Short messages that don't mention a dog, and don't follow
+        # a turn that involved a dog or a tool, go to the small talk model, and the tools' rewrites to the rewrite model. The router is passed to the tools on the
+        # AgentContext, since the tools are cached across requests. `/model_routing_stats` reports the calls, latency
+        # and cost of each route. See model_router.py.
+        self.model_router = ModelRouter(
+            self.client,
+            policy={
+                PLANNING_ROUTE: self.config.planning_model,
+                SMALL_TALK_ROUTE: self.config.small_talk_model,
+                REWRITE_ROUTE: self.config.rewrite_model,
+            },
+            is_small_talk=self.is_small_talk,
+        )
 
         # Agent Setup
         # ---------------------
@@ -197,45 +410,244 @@ class DogTrainer(AgentService):
         # This agent's planner is responsible for making decisions about what to do for a given input.
         agent = FunctionsBasedAgent(
             tools=self.tools,
-            llm=ChatOpenAI(self.client, model_name="gpt-4"),
+            llm=(
+                self.model_router.planner()
+                if self.config.model_routing_enabled
+                else TracedLLM(
+                    llm=ChatOpenAI(self.client, model_name=self.config.planning_model)
+                )
+            ),
         )
 
         # Here is where we override the agent's prompt to set its personality. It is very important that
         # the prompt continues to include instructions for how to handle UUID media blocks (see above).
-        agent.PROMPT = self.prompt_arguments.to_system_prompt(self.dogs)
+        agent.PROMPT = prepared.system_prompt
         self.set_default_agent(agent)
 
+        # Parallel Tools Setup
+        # --------------------
+
+        # When the LLM asks for several tools in one step, e.g. to answer a question and take a picture, they are run
+        # at the same time, at most `max_parallel_tools` at once and `TOOL_CONCURRENCY` calls of each tool. The SDK's
+        # ChatOpenAI only offers the model the legacy `functions`, with which it asks for one tool per step, so this
+        # has no effect, and is off by default, until the agent's LLM offers it `tools`. See parallel_actions.py.
+        if self.config.parallel_tools_enabled:
+            agent.output_parser = ParallelFunctionsOutputParser(tools=self.tools)
+        self.action_executor = ConcurrentActionExecutor(
+            max_workers=self.config.max_parallel_tools,
+            tool_concurrency=self.TOOL_CONCURRENCY,
+        )
+
+        # Tracing Setup
+        # -------------
+
+        # A `tracing_sample_rate` fraction of messages are traced: each planning step, tool, LLM call (with its tokens)
+        # and reply is timed as a span of the message's trace. `/recent_traces` reports the most recent traces, which
+        # are also appended to `trace_export_path`, if it is set. See tracing.py.
+        self.tracer = Tracer(
+            type(self).__name__,
+            sample_rate=self.config.tracing_sample_rate,
+            export_path=self.config.trace_export_path,
+            export_format=self.config.trace_export_format,
+        )
+
+        # Conversation History Setup
+        # --------------------------
+
+        # By default the agent sends the LLM no earlier messages of the conversation. With `history_window_tokens` set,
+        # each message is sent with the most recent `history_window_tokens` tokens of the conversation, and a summary
+        # of everything before them, which is brought up to date in the background by the `/summarize_history`
+        # endpoint. `/history_stats` reports how many tokens each conversation has sent, and how many more that is
+        # than without the window. See history_window.py.
+        self.history_manager = ConversationHistoryManager(
+            self,
+            window_tokens=self.config.history_window_tokens,
+            summary_enabled=self.config.history_summary_enabled,
+            baseline_selector=self.get_default_agent().message_selector,
+        )
+        if self.history_manager.enabled:
+            self.get_default_agent().message_selector = self.history_manager.selector()
+        self.add_mixin(ConversationHistoryMixin(self.history_manager))
+
+        # Request Coalescing Setup
+        # ------------------------
+
+        # Slack and Telegram deliver a message again when the agent is slow to respond. Runs of the agent are keyed by
+        # the message's id, so a retried delivery waits for or reuses the original run rather than answering twice.
+        # `/request_coalescing_stats` reports how many duplicate runs were avoided. See request_coalescing.py.
+        self.request_coalescer = RequestCoalescer(
+            self.client, enabled=self.config.request_coalescing_enabled
+        )
+        self.add_mixin(RequestCoalescingMixin(self.request_coalescer))
+
+        # Image Cache Setup
+        # -----------------
+
+        # Generated pictures are remembered in the workspace's KeyValueStore, keyed by the Stable Diffusion prompt and
+        # settings. Once `image_cache_max_variants` pictures have been generated for a prompt, requests for it are
+        # answered with them in turn. `/image_cache_stats` reports the hit ratio. See image_cache.py.
+        self.image_cache = ImageCache(
+            KeyValueStore(self.client, store_identifier="image-cache"),
+            ttl_seconds=self.config.image_cache_ttl_seconds,
+            max_entries=self.config.image_cache_max_entries,
+            max_variants=self.config.image_cache_max_variants,
+        )
+
+        # Image Jobs Setup
+        # ----------------
+
+        # On Slack and Telegram, the PictureTool starts generating and replies straight away, and the picture is sent
+        # once it is ready, so the webhook isn't held open (and retried) while Stable Diffusion runs. About
+        # `max_concurrent_image_jobs` pictures are generated at once. `/image_job_stats` reports how jobs went. The
+        # ImageJobs are passed to the tools on the AgentContext, since the tools are cached across requests. See
+        # image_jobs.py.
+        self.image_jobs = ImageJobs(
+            self,
+            max_concurrent_jobs=self.config.max_concurrent_image_jobs,
+            image_cache=self.image_cache if self.config.image_cache_enabled else None,
+        )
+        self.add_mixin(ImageJobsMixin(self.image_jobs))
+
         # Communication Transport Setup
         # -----------------------------
 
+        # Each transport's endpoints are registered now, but the transport itself is only constructed when a request
+        # arrives on one of those endpoints. See lazy_mixins.py.
+
         # Support Steamship's web client
-        self.add_mixin(
-            SteamshipWidgetTransport(
+        add_lazy_mixin(
+            self,
+            SteamshipWidgetTransport,
+            lambda: SteamshipWidgetTransport(
                 client=self.client,
                 agent_service=self,
-            )
+            ),
         )
 
         # Support Slack
-        self.add_mixin(
-            SlackTransport(
+        add_lazy_mixin(
+            self,
+            SlackTransport,
+            lambda: SlackTransport(
                 client=self.client,
                 config=SlackTransportConfig(),
                 agent_service=self,
-            )
+            ),
         )
 
         # Support Telegram
-        self.add_mixin(
-            TelegramTransport(
+        add_lazy_mixin(
+            self,
+            TelegramTransport,
+            lambda: TelegramTransport(
                 client=self.client,
                 config=TelegramTransportConfig(
                     bot_token=self.config.telegram_bot_token
                 ),
                 agent_service=self,
-            )
+            ),
         )
 
+    def run_agent(self, agent: Agent, context: AgentContext):
+        """Run the agent, unless the message is a duplicate delivery of one it has already run for.
+
+        The tools are given the model router, image cache and image jobs on the context, if they are enabled. A
+        speculative rewrite that no tool took by the end of the run is counted as wasted. A sample of runs are traced.
+        """
+        if self.config.model_routing_enabled:
+            with_model_router(self.model_router, context)
+        if self.config.image_cache_enabled:
+            with_image_cache(self.image_cache, context)
+        if self.config.async_image_generation_enabled:
+            with_image_jobs(self.image_jobs, context)
+        run_agent = super().run_agent
+
+        def run():
+            with self.tracer.trace() as trace, following_planned_turn(
+                self.follows_planned_turn(context)
+            ):
+                if trace.recording:
+                    context.emit_funcs = [traced_emit(f) for f in context.emit_funcs]
+                try:
+                    return run_agent(agent, context)
+                finally:
+                    speculation = get_speculative_rewrite(context)
+                    if speculation is not None:
+                        speculation.discard()
+
+        return self.request_coalescer.run(context, run)
+
+    def run_action(self, agent: Agent, action: Action, context: AgentContext):
+        """Run an action, running the tools of a ParallelAction concurrently, each in a `Tool.run` span."""
+        run_action = super().run_action
+
+        def run_tool(tool_action: Action):
+            with span("Tool.run", tool=tool_action.tool):
+                run_action(agent, tool_action, context)
+
+        if isinstance(action, ParallelAction):
+            self.action_executor.run(run_tool, action, context)
+        else:
+            run_tool(action)
+
+    def is_small_talk(self, text: str) -> bool:
+        """Whether a message is short and mentions neither a dog nor a picture, so no tool could help with it."""
+        return (
+            len(text.split()) <= self.config.small_talk_max_words
+            and not self.dog_registry.find(text)
+            and not PICTURE_REQUEST_PATTERN.search(text)
+        )
+
+    def follows_planned_turn(self, context: AgentContext) -> bool:
+        """Whether the turn before this one involved a dog or a tool, so that a short follow-up may be about it.
+
+        The chat history doesn't keep the tools' calls, so a turn is taken to have involved one if its message wasn't
+        small talk, or it was answered with anything but text.
+        """
+        messages = context.chat_history.messages
+        user_turns = [
+            i for i, message in enumerate(messages) if message.chat_role == RoleTag.USER
+        ]
+        if len(user_turns) < 2:
+            return False
+        request, *replies = messages[user_turns[-2] : user_turns[-1]]
+        return not self.is_small_talk(request.text or "") or any(
+            not reply.is_text() or self.dog_registry.find(reply.text or "")
+            for reply in replies
+        )
+
+    @get("/recent_traces")
+    def recent_traces(self, export_format: str = JSONL_FORMAT) -> dict:
+        """Return the most recent traces of this process, as JSON lines' spans or OpenTelemetry OTLP/JSON requests."""
+        return {"traces": recent_traces(export_format)}
+
+    @get("/model_routing_stats")
+    def model_routing_stats(self) -> dict:
+        """Return the calls, latency, tokens and cost of each model route in this process."""
+        return model_routing_stats()
+
+    @get("/speculation_stats")
+    def speculation_stats(self) -> dict:
+        """Return how many speculative rewrites this process used and wasted, and the seconds they saved and wasted."""
+        return speculation_stats()
+
+    @get("/image_cache_stats")
+    def image_cache_stats(self) -> dict:
+        """Return hit/miss counters, and the hit ratio, for the generated picture cache."""
+        return self.image_cache.stats()
+
+    def prepared_prompt_cache_key(self) -> str:
+        return f"{self.client.config.workspace_id}/{self.kv_store.store_identifier}"
+
+    def load_prepared_prompt(self, stored_arguments: dict) -> PreparedPrompt:
+        """Return the PreparedPrompt for the stored prompt arguments, reusing this process's copy if it is current."""
+        key = self.prepared_prompt_cache_key()
+        prepared = PREPARED_PROMPTS.get(key)
+        if prepared is None or prepared.version != stored_arguments.get("version"):
+            prepared = prepare_prompt(stored_arguments)
+            PREPARED_PROMPTS[key] = prepared
+        return prepared
+
     def next_action(
         self, agent: Agent, input_blocks: List[Block], context: AgentContext
     ) -> Action:
@@ -247,8 +659,24 @@ class DogTrainer(AgentService):
                     )
                 ]
             )
-        else:
-            return super().next_action(agent, input_blocks, context)
+
+        with span("next_action", step=len(context.completed_steps)) as step:
+            # On the first planning step, start the rewrite the chosen tool is likely to need. See speculation.py.
+            if (
+                self.config.speculative_rewrite_enabled
+                and not context.completed_steps
+                and input_blocks
+                and input_blocks[0].text
+                and get_speculative_rewrite(context) is None
+            ):
+                start_speculative_rewrite(context, self.tools, input_blocks[0].text)
+
+            action = super().next_action(agent, input_blocks, context)
+            step.set(tool=action.tool)
+        if action.is_final:
+            action = with_held_final_output(action, context)
+        discard_unless_chosen(context, action)
+        return action
 
     @post("/set_prompt_arguments")
     def set_prompt_arguments(
@@ -281,10 +709,14 @@ class DogTrainer(AgentService):
                 or self.prompt_arguments.behavior
                 or DEFAULT_BEHAVIOR,
                 "dogs": dogs,
+                # Serialize each dog for the prompts once, here, rather than on every request.
+                "dog_roster": DogRoster.from_dogs(dogs or []).to_dict(),
+                "version": uuid.uuid4().hex,
             }
         )
 
         # Save it in the KV Store so that next time this AgentService runs, it will pick up the new values
         self.kv_store.set("prompt-arguments", self.prompt_arguments.dict())
+        PREPARED_PROMPTS.pop(self.prepared_prompt_cache_key(), None)
 
-        return self.prompt_arguments.dict()
+        return self.prompt_arguments.dict(exclude={"dog_roster"})
@@ -0,0 +1,111 @@
+"""Compare the two-step and fused Stable Diffusion prompt rewrites of the DogPictureTool.
+
+Uses a stubbed LLM, so no network access or Steamship workspace is needed. Run from the dog-trainer folder with:
+
+    python -m benchmarks.dog_picture_prompt
+"""
+import argparse
+import json
+import time
+
+from benchmarks.stub_llm import StubLLM
+from dog import Dog
+from dog_picture_tool import DogPictureTool
+from steamship.agents.utils import with_llm
+
+DOGS = [
+    Dog(
+        name="Fido",
+        breed="Daschund",
+        description="A silly dog whose tongue is always out.",
+    ),
+    Dog(
+        name="Biggy",
+        breed="German Shephard",
+        description="A strong dog that is always guarding things.",
+    ),
+]
+
+REQUESTS = [
+    "Show me a picture of Fido swimming in a lake",
+    "Take a photo of Biggy guarding the front door",
+    "What would Fido look like as an astronaut?",
+]
+
+REWRITTEN_REQUEST = (
+    "A picture of a silly daschund with its tongue out swimming in a lake"
+)
+
+SD_PROMPT = (
+    "{a silly daschund with its tongue out swimming in a lake}, photograph, natural light, "
+    "(vivid colors:1.2), close-up, 35mm, sharp focus, highly detailed, 8K"
+)
+
+
+def dog_picture_responder(malformed: bool = False):
+    """Return a responder that answers the DogPictureTool prompts the way a well-behaved LLM would."""
+
+    def respond(prompt: str) -> str:
+        if prompt.rstrip().endswith("JSON:"):
+            if malformed:
+                return SD_PROMPT
+            return json.dumps(
+                {"rewritten_request": REWRITTEN_REQUEST, "prompt": SD_PROMPT}
+            )
+        if prompt.rstrip().endswith("REWRITTEN REQUEST:"):
+            return REWRITTEN_REQUEST
+        return SD_PROMPT
+
+    return respond
+
+
+def benchmark(mode: str, fused_rewrite: bool, malformed: bool, args) -> dict:
+    llm = StubLLM(
+        responder=dog_picture_responder(malformed=malformed),
+        seconds_per_call=args.seconds_per_call,
+        seconds_per_completion_token=args.seconds_per_token,
+    )
+    context = with_llm(llm=llm)
+    tool = DogPictureTool(dogs=DOGS, fused_rewrite=fused_rewrite)
+
+    started_at = time.perf_counter()
+    for _ in range(args.iterations):
+        for request in REQUESTS:
+            tool.stable_diffusion_prompt(request, context)
+    elapsed = time.perf_counter() - started_at
+
+    pictures = args.iterations * len(REQUESTS)
+    return {
+        "mode": mode,
+        "ms_per_picture": 1000 * elapsed / pictures,
+        "llm_calls": llm.calls / pictures,
+        "prompt_tokens": llm.prompt_tokens / pictures,
+        "completion_tokens": llm.completion_tokens / pictures,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2)
+    parser.add_argument("--seconds-per-call", type=float, default=0.4)
+    parser.add_argument("--seconds-per-token", type=float, default=0.01)
+    args = parser.parse_args()
+
+    results = [
+        benchmark("two-step", fused_rewrite=False, malformed=False, args=args),
+        benchmark("fused", fused_rewrite=True, malformed=False, args=args),
+        benchmark("fused (fallback)", fused_rewrite=True, malformed=True, args=args),
+    ]
+
+    print(
+        f"{'mode':<18}{'ms/picture':>12}{'llm calls':>11}{'prompt tok':>12}{'completion tok':>16}"
+    )
+    for r in results:
+        print(
+            f"{r['mode']:<18}{r['ms_per_picture']:>12.0f}{r['llm_calls']:>11.1f}"
+            f"{r['prompt_tokens']:>12.0f}{r['completion_tokens']:>16.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Compare serializing the dogs on every prompt build with reading the precomputed DogRoster fragments.
+
+Run from the dog-trainer folder with:
+
+    python -m benchmarks.dog_roster
+"""
+import argparse
+import json
+import timeit
+
+from dog import Dog
+from dog_registry import DogRegistry
+from dog_roster import DogRoster
+
+
+def make_dogs(count: int):
+    return [
+        Dog(
+            name=f"Dog{i}",
+            breed="Labrador",
+            description=f"A friendly dog who is number {i} in the kennel.",
+            aliases=[f"Pup{i}"],
+        )
+        for i in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(
+        f"{'dogs':>8}{'json.dumps ms':>16}{'roster ms':>12}{'speedup':>10}"
+        f"{'load roster ms':>17}{'2 dogs ms':>12}"
+    )
+    for size in args.sizes:
+        dogs = make_dogs(size)
+        registry = DogRegistry(dogs)
+        saved_roster = registry.roster.to_dict()
+        mentioned = dogs[:2]
+
+        def per_call_json():
+            return "\n".join([f"- {json.dumps(dog.dict())}" for dog in dogs])
+
+        assert per_call_json() == registry.as_json_bullets()
+
+        number = max(1, 20000 // size)
+        per_call = min(timeit.repeat(per_call_json, number=number, repeat=args.repeat))
+        roster = min(
+            timeit.repeat(registry.as_json_bullets, number=number, repeat=args.repeat)
+        )
+        load = min(
+            timeit.repeat(
+                lambda: DogRoster.from_dict(saved_roster),
+                number=number,
+                repeat=args.repeat,
+            )
+        )
+        subset = min(
+            timeit.repeat(
+                lambda: registry.as_json_bullets(mentioned),
+                number=number,
+                repeat=args.repeat,
+            )
+        )
+        print(
+            f"{size:>8}{1000 * per_call / number:>16.3f}{1000 * roster / number:>12.3f}"
+            f"{per_call / roster:>9.0f}x{1000 * load / number:>17.3f}{1000 * subset / number:>12.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Compare cold and warm construction of the DogTrainer AgentService.
+
+A cold start parses the stored dogs, builds the tools and formats the system prompt. A warm start finds all of that in
+the process-level PREPARED_PROMPTS cache. The KeyValueStore is replaced with a local in-memory stand-in, so no
+network access or Steamship workspace is needed. Run from the dog-trainer folder with:
+
+    python -m benchmarks.dog_trainer_startup
+"""
+import argparse
+import time
+
+import api
+from benchmarks.local_workspace import LocalClient, use_local_key_value_stores
+from steamship.invocable import InvocationContext
+
+
+def construct(client: LocalClient) -> api.DogTrainer:
+    return api.DogTrainer(
+        client=client,
+        config={},
+        context=InvocationContext(invocable_instance_handle="local-dog-trainer"),
+    )
+
+
+def timed(fn, repeat: int) -> float:
+    """Return the fastest of `repeat` runs of `fn`, in milliseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started_at)
+    return 1000 * best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    use_local_key_value_stores(api)
+
+    print(f"{'dogs':>8}{'cold ms':>12}{'warm ms':>12}{'speedup':>10}")
+    for size in args.sizes:
+        client = LocalClient.for_workspace(f"workspace-{size}")
+        construct(client).set_prompt_arguments(
+            dogs=[
+                {
+                    "name": f"Dog{i}",
+                    "breed": "Labrador",
+                    "description": f"A friendly dog who is number {i} in the kennel.",
+                }
+                for i in range(size)
+            ]
+        )
+
+        def cold():
+            api.PREPARED_PROMPTS.clear()
+            construct(client)
+
+        cold_ms = timed(cold, args.repeat)
+        construct(client)
+        warm_ms = timed(lambda: construct(client), args.repeat)
+        print(f"{size:>8}{cold_ms:>12.2f}{warm_ms:>12.2f}{cold_ms / warm_ms:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
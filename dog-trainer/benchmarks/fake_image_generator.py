@@ -0,0 +1,67 @@
+"""An offline stand-in for the Stable Diffusion plugin, used to exercise image generation without network access."""
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+from steamship import Block, MimeTypes, TaskState
+
+
+class FakeGeneratorOutput:
+    def __init__(self, blocks: List[Block]):
+        self.blocks = blocks
+
+
+class FakeImageTask:
+    """A generation Task that takes `seconds` to finish, from when it was started.
+
+    Like a Task that never reached the Steamship engine, it has no `task_id`, so it can't be waited on by
+    `invoke_later`.
+    """
+
+    task_id: Optional[str] = None
+
+    def __init__(self, prompt: str, seconds: float, fail: bool = False):
+        self.prompt = prompt
+        self.finishes_at = time.perf_counter() + seconds
+        self.fail = fail
+        self.state = TaskState.running
+        self.status_message: Optional[str] = None
+        self.output: Optional[FakeGeneratorOutput] = None
+
+    def wait(self, *args, **kwargs) -> "FakeImageTask":
+        time.sleep(max(0.0, self.finishes_at - time.perf_counter()))
+        if self.fail:
+            self.state = TaskState.failed
+            self.status_message = "Fake generation failure"
+            raise RuntimeError(self.status_message)
+        self.state = TaskState.succeeded
+        self.output = FakeGeneratorOutput(
+            [
+                Block(
+                    id=uuid.uuid4().hex,
+                    url=f"https://example.com/fake-images/{uuid.uuid4().hex}.png",
+                    mime_type=MimeTypes.PNG,
+                    text=self.prompt,
+                )
+            ]
+        )
+        return self
+
+
+class FakeImageGenerator:
+    """Plugin instance whose `generate` returns a FakeImageTask, keeping count of how many were started.
+
+    Register one with `LocalClient.plugins["stable-diffusion"] = FakeImageGenerator(...)`.
+    """
+
+    def __init__(self, seconds_per_image: float = 5.0, fail: bool = False):
+        self.seconds_per_image = seconds_per_image
+        self.fail = fail
+        self.generated = 0
+        self._lock = threading.Lock()
+
+    def generate(self, text: Optional[str] = None, **kwargs) -> FakeImageTask:
+        with self._lock:
+            self.generated += 1
+        return FakeImageTask(text or "", self.seconds_per_image, fail=self.fail)
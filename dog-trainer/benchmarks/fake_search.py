@@ -0,0 +1,63 @@
+"""An offline stand-in for the SERP API plugin that SearchTool (and so the QuestionTool) uses."""
+import threading
+import time
+from typing import Optional
+
+from steamship import Block, File, Tag
+from steamship.data import TagValueKey
+
+
+class FakeSearchOutput:
+    def __init__(self, file: File):
+        self.file = file
+
+
+class FakeSearchTask:
+    """A search Task that takes `seconds` to finish, from when it was started."""
+
+    task_id: Optional[str] = None
+
+    def __init__(self, answer: str, seconds: float):
+        self.answer = answer
+        self.finishes_at = time.perf_counter() + seconds
+        self.output: Optional[FakeSearchOutput] = None
+
+    def wait(self, *args, **kwargs) -> "FakeSearchTask":
+        time.sleep(max(0.0, self.finishes_at - time.perf_counter()))
+        self.output = FakeSearchOutput(
+            File.construct(
+                blocks=[
+                    Block(
+                        tags=[
+                            Tag(
+                                kind="search-result",
+                                value={TagValueKey.STRING_VALUE: self.answer},
+                            )
+                        ]
+                    )
+                ]
+            )
+        )
+        return self
+
+
+class FakeSearch:
+    """Plugin instance whose `tag` returns a FakeSearchTask, keeping count of how many searches were made.
+
+    Register one with `LocalClient.plugins["serpapi-wrapper"] = FakeSearch(...)`.
+    """
+
+    def __init__(
+        self,
+        seconds_per_search: float = 1.5,
+        answer: str = "About a cup of food a day, split into two meals.",
+    ):
+        self.seconds_per_search = seconds_per_search
+        self.answer = answer
+        self.searches = 0
+        self._lock = threading.Lock()
+
+    def tag(self, doc: str, **kwargs) -> FakeSearchTask:
+        with self._lock:
+            self.searches += 1
+        return FakeSearchTask(self.answer, self.seconds_per_search)
@@ -0,0 +1,155 @@
+"""Compare how long a Telegram user waits for a reply to a picture request, with and without image jobs.
+
+Sends `--users` picture requests at once through DogTrainer's PictureTool, as they would arrive from Telegram, and
+reports when the last of them got its first message back:
+
+- sync: the tool waits for the picture, so the reply (and the webhook) waits too
+- async: the tool replies straight away and the picture is pushed to the chat when it is ready (see image_jobs.py)
+
+Stable Diffusion is replaced by a FakeImageGenerator that takes `--image-seconds` per picture, the LLM by a StubLLM,
+the Telegram API by a recorder, and the KeyValueStore by an in-memory stand-in, so no network access is needed. Run
+from the dog-trainer folder with:
+
+    python -m benchmarks.image_jobs
+"""
+import argparse
+import json
+import threading
+import time
+from typing import List, Optional
+
+import api
+import image_jobs
+from benchmarks.fake_image_generator import FakeImageGenerator
+from benchmarks.local_workspace import LocalClient, use_local_key_value_stores
+from benchmarks.stub_llm import StubLLM
+from dog import Dog
+from dog_picture_tool import DogPictureTool
+from lazy_mixins import LazyMixin
+from steamship import Block
+from steamship.agents.mixins.transports.telegram import TelegramTransport
+from steamship.agents.utils import with_llm
+from steamship.invocable import InvocationContext
+
+DOGS = [Dog(name="Fido", breed="Daschund", description="A silly dog.")]
+
+COMPLETION = json.dumps(
+    {
+        "rewritten_request": "A picture of a silly daschund",
+        "prompt": "{a silly daschund}, photograph, natural light, highly detailed",
+    }
+)
+
+
+class OfflineChatHistory:
+    """Just enough of a ChatHistory for the tools: the message being answered."""
+
+    def __init__(self, text: str, chat_id: str):
+        self.last_user_message = Block(text=text)
+        self.last_user_message.set_chat_id(chat_id)
+
+
+class SentMessages:
+    """Records the messages the Telegram transport sends, and when each arrives."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.sent: List[tuple] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, blocks: List[Block], metadata: dict):
+        with self._lock:
+            for block in blocks:
+                self.sent.append(
+                    (time.perf_counter() - self.started_at, block.chat_id, block)
+                )
+
+    def first(self, chat_id: str, images: bool) -> Optional[float]:
+        return next(
+            (
+                seconds
+                for seconds, sent_chat_id, block in self.sent
+                if sent_chat_id == chat_id and (block.url is not None) == images
+            ),
+            None,
+        )
+
+
+def construct(max_jobs: int) -> api.DogTrainer:
+    return api.DogTrainer(
+        client=LocalClient.for_workspace("image-jobs"),
+        config={"max_concurrent_image_jobs": max_jobs},
+        context=InvocationContext(invocable_instance_handle="local-dog-trainer"),
+    )
+
+
+def run(mode: str, users: int, max_jobs: int, image_seconds: float) -> dict:
+    """Send `users` requests at once, and measure when each chat got a reply and a picture."""
+    generator = FakeImageGenerator(seconds_per_image=image_seconds)
+    LocalClient.plugins["stable-diffusion"] = generator
+    image_jobs.KeyValueStore.stores.clear()
+    service = construct(max_jobs)
+    telegram = next(
+        mixin.get()
+        for mixin in service.mixins
+        if isinstance(mixin, LazyMixin) and mixin.mixin_class is TelegramTransport
+    )
+    sent = SentMessages()
+    telegram._send = sent
+    tool = DogPictureTool(dogs=DOGS)
+    llm = StubLLM(responder=lambda prompt: COMPLETION, seconds_per_call=0.2)
+
+    def request(i: int):
+        context = with_llm(llm)
+        context.client = service.client
+        context.chat_history = OfflineChatHistory("A picture of Fido", f"chat-{i}")
+        context.emit_funcs = [telegram.build_emit_func(f"chat-{i}")]
+        if mode == "async":
+            image_jobs.with_image_jobs(service.image_jobs, context)
+        for emit_func in context.emit_funcs:
+            emit_func(tool.run([context.chat_history.last_user_message], context), {})
+
+    sent.started_at = time.perf_counter()
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    time.sleep(image_seconds + 0.2)  # Let background jobs deliver.
+
+    replies = [sent.first(f"chat-{i}", images=False) for i in range(users)]
+    pictures = [sent.first(f"chat-{i}", images=True) for i in range(users)]
+    first_message = [
+        min(s for s in (reply, picture) if s is not None)
+        for reply, picture in zip(replies, pictures)
+        if reply is not None or picture is not None
+    ]
+    return {
+        "first message (max)": max(first_message),
+        "pictures delivered": sum(picture is not None for picture in pictures),
+        "pictures generated": generator.generated,
+        "told to wait": sum(picture is None for picture in pictures),
+        "stats": service.image_jobs.stats() if mode == "async" else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=3)
+    parser.add_argument("--max-jobs", type=int, default=2)
+    parser.add_argument("--image-seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    use_local_key_value_stores(api, image_jobs)
+    for mode in ("sync", "async"):
+        results = run(mode, args.users, args.max_jobs, args.image_seconds)
+        print(f"{mode}:")
+        for name, value in results.items():
+            if isinstance(value, float):
+                value = f"{value:.2f} s"
+            if value is not None:
+                print(f"  {name:<24}{value}")
+
+
+if __name__ == "__main__":
+    main()
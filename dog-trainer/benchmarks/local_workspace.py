@@ -0,0 +1,83 @@
+"""Offline stand-ins for the parts of a Steamship workspace that DogTrainer touches while it starts up."""
+import copy
+import time
+from types import ModuleType
+from typing import Any, ClassVar, Dict, List, Optional, Tuple
+
+from pydantic import SecretStr
+from steamship import PluginInstance, Steamship
+from steamship.base.configuration import Configuration
+
+
+class LocalClient(Steamship):
+    """Enough of a Steamship client to construct an AgentService without network access.
+
+    Create one with `LocalClient.for_workspace(...)`, which skips the API key lookup that `Steamship()` performs.
+    """
+
+    plugins: ClassVar[Dict[str, Any]] = {}
+    """Offline stand-ins for plugin instances, by plugin handle, such as a FakeImageGenerator."""
+
+    @staticmethod
+    def for_workspace(workspace_id: str = "local-workspace") -> "LocalClient":
+        return LocalClient.construct(
+            config=Configuration.construct(
+                workspace_id=workspace_id, api_key=SecretStr("local")
+            )
+        )
+
+    def use_plugin(self, plugin_handle: str, *args, **kwargs) -> PluginInstance:
+        if plugin_handle in LocalClient.plugins:
+            return LocalClient.plugins[plugin_handle]
+        return PluginInstance.construct(handle=plugin_handle)
+
+
+class InMemoryKeyValueStore:
+    """Same interface as steamship.utils.kv_store.KeyValueStore, kept in a process-wide dict.
+
+    Values are deep-copied on the way in and out, as they would be when sent to and from Steamship.
+    """
+
+    stores: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    latency_seconds: float = 0.0
+    """Simulated network round trip added to every read and write."""
+
+    def __init__(self, client: Any = None, store_identifier: str = "KeyValueStore"):
+        self.client = client
+        self.store_identifier = f"kv-store-{store_identifier}"
+        self._data = InMemoryKeyValueStore.stores.setdefault(self.store_identifier, {})
+
+    def get(self, key: str) -> Optional[Dict]:
+        time.sleep(InMemoryKeyValueStore.latency_seconds)
+        return copy.deepcopy(self._data.get(key))
+
+    def delete(self, key: str) -> bool:
+        return self._data.pop(key, None) is not None
+
+    def set(self, key: str, value: Dict[str, Any]):
+        time.sleep(InMemoryKeyValueStore.latency_seconds)
+        self._data[key] = copy.deepcopy(value)
+
+    def items(
+        self, filter_keys: Optional[List[str]] = None
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        return [
+            (key, copy.deepcopy(value))
+            for key, value in self._data.items()
+            if filter_keys is None or key in filter_keys
+        ]
+
+    def reset(self):
+        self._data.clear()
+
+
+def use_local_key_value_stores(*modules: ModuleType):
+    """Point the KeyValueStore used by each of `modules` at InMemoryKeyValueStore.
+
+    The Telegram transport reads its bot token from a KeyValueStore when it is constructed, so it is always patched.
+    """
+    from steamship.agents.mixins.transports import telegram
+
+    for module in (telegram, *modules):
+        module.KeyValueStore = InMemoryKeyValueStore
@@ -0,0 +1,163 @@
+"""Compare a short conversation with every LLM call on GPT-4, and with calls routed to cheaper models by purpose.
+
+The user says hello, asks how much Fido should eat, asks for a picture of Fido, and says thanks. Runs DogTrainer's agent
+end to end for each turn, under two routing policies (see model_router.py):
+
+- gpt-4 only: planning, small talk and the tools' rewrites all use GPT-4
+- tiered: planning uses GPT-4, and small talk and rewrites GPT-3.5
+
+Each turn follows the earlier ones, so the thanks, which follows the picture, is planned rather than small talk.
+
+The models are stub LLMs that take longer, per call and per token, for GPT-4; the search and Stable Diffusion plugins
+are fakes, and the KeyValueStore an in-memory stand-in, so no network access is needed. Costs are estimated from the
+tokens sent and received, at MODEL_PRICES. Run from the dog-trainer folder with:
+
+    python -m benchmarks.model_routing
+"""
+import argparse
+import json
+import time
+from typing import Dict, List, Tuple
+
+import api
+import model_router
+from benchmarks.fake_image_generator import FakeImageGenerator
+from benchmarks.fake_search import FakeSearch
+from benchmarks.local_workspace import (
+    InMemoryKeyValueStore,
+    LocalClient,
+    use_local_key_value_stores,
+)
+from benchmarks.parallel_tools import DOGS, OfflineChatHistory, tool_completion
+from benchmarks.stub_llm import StubChatLLM, StubLLM
+from steamship import Block
+from steamship.agents.schema import AgentContext
+from steamship.data.tags.tag_constants import RoleTag
+from steamship.invocable import InvocationContext
+
+TURNS = [
+    "Hi there!",
+    "How much should Fido eat?",
+    "Show me a picture of Fido swimming",
+    "Thanks, that's great!",
+]
+
+POLICIES = {
+    "gpt-4 only": {"planning": "gpt-4", "small_talk": "gpt-4", "rewrite": "gpt-4"},
+    "tiered": model_router.DEFAULT_POLICY,
+}
+
+SECONDS_PER_CALL = {"gpt-4": 1.0, "gpt-3.5-turbo": 0.3}
+SECONDS_PER_COMPLETION_TOKEN = {"gpt-4": 0.02, "gpt-3.5-turbo": 0.005}
+
+
+def plan(messages: List[Block]) -> str:
+    """The planner's response: a tool call for a message about Fido, an answer to a tool's result, or small talk."""
+    if model_router.is_function_result(messages[-1]):
+        return "Fido should eat about a cup of food a day, split into two meals."
+    request = messages[-1].text
+    if "picture" in request:
+        tool = "PictureTool"
+    elif "Fido" in request:
+        tool = "QuestionTool"
+    else:
+        return "Happy to help! Ask me anything about your dogs."
+    return json.dumps(
+        {"function_call": {"name": tool, "arguments": json.dumps({"text": request})}}
+    )
+
+
+def stub_llm(model: str, chat: bool):
+    if chat:
+        return StubChatLLM(
+            responder=plan,
+            seconds_per_call=SECONDS_PER_CALL[model],
+            seconds_per_completion_token=SECONDS_PER_COMPLETION_TOKEN[model],
+        )
+    return StubLLM(
+        responder=tool_completion,
+        seconds_per_call=SECONDS_PER_CALL[model] / 2,
+        seconds_per_completion_token=SECONDS_PER_COMPLETION_TOKEN[model],
+    )
+
+
+def route_counters() -> Dict[Tuple[str, str], dict]:
+    return {
+        (route, model): counters
+        for route, models in model_router.model_routing_stats()["routes"].items()
+        for model, counters in models.items()
+    }
+
+
+def run(policy: Dict[str, str]) -> dict:
+    service = api.DogTrainer(
+        client=LocalClient.for_workspace("model-routing"),
+        config={
+            "planning_model": policy["planning"],
+            "small_talk_model": policy["small_talk"],
+            "rewrite_model": policy["rewrite"],
+        },
+        context=InvocationContext(invocable_instance_handle="local-dog-trainer"),
+    )
+    service.model_router.llm_factory = stub_llm
+    agent = service.get_default_agent()
+
+    before = route_counters()
+    seconds = []
+    messages: List[Block] = []
+    for turn in TURNS:
+        context = AgentContext()
+        context.client = service.client
+        context.llm_cache = context.action_cache = None
+        context.chat_history = OfflineChatHistory(turn, messages)
+        context.chat_history.last_user_message.set_chat_role(RoleTag.USER)
+        replies: List[Block] = []
+        context.emit_funcs = [lambda blocks, metadata: replies.extend(blocks)]
+        started_at = time.perf_counter()
+        service.run_agent(agent, context)
+        seconds.append(time.perf_counter() - started_at)
+        for reply in replies:
+            reply.set_chat_role(RoleTag.ASSISTANT)
+        messages = context.chat_history.messages + replies
+
+    routes = {}
+    for key, counters in route_counters().items():
+        earlier = before.get(key, {})
+        routes[key] = {
+            name: counters[name] - earlier.get(name, 0)
+            for name in ("calls", "seconds", "cost_usd")
+        }
+    return {"seconds": seconds, "routes": routes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--search-seconds", type=float, default=1.0)
+    parser.add_argument("--image-seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    use_local_key_value_stores(api)
+    InMemoryKeyValueStore(store_identifier="my-kv-store").set(
+        "prompt-arguments", {"dogs": DOGS, "version": "model-routing"}
+    )
+    LocalClient.plugins["serpapi-wrapper"] = FakeSearch(args.search_seconds)
+    LocalClient.plugins["stable-diffusion"] = FakeImageGenerator(args.image_seconds)
+
+    for name, policy in POLICIES.items():
+        results = run(policy)
+        print(f"{name}:")
+        for turn, seconds in zip(TURNS, results["seconds"]):
+            print(f"  {turn!r:<40}{seconds:.2f} s")
+        for (route, model), counters in sorted(results["routes"].items()):
+            if counters["calls"]:
+                print(
+                    f"  {route:<12}{model:<16}{counters['calls']:>3} calls"
+                    f"{counters['seconds'] / counters['calls']:>8.2f} s/call"
+                    f"  ${counters['cost_usd']:.4f}"
+                )
+        total = sum(counters["cost_usd"] for counters in results["routes"].values())
+        print(f"  {'total':<28}{sum(results['seconds']):>15.2f} s  ${total:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""Compare answering a question and taking a picture in one request, with the tools run in turn and in parallel.
+
+The user asks "How much should Fido eat? And show me a picture of him eating." Runs DogTrainer's agent end to end:
+
+- sequential: the planner asks for the QuestionTool, then, on a second planning step, the PictureTool
+- parallel: the planner asks for both in one `multi_tool_use.parallel` call, and they run concurrently (see
+  parallel_actions.py), then writes the reply from the answer, to which the picture is added
+
+The planner is a scripted chat LLM, the tools' LLM a StubLLM, the search and Stable Diffusion plugins fakes, and the
+KeyValueStore an in-memory stand-in, so no network access is needed. Run from the dog-trainer folder with:
+
+    python -m benchmarks.parallel_tools
+"""
+import argparse
+import json
+import time
+from typing import List, Optional
+
+import api
+from benchmarks.fake_image_generator import FakeImageGenerator
+from benchmarks.fake_search import FakeSearch
+from benchmarks.local_workspace import (
+    InMemoryKeyValueStore,
+    LocalClient,
+    use_local_key_value_stores,
+)
+from benchmarks.stub_llm import StubLLM
+from steamship import Block
+from steamship.agents.schema import ChatLLM, Tool
+from steamship.agents.utils import with_llm
+from steamship.invocable import InvocationContext
+
+DOGS = [{"name": "Fido", "breed": "Daschund", "description": "A silly dog."}]
+
+QUESTION = "How much should Fido eat? And show me a picture of him eating."
+
+
+def function_call(name: str, arguments: dict) -> str:
+    return json.dumps(
+        {"function_call": {"name": name, "arguments": json.dumps(arguments)}}
+    )
+
+
+PLANS = {
+    "sequential": [
+        function_call("QuestionTool", {"text": "How much should Fido eat?"}),
+        function_call("PictureTool", {"text": "Fido eating"}),
+    ],
+    "parallel": [
+        function_call(
+            "multi_tool_use.parallel",
+            {
+                "tool_uses": [
+                    {
+                        "recipient_name": "functions.QuestionTool",
+                        "parameters": {"text": "How much should Fido eat?"},
+                    },
+                    {
+                        "recipient_name": "functions.PictureTool",
+                        "parameters": {"text": "Fido eating"},
+                    },
+                ]
+            },
+        ),
+        "A daschund like Fido should eat about a cup of food a day. Here he is eating!",
+    ],
+}
+
+
+class ScriptedChatLLM(ChatLLM):
+    """Planner that answers each planning step with the next of `responses`, after a simulated delay."""
+
+    responses: List[str]
+    seconds_per_call: float = 1.0
+    calls: int = 0
+
+    def chat(
+        self, messages: List[Block], tools: Optional[List[Tool]], **kwargs
+    ) -> List[Block]:
+        time.sleep(self.seconds_per_call)
+        response = self.responses[min(self.calls, len(self.responses) - 1)]
+        self.calls += 1
+        return [Block(text=response)]
+
+
+class OfflineChatHistory:
+    """Just enough of a ChatHistory for the agent: the message being answered, after the `earlier` messages.
+
+    The earlier messages are never selected for the planner, as with the SDK's default NoMessages selector.
+    """
+
+    def __init__(self, text: str, earlier: Optional[List[Block]] = None):
+        self.last_user_message = Block(text=text)
+        self.messages = list(earlier or []) + [self.last_user_message]
+
+    def is_searchable(self) -> bool:
+        return False
+
+    def select_messages(self, selector) -> List[Block]:
+        return []
+
+
+def tool_completion(prompt: str) -> str:
+    if "JSON:" in prompt:
+        return json.dumps(
+            {
+                "rewritten_request": "A silly daschund eating",
+                "prompt": "{a silly daschund eating}, photograph, natural light",
+            }
+        )
+    return "How much should a daschund eat?"
+
+
+def run(mode: str, args: argparse.Namespace) -> dict:
+    service = api.DogTrainer(
+        client=LocalClient.for_workspace("parallel-tools"),
+        config={
+            "parallel_tools_enabled": mode == "parallel",
+            "model_routing_enabled": False,
+        },
+        context=InvocationContext(invocable_instance_handle="local-dog-trainer"),
+    )
+    agent = service.get_default_agent()
+    agent.llm = ScriptedChatLLM(
+        responses=PLANS[mode], seconds_per_call=args.planner_seconds
+    )
+
+    replies: List[Block] = []
+    context = with_llm(
+        StubLLM(responder=tool_completion, seconds_per_call=args.llm_seconds)
+    )
+    context.client = service.client
+    context.llm_cache = context.action_cache = None
+    context.chat_history = OfflineChatHistory(QUESTION)
+    context.emit_funcs = [lambda blocks, metadata: replies.extend(blocks)]
+
+    started_at = time.perf_counter()
+    service.run_agent(agent, context)
+    return {
+        "seconds": time.perf_counter() - started_at,
+        "planner calls": agent.llm.calls,
+        "steps": [step.tool for step in context.completed_steps],
+        "reply": [block.text if block.url is None else "<image>" for block in replies],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--planner-seconds", type=float, default=1.0)
+    parser.add_argument("--llm-seconds", type=float, default=0.5)
+    parser.add_argument("--search-seconds", type=float, default=1.5)
+    parser.add_argument("--image-seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    use_local_key_value_stores(api)
+    InMemoryKeyValueStore(store_identifier="my-kv-store").set(
+        "prompt-arguments", {"dogs": DOGS, "version": "parallel-tools"}
+    )
+    LocalClient.plugins["serpapi-wrapper"] = FakeSearch(args.search_seconds)
+    LocalClient.plugins["stable-diffusion"] = FakeImageGenerator(args.image_seconds)
+
+    for mode in PLANS:
+        results = run(mode, args)
+        print(f"{mode}:")
+        print(f"  {'latency':<16}{results['seconds']:.2f} s")
+        for name in ("planner calls", "steps", "reply"):
+            print(f"  {name:<16}{results[name]}")
+
+
+if __name__ == "__main__":
+    main()
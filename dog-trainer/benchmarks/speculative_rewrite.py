@@ -0,0 +1,115 @@
+"""Compare answering "How much should Fido eat?" with and without a speculative question rewrite.
+
+Runs DogTrainer's agent end to end for each scenario:
+
+- off: the planner picks the QuestionTool, which then rewrites the question with Fido's breed
+- hit: the rewrite starts alongside planning, and the planner picks the QuestionTool with the user's question, so the
+  tool uses it
+- miss: the rewrite starts alongside planning, but the planner rephrases the question, so the rewrite is wasted and the
+  tool makes its own
+
+The planner is a scripted chat LLM, the tools' LLM a StubLLM, the search plugin a fake, and the KeyValueStore an
+in-memory stand-in, so no network access is needed. Run from the dog-trainer folder with:
+
+    python -m benchmarks.speculative_rewrite
+"""
+import argparse
+import time
+from typing import List
+
+import api
+from benchmarks.fake_search import FakeSearch
+from benchmarks.local_workspace import (
+    InMemoryKeyValueStore,
+    LocalClient,
+    use_local_key_value_stores,
+)
+from benchmarks.parallel_tools import (
+    DOGS,
+    OfflineChatHistory,
+    ScriptedChatLLM,
+    function_call,
+    tool_completion,
+)
+from benchmarks.stub_llm import StubLLM
+from speculation import speculation_stats
+from steamship import Block
+from steamship.agents.utils import with_llm
+from steamship.invocable import InvocationContext
+
+QUESTION = "How much should Fido eat?"
+
+ANSWER = "Fido should eat about a cup of food a day, split into two meals."
+
+SCENARIOS = {
+    "off": (False, QUESTION),
+    "hit": (True, QUESTION),
+    "miss": (True, "What is the right amount of food for Fido?"),
+}
+"""Whether speculation is enabled, and the question the planner passes to the QuestionTool, for each scenario."""
+
+
+def run(enabled: bool, planned_question: str, args: argparse.Namespace) -> dict:
+    service = api.DogTrainer(
+        client=LocalClient.for_workspace("speculative-rewrite"),
+        config={
+            "speculative_rewrite_enabled": enabled,
+            "model_routing_enabled": False,
+        },
+        context=InvocationContext(invocable_instance_handle="local-dog-trainer"),
+    )
+    agent = service.get_default_agent()
+    agent.llm = ScriptedChatLLM(
+        responses=[
+            function_call("QuestionTool", {"text": planned_question}),
+            ANSWER,
+        ],
+        seconds_per_call=args.planner_seconds,
+    )
+
+    replies: List[Block] = []
+    tool_llm = StubLLM(responder=tool_completion, seconds_per_call=args.llm_seconds)
+    context = with_llm(tool_llm)
+    context.client = service.client
+    context.llm_cache = context.action_cache = None
+    context.chat_history = OfflineChatHistory(QUESTION)
+    context.emit_funcs = [lambda blocks, metadata: replies.extend(blocks)]
+
+    before = speculation_stats()
+    started_at = time.perf_counter()
+    service.run_agent(agent, context)
+    seconds = time.perf_counter() - started_at
+    after = speculation_stats()
+    return {
+        "seconds": seconds,
+        "rewrite calls": tool_llm.calls,
+        "used": after["used"] - before["used"],
+        "wasted": after["wasted"] - before["wasted"],
+        "saved seconds": round(after["saved_seconds"] - before["saved_seconds"], 2),
+        "reply": [block.text for block in replies],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--planner-seconds", type=float, default=1.0)
+    parser.add_argument("--llm-seconds", type=float, default=0.5)
+    parser.add_argument("--search-seconds", type=float, default=1.0)
+    args = parser.parse_args()
+
+    use_local_key_value_stores(api)
+    InMemoryKeyValueStore(store_identifier="my-kv-store").set(
+        "prompt-arguments", {"dogs": DOGS, "version": "speculative-rewrite"}
+    )
+    LocalClient.plugins["serpapi-wrapper"] = FakeSearch(args.search_seconds)
+
+    for scenario, (enabled, planned_question) in SCENARIOS.items():
+        results = run(enabled, planned_question, args)
+        print(f"{scenario}:")
+        print(f"  {'latency':<16}{results['seconds']:.2f} s")
+        for name in ("rewrite calls", "used", "wasted", "saved seconds", "reply"):
+            print(f"  {name:<16}{results[name]}")
+
+
+if __name__ == "__main__":
+    main()
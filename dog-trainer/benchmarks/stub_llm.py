@@ -0,0 +1,77 @@
+"""Offline stand-ins for the OpenAI LLMs, used to benchmark the dog trainer without network access."""
+import re
+import time
+from typing import Callable, List, Optional
+
+from steamship import Block
+from steamship.agents.schema import LLM, ChatLLM, Tool
+
+
+def count_tokens(text: str) -> int:
+    """Approximate the number of tokens in `text` by counting words and punctuation marks."""
+    return len(re.findall(r"\w+|[^\w\s]", text or ""))
+
+
+class StubLLM(LLM):
+    """LLM that answers with canned completions after a simulated delay, keeping count of calls and tokens.
+
+    The simulated delay is a fixed per-call round trip plus a per-token cost for the generated completion, which is
+    roughly how hosted completion APIs behave.
+    """
+
+    responder: Callable[[str], str]
+    """Produces the completion for a prompt."""
+
+    seconds_per_call: float = 0.4
+    seconds_per_completion_token: float = 0.01
+
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    def complete(
+        self, prompt: str, stop: Optional[str] = None, **kwargs
+    ) -> List[Block]:
+        completion = self.responder(prompt)
+        completion_tokens = count_tokens(completion)
+        time.sleep(
+            self.seconds_per_call
+            + self.seconds_per_completion_token * completion_tokens
+        )
+
+        self.calls += 1
+        self.prompt_tokens += count_tokens(prompt)
+        self.completion_tokens += completion_tokens
+        return [Block(text=completion)]
+
+
+class StubChatLLM(ChatLLM):
+    """ChatLLM that answers with canned responses after a simulated delay, keeping count of calls and tokens.
+
+    Like StubLLM, the delay is a fixed round trip plus a per-token cost for the generated response.
+    """
+
+    responder: Callable[[List[Block]], str]
+    """Produces the response, such as a function call or a reply, to the chat messages."""
+
+    seconds_per_call: float = 1.0
+    seconds_per_completion_token: float = 0.01
+
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    def chat(
+        self, messages: List[Block], tools: Optional[List[Tool]], **kwargs
+    ) -> List[Block]:
+        response = self.responder(messages)
+        completion_tokens = count_tokens(response)
+        time.sleep(
+            self.seconds_per_call
+            + self.seconds_per_completion_token * completion_tokens
+        )
+
+        self.calls += 1
+        self.prompt_tokens += sum(count_tokens(message.text) for message in messages)
+        self.completion_tokens += completion_tokens
+        return [Block(text=response)]
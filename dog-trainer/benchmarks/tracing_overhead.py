@@ -0,0 +1,144 @@
+"""Measure what tracing the dog trainer's turns costs, and print the trace of one turn.
+
+Runs DogTrainer's agent end to end over the conversation of benchmarks/model_routing.py (hello, a question about
+Fido, a picture of Fido, thanks):
+
+- overhead: with every backend answering instantly, so that their latency doesn't hide the instrumentation's, the
+  mean time of a turn with no turns traced (a sample rate of 0) and with every turn traced (a sample rate of 1)
+- trace: the spans of the picture request, with the backends taking as long as in benchmarks/model_routing.py
+
+The models are stub LLMs, the search and Stable Diffusion plugins fakes, and the KeyValueStore an in-memory stand-in,
+so no network access is needed. Run from the dog-trainer folder with:
+
+    python -m benchmarks.tracing_overhead
+"""
+import argparse
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import api
+import tracing
+from benchmarks.fake_image_generator import FakeImageGenerator
+from benchmarks.fake_search import FakeSearch
+from benchmarks.local_workspace import (
+    InMemoryKeyValueStore,
+    LocalClient,
+    use_local_key_value_stores,
+)
+from benchmarks.model_routing import (
+    SECONDS_PER_CALL,
+    SECONDS_PER_COMPLETION_TOKEN,
+    TURNS,
+    plan,
+)
+from benchmarks.parallel_tools import DOGS, OfflineChatHistory, tool_completion
+from benchmarks.stub_llm import StubChatLLM, StubLLM
+from steamship.agents.schema import AgentContext
+from steamship.data.tags.tag_constants import RoleTag
+from steamship.invocable import InvocationContext
+
+PICTURE_TURN = "Show me a picture of Fido swimming"
+
+
+def stub_llm_factory(scale: float):
+    """Build stub LLMs that take `scale` times as long as those of benchmarks/model_routing.py."""
+
+    def stub_llm(model: str, chat: bool):
+        if chat:
+            return StubChatLLM(
+                responder=plan,
+                seconds_per_call=SECONDS_PER_CALL[model] * scale,
+                seconds_per_completion_token=SECONDS_PER_COMPLETION_TOKEN[model]
+                * scale,
+            )
+        return StubLLM(
+            responder=tool_completion,
+            seconds_per_call=SECONDS_PER_CALL[model] / 2 * scale,
+            seconds_per_completion_token=SECONDS_PER_COMPLETION_TOKEN[model] * scale,
+        )
+
+    return stub_llm
+
+
+def run(
+    turns: List[str], sample_rate: float, scale: float, args: argparse.Namespace
+) -> List[float]:
+    """Run the agent for each of `turns`, tracing a `sample_rate` fraction of them, and return each turn's seconds."""
+    LocalClient.plugins["serpapi-wrapper"] = FakeSearch(args.search_seconds * scale)
+    LocalClient.plugins["stable-diffusion"] = FakeImageGenerator(
+        args.image_seconds * scale
+    )
+    seconds = []
+    for turn in turns:
+        service = api.DogTrainer(
+            client=LocalClient.for_workspace("tracing-overhead"),
+            config={"tracing_sample_rate": sample_rate},
+            context=InvocationContext(invocable_instance_handle="local-dog-trainer"),
+        )
+        service.model_router.llm_factory = stub_llm_factory(scale)
+        agent = service.get_default_agent()
+        context = AgentContext()
+        context.client = service.client
+        context.llm_cache = context.action_cache = None
+        context.chat_history = OfflineChatHistory(turn)
+        context.chat_history.last_user_message.set_chat_role(RoleTag.USER)
+        context.emit_funcs = [lambda blocks, metadata: None]
+        started_at = time.perf_counter()
+        service.run_agent(agent, context)
+        seconds.append(time.perf_counter() - started_at)
+    return seconds
+
+
+def print_trace(spans: List[dict]):
+    children: Dict[str, List[dict]] = defaultdict(list)
+    for span in spans:
+        children[span["parent_id"]].append(span)
+
+    def print_span(span: dict, depth: int):
+        attributes = ", ".join(
+            f"{key}={value}" for key, value in span["attributes"].items()
+        )
+        print(
+            f"  {'  ' * depth + span['name']:<24}{span['duration_ms']:9.1f} ms  {attributes}"
+        )
+        for child in sorted(
+            children[span["span_id"]], key=lambda child: child["start_time_unix_nano"]
+        ):
+            print_span(child, depth + 1)
+
+    for root in children[None]:
+        print_span(root, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeats", type=int, default=25)
+    parser.add_argument("--search-seconds", type=float, default=1.0)
+    parser.add_argument("--image-seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    use_local_key_value_stores(api)
+    InMemoryKeyValueStore(store_identifier="my-kv-store").set(
+        "prompt-arguments", {"dogs": DOGS, "version": "tracing-overhead"}
+    )
+
+    # Warm up, so that neither sample rate pays for first-use costs.
+    run(TURNS, 1.0, 0.0, args)
+    print("overhead:")
+    means = {}
+    for sample_rate in (0.0, 1.0):
+        seconds = run(TURNS * args.repeats, sample_rate, 0.0, args)
+        means[sample_rate] = sum(seconds) / len(seconds)
+        print(
+            f"  {'sample rate ' + str(sample_rate):<24}{means[sample_rate] * 1000:9.2f} ms/turn"
+        )
+    print(f"  {'traced - untraced':<24}{(means[1.0] - means[0.0]) * 1000:9.2f} ms/turn")
+
+    run([PICTURE_TURN], 1.0, 1.0, args)
+    print(f"trace of {PICTURE_TURN!r}:")
+    print_trace(tracing.recent_traces()[-1])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Profile how much of each request's DogTrainer construction is spent building transports.
+
+Every request constructs the AgentService. Before transports were registered lazily, that meant constructing all
+three transports, even though a request only arrives on one. This compares:
+
+- eager: constructing the service and then every transport (the previous behavior)
+- lazy: constructing the service and then only the transport whose route was hit
+
+The KeyValueStore is an in-memory stand-in with a simulated round trip, since the Telegram transport reads its bot
+token from one when it is constructed. Run from the dog-trainer folder with:
+
+    python -m benchmarks.transport_startup
+"""
+import argparse
+import time
+from typing import List
+
+import api
+from benchmarks.local_workspace import (
+    InMemoryKeyValueStore,
+    LocalClient,
+    use_local_key_value_stores,
+)
+from lazy_mixins import LazyMixin
+from steamship.invocable import InvocationContext
+
+
+def construct() -> api.DogTrainer:
+    return api.DogTrainer(
+        client=LocalClient.for_workspace("transport-startup"),
+        config={},
+        context=InvocationContext(invocable_instance_handle="local-dog-trainer"),
+    )
+
+
+def transports(service: api.DogTrainer) -> List[LazyMixin]:
+    """The service's transports, leaving out the mixins it adds eagerly."""
+    return [mixin for mixin in service.mixins if isinstance(mixin, LazyMixin)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--kv-latency-ms", type=float, default=50.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    use_local_key_value_stores(api)
+    InMemoryKeyValueStore.latency_seconds = args.kv_latency_ms / 1000
+    construct()  # Warm the prepared prompt cache so only transport costs differ.
+
+    per_transport = {}
+    totals = {"eager": [], "lazy": []}
+    for i in range(args.repeat):
+        started_at = time.perf_counter()
+        service = construct()
+        for mixin in transports(service):
+            mixin.get()
+            per_transport.setdefault(mixin.mixin_class.__name__, []).append(
+                mixin.construction_seconds
+            )
+        totals["eager"].append(time.perf_counter() - started_at)
+
+        # A lazy request only pays for the transport it arrived on. Rotate through them.
+        started_at = time.perf_counter()
+        service = construct()
+        lazy_transports = transports(service)
+        lazy_transports[i % len(lazy_transports)].get()
+        totals["lazy"].append(time.perf_counter() - started_at)
+
+    print("Per-transport construction cost:")
+    for name, seconds in per_transport.items():
+        print(f"  {name:<28}{1000 * min(seconds):>10.2f} ms")
+    print("Per-request service construction (best / mean):")
+    for mode, seconds in totals.items():
+        print(
+            f"  {mode:<28}{1000 * min(seconds):>10.2f} ms"
+            f"{1000 * sum(seconds) / len(seconds):>10.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
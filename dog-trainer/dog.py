@@ -1,3 +1,5 @@
+from typing import List
+
 from pydantic.fields import Field
 from pydantic.main import BaseModel
 
@@ -10,3 +12,6 @@ class Dog(BaseModel):
     description: str = Field(
         default="description", description="Description of the dog's personality."
     )
+    aliases: List[str] = Field(
+        default=[], description="Nicknames the dog's owner also uses for the dog."
+    )
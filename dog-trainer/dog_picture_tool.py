@@ -1,14 +1,16 @@
 """Tool for generating images."""
 import json
-from typing import Any, List, Union
+import logging
+import re
+from typing import Any, List, Optional, Union
 
 from dog import Dog
+from dog_registry import DogRegistry
+from image_jobs import run_image_tool
+from model_router import REWRITE_ROUTE, route_llm
+from speculation import take_speculative_rewrite
 from steamship import Block, Task
-from steamship.agents.llms import OpenAI
 from steamship.agents.schema import AgentContext, Tool
-from steamship.agents.tools.image_generation.stable_diffusion import StableDiffusionTool
-from steamship.agents.utils import get_llm
-from steamship.utils.repl import ToolREPL
 
 PHOTO_REQUEST_REWRITE = """Please rephrase the photo topic below so that it includes specific information about the dog breed and dog description.
 
@@ -22,13 +24,7 @@ REQUEST: {request}
 
 REWRITTEN REQUEST:"""
 
-PROMPT_TOOL = """Please act as a prompt generator for a generative AI called "Stable Diffusion". Stable Diffusion generates images based on given prompts.
-
-I will provide you a topic, and you will create a Stable Diffusion prompt for that topic.
-
-IMPORTANT: Provide ONLY the prompt in response!
-
-## Basic information required to write good Stable Diffusion prompts
+STABLE_DIFFUSION_PROMPT_ADVICE = """## Basic information required to write good Stable Diffusion prompts
 
 ### Prompt structure
 
@@ -47,7 +43,18 @@ IMPORTANT: Provide ONLY the prompt in response!
 - Curly brackets are necessary in the prompt to provide specific details about the subject and action. These details are important for generating a high-quality image.
 - Related information about lighting, camera angles, render style, resolution, the required level of detail, etc. should be included at the end of the prompt.
 - Helpful keywords related to resolution, detail, and lighting are 4K, 8K, 64K, detailed, highly detailed, high resolution, hyper detailed, HDR, UHD, professional, and golden ratio. Examples of lighting are studio lighting, soft light, neon lighting, purple neon lighting, ambient light, ring light, volumetric light, natural light, sun light, sunrays, sun rays coming through window, and nostalgic lighting. Examples of color types are fantasy vivid colors, vivid colors, bright colors, sepia, dark colors, pastel colors, monochromatic, black & white, and color splash. Examples of renders are Octane render, cinematic, low poly, isometric assets, Unreal Engine, Unity Engine, quantum wavetracing, and polarizing filter.
-- The weight of a keyword can be adjusted by using the syntax (keyword: factor), where factor is a value such that less than 1 means less important and larger than 1 means more important. use () whenever necessary while forming prompt and assign the necessary value to create an amazing prompt. Examples of weight for a keyword are (soothing tones:1.25), (hdr:1.25), (artstation:1.2),(intricate details:1.14), (hyperrealistic 3d render:1.16), (filmic:0.55), (rutkowski:1.1), (faded:1.3)
+- The weight of a keyword can be adjusted by using the syntax (keyword: factor), where factor is a value such that less than 1 means less important and larger than 1 means more important. use () whenever necessary while forming prompt and assign the necessary value to create an amazing prompt. Examples of weight for a keyword are (soothing tones:1.25), (hdr:1.25), (artstation:1.2),(intricate details:1.14), (hyperrealistic 3d render:1.16), (filmic:0.55), (rutkowski:1.1), (faded:1.3)"""
+
+PROMPT_TOOL = (
+    """Please act as a prompt generator for a generative AI called "Stable Diffusion". Stable Diffusion generates images based on given prompts.
+
+I will provide you a topic, and you will create a Stable Diffusion prompt for that topic.
+
+IMPORTANT: Provide ONLY the prompt in response!
+
+"""
+    + STABLE_DIFFUSION_PROMPT_ADVICE
+    + """
 
 The prompts you provide will be in English.
 
@@ -62,6 +69,33 @@ Are you ready?
 Topic: {topic}
 Prompt:
 """
+)
+
+FUSED_PHOTO_PROMPT = (
+    """Please act as a prompt generator for a generative AI called "Stable Diffusion". Stable Diffusion generates images based on given prompts.
+
+You know about the following dogs:
+
+{dogs}
+
+I will provide you a request for a picture. First, rewrite the request so that it has the breed and description of any dog it mentions. Then create a Stable Diffusion prompt for the rewritten request.
+
+"""
+    + STABLE_DIFFUSION_PROMPT_ADVICE
+    + """
+
+The prompts you provide will be in English. It is important to create detailed prompts with as much information as possible.
+
+Respond with a single JSON object and nothing else, in the form:
+
+{{"rewritten_request": "<the rewritten request>", "prompt": "<the Stable Diffusion prompt>"}}
+
+REQUEST: {request}
+
+JSON:"""
+)
+
+IMAGE_JOB_ACKNOWLEDGEMENT = "On it! I'll send you the picture as soon as it's ready."
 
 
 class DogPictureTool(Tool):
@@ -82,12 +116,36 @@ class DogPictureTool(Tool):
 
     dogs: List[Dog]
 
-    def dog_list_as_json_bullets(self) -> str:
-        """Return the list of dogs we know about as JSON bullet points.
+    fused_rewrite: bool = True
+    """Whether to rewrite the request and write the Stable Diffusion prompt in a single LLM completion.
 
-        LLMs don't care if we speak in English or JSON, so this is a perfectly fine way to enumerate them.
-        """
-        return "\n".join([f"- {json.dumps(dog.dict())}" for dog in self.dogs])
+    If the single completion can't be parsed, the tool falls back to the two-step rewrite.
+    """
+
+    registry: Optional[DogRegistry] = None
+    """Index of `dogs` by name. Pass one in to share it between tools; otherwise it is built on first use."""
+
+    deterministic_rewrite: bool = False
+    """Whether to replace dog names with their breed and description directly, instead of asking the LLM."""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def get_registry(self) -> DogRegistry:
+        if self.registry is None:
+            self.registry = DogRegistry(self.dogs)
+        return self.registry
+
+    def dog_list_as_json_bullets(self, dogs: Optional[List[Dog]] = None) -> str:
+        """Return the list of dogs we know about (or just `dogs`, if provided) as JSON bullet points."""
+        return self.get_registry().as_json_bullets(dogs)
+
+    @staticmethod
+    def describe_dog(dog: Dog) -> str:
+        """Describe a dog's appearance for a picture, in place of its name."""
+        if dog.description and dog.description != "description":
+            return f"a {dog.breed} ({dog.description})"
+        return f"a {dog.breed}"
 
     def rewrite_photo_request_with_better_details(
         self, request: str, context: AgentContext
@@ -96,36 +154,104 @@ class DogPictureTool(Tool):
 
         For example, if the user says: "Give me a picture of Barky swimming"
         We want the rewrite to be something like: "Picture of a chocolate labrador with shaggy hair swimming"
+
+        If the request doesn't mention any dog we know about, there is nothing to rewrite and the LLM isn't called.
+        Otherwise only the dogs that are mentioned are sent to the LLM.
         """
-        llm = get_llm(context, default=OpenAI(client=context.client))
-        dogs = self.dog_list_as_json_bullets()
+        registry = self.get_registry()
+        mentioned_dogs = registry.find(request)
+        if not mentioned_dogs:
+            return request
+        if self.deterministic_rewrite:
+            return registry.substitute(request, self.describe_dog)
+
+        llm = route_llm(context, REWRITE_ROUTE)
+        dogs = self.dog_list_as_json_bullets(mentioned_dogs)
         photo_request = llm.complete(
             PHOTO_REQUEST_REWRITE.format(dogs=dogs, request=request)
         )[0].text.strip()
         return photo_request
 
+    def write_stable_diffusion_prompt(
+        self, photo_request: str, context: AgentContext
+    ) -> str:
+        """Turn an (already rewritten) photo request into a detailed Stable Diffusion prompt."""
+        llm = route_llm(context, REWRITE_ROUTE)
+        return llm.complete(PROMPT_TOOL.format(topic=photo_request))[0].text.strip()
+
+    def write_fused_stable_diffusion_prompt(
+        self, request: str, context: AgentContext, dogs: Optional[List[Dog]] = None
+    ) -> Optional[str]:
+        """Rewrite a photo request and turn it into a Stable Diffusion prompt with a single LLM completion.
+
+        Only `dogs` are described to the LLM, if provided. Returns None if the completion isn't the JSON object we
+        asked for.
+        """
+        llm = route_llm(context, REWRITE_ROUTE)
+        dogs = self.dog_list_as_json_bullets(dogs)
+        completion = llm.complete(
+            FUSED_PHOTO_PROMPT.format(dogs=dogs, request=request)
+        )[0].text
+        match = re.search(r"\{.*\}", completion or "", re.DOTALL)
+        try:
+            sd_prompt = json.loads(match.group(0)).get("prompt") if match else None
+        except (ValueError, AttributeError):
+            sd_prompt = None
+        if not isinstance(sd_prompt, str) or not sd_prompt.strip():
+            return None
+        return sd_prompt.strip()
+
+    def stable_diffusion_prompt(self, request: str, context: AgentContext) -> str:
+        """Return the Stable Diffusion prompt for a photo request, using one LLM call where possible."""
+        mentioned_dogs = self.get_registry().find(request)
+        if self.fused_rewrite and mentioned_dogs and not self.deterministic_rewrite:
+            sd_prompt = self.write_fused_stable_diffusion_prompt(
+                request, context, mentioned_dogs
+            )
+            if sd_prompt is not None:
+                return sd_prompt
+            logging.warning(
+                "Could not parse a Stable Diffusion prompt from the fused rewrite. Falling back to two steps."
+            )
+
+        # Rewrite the photo request with information about the breed and description
+        photo_request = self.rewrite_photo_request_with_better_details(request, context)
+
+        # Create a stable diffusion prompt for the image
+        return self.write_stable_diffusion_prompt(photo_request, context)
+
     def run(
         self, tool_input: List[Block], context: AgentContext
     ) -> Union[List[Block], Task[Any]]:
-        # Rewrite the photo request with information about the breed and description
-        photo_request = self.rewrite_photo_request_with_better_details(
-            tool_input[0].text, context
+        # The prompt may already have been written while the agent was planning. See speculation.py.
+        sd_prompt = take_speculative_rewrite(
+            context, self.name, tool_input[0].text
+        ) or self.stable_diffusion_prompt(tool_input[0].text, context)
+
+        # Deferred so that loading the agent doesn't import tool modules until a request needs them.
+        from steamship.agents.tools.image_generation.stable_diffusion import (
+            StableDiffusionTool,
         )
 
-        # Create a stable diffusion prompt for the image
-        llm = get_llm(context, default=OpenAI(client=context.client))
-        sd_prompt = llm.complete(PROMPT_TOOL.format(topic=photo_request))[
-            0
-        ].text.strip()
-
         # Run and return the StableDiffusionTool response
         stable_diffusion_tool = StableDiffusionTool()
 
-        # Now return the results of running Stable Diffusion on those modified prompts.
-        return stable_diffusion_tool.run([Block(text=sd_prompt)], context)
+        # Now return the results of running Stable Diffusion on those modified prompts. A previously generated picture
+        # for the same prompt may be reused, and on Slack and Telegram the picture may be generated in the background
+        # and sent when it's ready. See image_jobs.py.
+        sd_input = [Block(text=sd_prompt)]
+        return run_image_tool(
+            stable_diffusion_tool,
+            sd_input,
+            context,
+            IMAGE_JOB_ACKNOWLEDGEMENT,
+            lambda: stable_diffusion_tool.run(sd_input, context),
+        )
 
 
 if __name__ == "__main__":
+    from steamship.utils.repl import ToolREPL
+
     print("Try running with an input like 'Fido'")
     ToolREPL(
         DogPictureTool(
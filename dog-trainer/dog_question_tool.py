@@ -1,14 +1,12 @@
 """Tool for generating images."""
-import json
-from typing import Any, List, Union
+from typing import Any, List, Optional, Union
 
 from dog import Dog
+from dog_registry import DogRegistry
+from model_router import REWRITE_ROUTE, route_llm
+from speculation import take_speculative_rewrite
 from steamship import Block, Task
-from steamship.agents.llms import OpenAI
 from steamship.agents.schema import AgentContext, Tool
-from steamship.agents.tools.search import SearchTool
-from steamship.agents.utils import get_llm
-from steamship.utils.repl import ToolREPL
 
 QUESTION_REWRITE = """Please rephrase the question below so that it includes specific information about the dog breed and dog description.
 
@@ -35,12 +33,23 @@ class DogQuestionTool(Tool):
 
     dogs: List[Dog]
 
-    def dog_list_as_json_bullets(self) -> str:
-        """Return the list of dogs we know about as JSON bullet points.
+    registry: Optional[DogRegistry] = None
+    """Index of `dogs` by name. Pass one in to share it between tools; otherwise it is built on first use."""
 
-        LLMs don't care if we speak in English or JSON, so this is a perfectly fine way to enumerate them.
-        """
-        return "\n".join([f"- {json.dumps(dog.dict())}" for dog in self.dogs])
+    deterministic_rewrite: bool = False
+    """Whether to replace dog names with their breed directly, instead of asking the LLM to rewrite the question."""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def get_registry(self) -> DogRegistry:
+        if self.registry is None:
+            self.registry = DogRegistry(self.dogs)
+        return self.registry
+
+    def dog_list_as_json_bullets(self, dogs: Optional[List[Dog]] = None) -> str:
+        """Return the list of dogs we know about (or just `dogs`, if provided) as JSON bullet points."""
+        return self.get_registry().as_json_bullets(dogs)
 
     def rewrite_question_with_better_details(
         self, request: str, context: AgentContext
@@ -49,9 +58,19 @@ class DogQuestionTool(Tool):
 
         For example, if the user says: "How much should Barky eat?"
         We want the rewrite to be something like: "How much should a  chocolate labrador that is 2 years old eat?"
+
+        If the question doesn't mention any dog we know about, there is nothing to rewrite and the LLM isn't called.
+        Otherwise only the dogs that are mentioned are sent to the LLM.
         """
-        llm = get_llm(context, default=OpenAI(client=context.client))
-        dogs = self.dog_list_as_json_bullets()
+        registry = self.get_registry()
+        mentioned_dogs = registry.find(request)
+        if not mentioned_dogs:
+            return request
+        if self.deterministic_rewrite:
+            return registry.substitute(request, lambda dog: f"a {dog.breed}")
+
+        llm = route_llm(context, REWRITE_ROUTE)
+        dogs = self.dog_list_as_json_bullets(mentioned_dogs)
         rewritten_question = llm.complete(
             QUESTION_REWRITE.format(dogs=dogs, request=request)
         )[0].text.strip()
@@ -60,10 +79,14 @@ class DogQuestionTool(Tool):
     def run(
         self, tool_input: List[Block], context: AgentContext
     ) -> Union[List[Block], Task[Any]]:
-        # Rewrite the question with information about the breed and description
-        rewritten_question = self.rewrite_question_with_better_details(
-            tool_input[0].text, context
-        )
+        # Rewrite the question with information about the breed and description, unless the rewrite was already
+        # started while the agent was planning. See speculation.py.
+        rewritten_question = take_speculative_rewrite(
+            context, self.name, tool_input[0].text
+        ) or self.rewrite_question_with_better_details(tool_input[0].text, context)
+
+        # Deferred so that loading the agent doesn't import tool modules until a request needs them.
+        from steamship.agents.tools.search import SearchTool
 
         # Now return the results of issuing that question to Google
         search_tool = SearchTool()
@@ -71,6 +94,8 @@ class DogQuestionTool(Tool):
 
 
 if __name__ == "__main__":
+    from steamship.utils.repl import ToolREPL
+
     print("Try running with an input like 'Fido'")
     ToolREPL(
         DogQuestionTool(
@@ -0,0 +1,105 @@
+"""In-memory index of the dogs an agent knows about, searchable by name."""
+import difflib
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dog import Dog
+from dog_roster import DogRoster
+
+FUZZY_MATCH_CUTOFF = 0.85
+"""How similar (0-1) a word must be to a dog's name to count as a misspelling of it."""
+
+FUZZY_MATCH_MIN_LENGTH = 4
+"""Words shorter than this are only matched exactly. Short words are too easily confused with one another."""
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"\w+", (text or "").casefold())
+
+
+class DogRegistry:
+    """Finds which known dogs a piece of text is talking about.
+
+    Dogs are indexed by their name and any aliases, case-insensitively. Names with several words ("Mister Biggs")
+    are supported, as are small misspellings of single-word names ("Fidoo").
+
+    This lets the dog tools skip the LLM rewrite entirely when a request doesn't mention any of our dogs, and send
+    only the dogs that are mentioned when it does.
+    """
+
+    dogs: List[Dog]
+
+    roster: DogRoster
+    """The prompt fragments for `dogs`, in the same order."""
+
+    def __init__(self, dogs: List[Dog], roster: Optional[DogRoster] = None):
+        self.dogs = list(dogs)
+        if roster is None or len(roster) != len(self.dogs):
+            roster = DogRoster.from_dogs(self.dogs)
+        self.roster = roster
+        self._positions = {id(dog): i for i, dog in enumerate(self.dogs)}
+        self._index: Dict[str, Dog] = {}
+        for dog in self.dogs:
+            for name in [dog.name, *dog.aliases]:
+                key = " ".join(_words(name))
+                if key:
+                    self._index.setdefault(key, dog)
+        self._max_name_words = max(
+            (len(key.split(" ")) for key in self._index), default=0
+        )
+        self._single_word_names = [key for key in self._index if " " not in key]
+
+    def _lookup(self, phrase: str) -> Optional[Dog]:
+        if phrase in self._index:
+            return self._index[phrase]
+        if " " in phrase or len(phrase) < FUZZY_MATCH_MIN_LENGTH:
+            return None
+        close = difflib.get_close_matches(
+            phrase, self._single_word_names, n=1, cutoff=FUZZY_MATCH_CUTOFF
+        )
+        return self._index[close[0]] if close else None
+
+    def mentions(self, text: str) -> List[Tuple[int, int, Dog]]:
+        """Return the (start, end, dog) spans in `text` that refer to a known dog, in order of appearance.
+
+        Longer names win over shorter ones, so "Mister Biggs" is found as a single mention.
+        """
+        tokens = list(re.finditer(r"\w+", text or ""))
+        found = []
+        i = 0
+        while i < len(tokens):
+            for n in range(min(self._max_name_words, len(tokens) - i), 0, -1):
+                phrase = " ".join(t.group(0).casefold() for t in tokens[i : i + n])
+                dog = self._lookup(phrase)
+                if dog is not None:
+                    found.append((tokens[i].start(), tokens[i + n - 1].end(), dog))
+                    i += n
+                    break
+            else:
+                i += 1
+        return found
+
+    def find(self, text: str) -> List[Dog]:
+        """Return the known dogs mentioned in `text`, without duplicates, in the order they are mentioned."""
+        dogs = []
+        for _, _, dog in self.mentions(text):
+            if all(dog is not seen for seen in dogs):
+                dogs.append(dog)
+        return dogs
+
+    def substitute(self, text: str, describe: Callable[[Dog], str]) -> str:
+        """Replace every mention of a known dog in `text` with `describe(dog)`."""
+        for start, end, dog in reversed(self.mentions(text)):
+            text = f"{text[:start]}{describe(dog)}{text[end:]}"
+        return text
+
+    def as_json_bullets(self, dogs: Optional[List[Dog]] = None) -> str:
+        """Return all dogs (or just `dogs`, if provided) as JSON bullet points, using the precomputed roster.
+
+        LLMs don't care if we speak in English or JSON, so this is a perfectly fine way to enumerate them.
+        """
+        if dogs is None:
+            return self.roster.bullets()
+        if all(id(dog) in self._positions for dog in dogs):
+            return self.roster.bullets(self._positions[id(dog)] for dog in dogs)
+        return DogRoster.from_dogs(dogs).bullets()
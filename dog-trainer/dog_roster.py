@@ -0,0 +1,58 @@
+"""Precomputed prompt fragments for the dogs an agent knows about."""
+import hashlib
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from dog import Dog
+
+
+class DogRoster:
+    """An immutable list of dogs, each already serialized to the JSON bullet point used in prompts.
+
+    Serializing every dog on every tool call and prompt build adds up for owners with large kennels. The roster is
+    built once, when the dogs are set, and saved alongside them so that later requests only join strings.
+
+    The `version` is a hash of the fragments, which changes whenever any dog does.
+    """
+
+    __slots__ = ("fragments", "version")
+
+    fragments: Tuple[str, ...]
+    version: str
+
+    def __init__(self, fragments: Iterable[str]):
+        fragments = tuple(fragments)
+        object.__setattr__(self, "fragments", fragments)
+        object.__setattr__(self, "version", DogRoster.version_of(fragments))
+
+    def __setattr__(self, name: str, value: Any):
+        raise AttributeError("DogRoster is immutable")
+
+    def __len__(self) -> int:
+        return len(self.fragments)
+
+    @staticmethod
+    def version_of(fragments: Tuple[str, ...]) -> str:
+        return hashlib.sha256("\n".join(fragments).encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def from_dogs(dogs: List[Dog]) -> "DogRoster":
+        """Serialize each dog once."""
+        return DogRoster(f"- {json.dumps(dog.dict())}" for dog in dogs)
+
+    @staticmethod
+    def from_dict(data: Optional[Dict[str, Any]]) -> Optional["DogRoster"]:
+        """Load a roster saved with `to_dict`, or return None if there isn't a valid one."""
+        if not data or not isinstance(data.get("fragments"), list):
+            return None
+        roster = DogRoster(data["fragments"])
+        return roster if roster.version == data.get("version") else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"version": self.version, "fragments": list(self.fragments)}
+
+    def bullets(self, positions: Optional[Iterable[int]] = None) -> str:
+        """Return the JSON bullet points for all dogs, or only those at `positions`."""
+        if positions is None:
+            return "\n".join(self.fragments)
+        return "\n".join(self.fragments[i] for i in positions)
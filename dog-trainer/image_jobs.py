@@ -0,0 +1,377 @@
+"""Generate images in the background on Slack and Telegram, acknowledging the request straight away.
+
+An image takes Stable Diffusion long enough that Slack and Telegram often give up on the webhook before the agent has
+answered, and retry it. With an ImageJobs attached to the AgentContext, an image tool instead starts the generation
+Task, answers at once with an acknowledgement, and the finished image is pushed to the chat through the transport:
+
+- In a deployed instance, the ImageJobsMixin's `/deliver_image_job` endpoint is scheduled to run once the Task is done.
+- Elsewhere (e.g. when running locally), a background thread waits for the Task.
+
+Requests from the Steamship web widget, which has no way to push a message later, still wait for the image.
+
+Each workspace runs about `max_concurrent_jobs` image jobs at once. A request beyond that is told to try again
+shortly, rather than queueing more work behind a slow generator. The cap is best-effort: KeyValueStore has no atomic
+updates, so requests in several processes that start jobs at the same moment may read slightly out of date job lists.
+
+`run_image_tool` is how image tools use this: it answers from the ImageCache (see image_cache.py) when it can, then
+tries a background job, and otherwise generates the image while the request waits.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from image_cache import ImageCache, get_image_cache
+from steamship import Block, Task, TaskState
+from steamship.agents.schema import AgentContext
+from steamship.invocable import PackageService, get, post
+from steamship.invocable.package_mixin import PackageMixin
+from steamship.utils.kv_store import KeyValueStore
+
+IMAGE_JOBS_STORE_IDENTIFIER = "image-jobs"
+
+_IMAGE_JOBS_KEY = "image_jobs"
+
+PUSH_TRANSPORTS = {
+    "steamship.agents.mixins.transports.slack": "SlackTransport",
+    "steamship.agents.mixins.transports.telegram": "TelegramTransport",
+}
+"""The transports that can send a message after the request has been answered, by the module their emit functions
+are defined in."""
+
+BUSY_MESSAGE = "I'm already working on a few pictures. Ask me again in a minute!"
+
+FAILED_MESSAGE = "Sorry, I couldn't make that picture."
+
+_COUNTERS = {"started": 0, "delivered": 0, "failed": 0, "busy": 0}
+_COUNTERS_LOCK = threading.Lock()
+
+
+def with_image_jobs(image_jobs: "ImageJobs", context: AgentContext) -> AgentContext:
+    """Let the image tools run for `context` generate in the background with `image_jobs`."""
+    context.metadata[_IMAGE_JOBS_KEY] = image_jobs
+    return context
+
+
+def get_image_jobs(context: AgentContext) -> Optional["ImageJobs"]:
+    """Retrieve the ImageJobs set on `context` with `with_image_jobs`, if any."""
+    return context.metadata.get(_IMAGE_JOBS_KEY)
+
+
+def push_target(context: AgentContext) -> Optional[Dict[str, Any]]:
+    """Describe where to push an image for `context` later, or return None if its transport can't push."""
+    transports = {
+        PUSH_TRANSPORTS.get(getattr(emit_func, "__module__", None))
+        for emit_func in context.emit_funcs
+    } - {None}
+    message = context.chat_history.last_user_message
+    if not transports or message is None or message.chat_id is None:
+        return None
+    return {
+        "transport": min(transports),
+        "chat_id": message.chat_id,
+        "thread_ts": (context.metadata.get("slack") or {}).get("thread_ts"),
+    }
+
+
+def run_image_tool(
+    tool: Any,
+    tool_input: List[Block],
+    context: AgentContext,
+    acknowledgement: str,
+    run: Callable[[], List[Block]],
+) -> List[Block]:
+    """Answer a request for an image made by `tool`, a GeneratorTool, from the first text block of `tool_input`.
+
+    Uses the ImageCache and ImageJobs set on `context`, if any, and otherwise calls `run`, which runs `tool` as usual.
+    """
+    image_cache = get_image_cache(context)
+    prompts = [block.text for block in tool_input if block.is_text()]
+    cache_key = None
+    if image_cache is not None and prompts:
+        cache_key = ImageCache.key_for(
+            prompts[0], tool.generator_plugin_handle, tool.generator_plugin_config
+        )
+        cached = image_cache.get(cache_key)
+        if cached is not None:
+            cached.client = context.client
+            return [cached]
+
+    image_jobs = get_image_jobs(context)
+    if image_jobs is not None:
+        blocks = image_jobs.start(
+            tool, tool_input, context, acknowledgement, cache_key=cache_key
+        )
+        if blocks is not None:
+            return blocks
+
+    blocks = run()
+    if cache_key is not None:
+        for block in blocks:
+            if block.is_image():
+                image_cache.put(cache_key, block)
+                block.tags = list(block.tags or []) + [image_cache.cache_tag("MISS")]
+    return blocks
+
+
+class ImageJobs:
+    """Runs image generation Tasks in the background, about `max_concurrent_jobs` at a time per workspace.
+
+    Each job in progress holds a slot: a record of its own in `IMAGE_JOBS_STORE_IDENTIFIER`, under JOB_PREFIX and its id.
+    Counters of how jobs went are kept per process.
+    """
+
+    JOB_TIMEOUT_SECONDS = 600
+    """How long a job holds its slot if it is never delivered (because its process died, for example)."""
+
+    JOB_PREFIX = "job:"
+
+    def __init__(
+        self,
+        service: PackageService,
+        max_concurrent_jobs: int = 2,
+        image_cache: Optional[ImageCache] = None,
+    ):
+        self.service = service
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.image_cache = image_cache
+        """Where to keep finished images, for jobs started with a `cache_key`."""
+        self._store: Optional[KeyValueStore] = None
+
+    @property
+    def store(self) -> KeyValueStore:
+        if self._store is None:
+            self._store = KeyValueStore(
+                self.service.client, store_identifier=IMAGE_JOBS_STORE_IDENTIFIER
+            )
+        return self._store
+
+    def _jobs(self) -> List[tuple]:
+        """Return the ids of the jobs in progress, oldest first, dropping jobs that have timed out."""
+        now = time.time()
+        jobs = []
+        for key, job in self.store.items():
+            if not key.startswith(self.JOB_PREFIX):
+                continue
+            if job["expires_at"] > now:
+                jobs.append((job["started_at"], key[len(self.JOB_PREFIX) :]))
+            else:
+                self.store.delete(key)
+        return [job_id for _, job_id in sorted(jobs)]
+
+    @staticmethod
+    def _count(counter: str):
+        with _COUNTERS_LOCK:
+            _COUNTERS[counter] += 1
+
+    def _claim(self) -> Optional[str]:
+        """Take a job slot and return the job's id, or return None if all slots are taken.
+
+        The job's slot is written first, and kept only if it is among the `max_concurrent_jobs` oldest jobs, so two
+        processes claiming the last slot at once can't both keep it unless one reads the store before the other's write
+        shows up in it.
+        """
+        job_id = uuid.uuid4().hex
+        started_at = time.time()
+        self.store.set(
+            self.JOB_PREFIX + job_id,
+            {
+                "started_at": started_at,
+                "expires_at": started_at + self.JOB_TIMEOUT_SECONDS,
+            },
+        )
+        if job_id not in self._jobs()[: self.max_concurrent_jobs]:
+            self.store.delete(self.JOB_PREFIX + job_id)
+            self._count("busy")
+            return None
+        self._count("started")
+        return job_id
+
+    def _release(self, job_id: str, counter: str):
+        """Give up a job's slot, counting how it went."""
+        self.store.delete(self.JOB_PREFIX + job_id)
+        self._count(counter)
+
+    def start(
+        self,
+        tool: Any,
+        tool_input: List[Block],
+        context: AgentContext,
+        acknowledgement: str,
+        cache_key: Optional[str] = None,
+    ) -> Optional[List[Block]]:
+        """Start generating the image for the first text block of `tool_input` with `tool`, a GeneratorTool.
+
+        Returns the blocks to answer the request with now: `acknowledgement`, or a message asking the user to wait if
+        too many images are being generated. Returns None if the image can't be pushed later, in which case the
+        caller should run `tool` as usual. The finished image is cached under `cache_key`, if given.
+        """
+        target = push_target(context)
+        prompts = [block.text for block in tool_input if block.is_text()]
+        if target is None or not prompts:
+            return None
+
+        job_id = self._claim()
+        if job_id is None:
+            return [Block(text=BUSY_MESSAGE)]
+
+        try:
+            generator = context.client.use_plugin(
+                plugin_handle=tool.generator_plugin_handle,
+                instance_handle=tool.generator_plugin_instance_handle,
+                config=tool.generator_plugin_config,
+            )
+            task = generator.generate(
+                text=prompts[0],
+                append_output_to_file=True,
+                make_output_public=tool.make_output_public,
+            )
+            self._schedule_delivery(job_id, tool, task, context, target, cache_key)
+        except BaseException:
+            # Nothing will deliver the job, so give its slot back now rather than when it times out.
+            self._release(job_id, "failed")
+            raise
+        logging.info(f"Started image job {job_id} for {target['transport']}")
+        return [Block(text=acknowledgement)]
+
+    def _schedule_delivery(
+        self,
+        job_id: str,
+        tool: Any,
+        task: Task,
+        context: AgentContext,
+        target: Dict[str, Any],
+        cache_key: Optional[str],
+    ):
+        """Arrange for the image of `task` to be sent to `target` once it is generated."""
+        invocation = self.service.context
+        if (
+            task.task_id is not None
+            and invocation is not None
+            and invocation.invocable_instance_handle is not None
+        ):
+            self.service.invoke_later(
+                "deliver_image_job",
+                wait_on_tasks=[task],
+                arguments={
+                    "job_id": job_id,
+                    "task_id": task.task_id,
+                    "target": target,
+                    "cache_key": cache_key,
+                },
+            )
+        else:
+            # Outside a deployed instance, there is no task queue to schedule delivery on.
+            threading.Thread(
+                target=self._wait_and_emit,
+                args=(job_id, tool, task, context, cache_key),
+                daemon=True,
+            ).start()
+
+    def _cache(self, cache_key: Optional[str], blocks: List[Block]):
+        """Keep the images of a finished job in the image cache, if it was started with a `cache_key`."""
+        if self.image_cache is None or cache_key is None:
+            return
+        for block in blocks:
+            if block.is_image():
+                self.image_cache.put(cache_key, block)
+
+    def _wait_and_emit(
+        self,
+        job_id: str,
+        tool: Any,
+        task: Task,
+        context: AgentContext,
+        cache_key: Optional[str] = None,
+    ):
+        """Wait for `task` in this process, and emit its image through `context`'s emit functions."""
+        try:
+            task.wait()
+            blocks = tool.post_process(task, context)
+            self._cache(cache_key, blocks)
+            counter = "delivered"
+        except Exception as e:
+            logging.exception(f"Image job {job_id} failed: {e}")
+            blocks, counter = [Block(text=FAILED_MESSAGE)], "failed"
+        try:
+            for emit_func in context.emit_funcs:
+                emit_func(blocks, context.metadata)
+        finally:
+            self._release(job_id, counter)
+
+    def deliver(
+        self,
+        job_id: str,
+        task_id: str,
+        target: Dict[str, Any],
+        cache_key: Optional[str] = None,
+    ):
+        """Send the image generated by Task `task_id` to the chat described by `target` (see `push_target`)."""
+        counter = "failed"
+        try:
+            task = Task.get(self.service.client, _id=task_id)
+            if task.state == TaskState.succeeded:
+                output = task.output
+                if isinstance(output, str):
+                    output = json.loads(output)
+                blocks = [
+                    Block.parse_obj(block) if isinstance(block, dict) else block
+                    for block in (output or {}).get("blocks") or []
+                ]
+                self._cache(cache_key, blocks)
+                counter = "delivered"
+            else:
+                logging.error(f"Image job {job_id} failed: {task.status_message}")
+                blocks = [Block(text=FAILED_MESSAGE)]
+            for block in blocks:
+                block.client = self.service.client
+                block.set_chat_id(target["chat_id"])
+                if target.get("thread_ts"):
+                    block.set_thread_id(target["thread_ts"])
+            self.transport(target["transport"]).send(blocks)
+        finally:
+            self._release(job_id, counter)
+
+    def transport(self, name: str) -> Any:
+        """Return the service's transport mixin of class `name`."""
+        for mixin in self.service.mixins:
+            if getattr(mixin, "mixin_class", type(mixin)).__name__ == name:
+                return mixin.get() if hasattr(mixin, "mixin_class") else mixin
+        raise ValueError(f"This agent has no {name}")
+
+    def stats(self) -> Dict[str, int]:
+        """Return how many image jobs are in progress, and how many this process started, delivered, failed or turned
+        away."""
+        with _COUNTERS_LOCK:
+            counters = dict(_COUNTERS)
+        return {
+            **counters,
+            "in_progress": len(self._jobs()),
+            "max_concurrent_jobs": self.max_concurrent_jobs,
+        }
+
+
+class ImageJobsMixin(PackageMixin):
+    """Provides the endpoint that delivers images generated in the background, and one that reports on image jobs."""
+
+    def __init__(self, image_jobs: ImageJobs):
+        self.image_jobs = image_jobs
+
+    @post("deliver_image_job")
+    def deliver_image_job(
+        self,
+        job_id: str,
+        task_id: str,
+        target: dict,
+        cache_key: Optional[str] = None,
+    ) -> dict:
+        """Send a finished image to the chat that asked for it."""
+        self.image_jobs.deliver(job_id, task_id, target, cache_key)
+        return {"job_id": job_id}
+
+    @get("image_job_stats")
+    def image_job_stats(self) -> dict:
+        """Return how many images are being generated in the background, and how earlier image jobs went."""
+        return self.image_jobs.stats()
@@ -0,0 +1,291 @@
+"""Send each of the agent's LLM calls to the cheapest model that can do it well.
+
+The dog trainer makes three kinds of LLM call, which the ModelRouter calls routes:
+
+- planning: deciding which tool to use for a message about a dog, and answering with what the tools returned. This
+  needs the strongest model (GPT-4 by default).
+- small_talk: answering a short message that doesn't mention any of the dogs, like "Hi!" or "Thanks!". No tool can
+  help with one, so a fast, cheap model will do. A message that follows a turn which involved a dog or a tool is never
+  small talk, since "Can he swim?" or "Show him swimming" may be about that dog.
+- rewrite: the tools' rewrites of a request with a dog's breed and description (`QUESTION_REWRITE`,
+  `PHOTO_REQUEST_REWRITE` and the Stable Diffusion prompts). These are simple text transformations, which a fast,
+  cheap model also does well.
+
+Which model serves each route is configured by a policy, a dict from route to model name. The agent's planner is a
+RoutingChatLLM, which tells small talk from planning by the messages it is sent, and the tools get their LLM for the
+rewrite route from the ModelRouter on the AgentContext (see `route_llm`), since the tools are cached across requests.
+
+Every routed call is timed, and its tokens counted and priced with MODEL_PRICES, per route and model, for the life of
+the process. `model_routing_stats` reports these. In a traced turn, each call is also an `llm.chat` or `llm.complete`
+span, with its route, model and tokens (see tracing.py).
+"""
+import contextlib
+import contextvars
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from history_window import count_tokens
+from steamship import Block
+from steamship.agents.llms.openai import ChatOpenAI, OpenAI
+from steamship.agents.schema import LLM, AgentContext, ChatLLM, Tool
+from steamship.agents.utils import get_llm
+from steamship.data import TagKind
+from steamship.data.tags.tag_constants import RoleTag
+from tracing import span
+
+PLANNING_ROUTE = "planning"
+SMALL_TALK_ROUTE = "small_talk"
+REWRITE_ROUTE = "rewrite"
+
+DEFAULT_POLICY = {
+    PLANNING_ROUTE: "gpt-4",
+    SMALL_TALK_ROUTE: "gpt-3.5-turbo",
+    REWRITE_ROUTE: "gpt-3.5-turbo",
+}
+
+MODEL_PRICES = {
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-0613": (0.03, 0.06),
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-3.5-turbo-0613": (0.0015, 0.002),
+}
+"""USD per 1,000 prompt and completion tokens of each model, at OpenAI's list prices. Unlisted models cost nothing."""
+
+_MODEL_ROUTER_KEY = "model_router"
+
+_METRICS: Dict[str, Dict[str, Dict[str, float]]] = {}
+_METRICS_LOCK = threading.Lock()
+
+_FOLLOWS_PLANNED_TURN: contextvars.ContextVar[bool] = contextvars.ContextVar(
+    "follows_planned_turn", default=False
+)
+
+
+def with_model_router(router: "ModelRouter", context: AgentContext) -> AgentContext:
+    """Let the tools run for `context` get their LLMs from `router`."""
+    context.metadata[_MODEL_ROUTER_KEY] = router
+    return context
+
+
+@contextlib.contextmanager
+def following_planned_turn(planned: bool):
+    """Plan the steps run in this block as following a turn that involved a dog or a tool, if `planned`.
+
+    Kept in a context variable rather than on the AgentContext, since the planner isn't given the AgentContext.
+    """
+    token = _FOLLOWS_PLANNED_TURN.set(planned)
+    try:
+        yield
+    finally:
+        _FOLLOWS_PLANNED_TURN.reset(token)
+
+
+def get_model_router(context: AgentContext) -> Optional["ModelRouter"]:
+    """Retrieve the ModelRouter set on `context` with `with_model_router`, if any."""
+    return context.metadata.get(_MODEL_ROUTER_KEY)
+
+
+def route_llm(context: AgentContext, route: str) -> LLM:
+    """Return the LLM for `route` from the context's ModelRouter, or the context's LLM if there is no router."""
+    router = get_model_router(context)
+    if router is not None:
+        return router.llm(route)
+    return get_llm(context) or OpenAI(client=context.client)
+
+
+def record_call(
+    route: str, model: str, seconds: float, prompt_tokens: int, completion_tokens: int
+):
+    """Add a call to `model` on `route` to the process's latency, token and cost counters."""
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+    with _METRICS_LOCK:
+        counters = _METRICS.setdefault(route, {}).setdefault(
+            model,
+            {
+                "calls": 0,
+                "seconds": 0.0,
+                "max_seconds": 0.0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "cost_usd": 0.0,
+            },
+        )
+        counters["calls"] += 1
+        counters["seconds"] += seconds
+        counters["max_seconds"] = max(counters["max_seconds"], seconds)
+        counters["prompt_tokens"] += prompt_tokens
+        counters["completion_tokens"] += completion_tokens
+        counters["cost_usd"] += cost
+
+
+def model_routing_stats() -> Dict[str, Any]:
+    """Return the calls, latency, tokens and cost of each route and model in this process."""
+    with _METRICS_LOCK:
+        routes = {
+            route: {
+                model: {
+                    **counters,
+                    "mean_seconds": counters["seconds"] / counters["calls"],
+                }
+                for model, counters in models.items()
+            }
+            for route, models in _METRICS.items()
+        }
+    return {
+        "routes": routes,
+        "cost_usd": sum(
+            counters["cost_usd"]
+            for models in routes.values()
+            for counters in models.values()
+        ),
+    }
+
+
+def is_function_result(message: Block) -> bool:
+    """Whether a chat message is the output of a tool (see Action.to_chat_messages)."""
+    return any(
+        tag.kind == TagKind.ROLE and tag.name == RoleTag.FUNCTION
+        for tag in message.tags or []
+    )
+
+
+def _text(blocks: List[Block]) -> str:
+    return "\n".join(block.text or "" for block in blocks)
+
+
+class RoutedLLM(LLM):
+    """An LLM that records the latency, tokens and cost of its completions against a route."""
+
+    route: str
+    model: str
+    llm: Any
+
+    def complete(
+        self, prompt: str, stop: Optional[str] = None, **kwargs
+    ) -> List[Block]:
+        with span("llm.complete", route=self.route, model=self.model) as call:
+            started_at = time.perf_counter()
+            blocks = self.llm.complete(prompt, stop=stop, **kwargs)
+            seconds = time.perf_counter() - started_at
+            prompt_tokens = count_tokens(prompt)
+            completion_tokens = count_tokens(_text(blocks))
+            call.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        record_call(
+            self.route,
+            self.model,
+            seconds,
+            prompt_tokens,
+            completion_tokens,
+        )
+        return blocks
+
+
+class RoutingChatLLM(ChatLLM, LLM):
+    """The agent's planner: sends each planning step to the small talk or planning model of a ModelRouter.
+
+    A step is small talk if no tool has run yet, the turn doesn't follow one that involved a dog or a tool (see
+    `following_planned_turn`), and the router's `is_small_talk` says so of the user's message. Its completions (when it
+    stands in as the context's LLM) take the rewrite route.
+    """
+
+    router: Any
+
+    @staticmethod
+    def _last_user_message(messages: List[Block]) -> Optional[Block]:
+        return next(
+            (
+                message
+                for message in reversed(messages)
+                if message.chat_role == RoleTag.USER
+            ),
+            None,
+        )
+
+    def route_for(self, messages: List[Block]) -> str:
+        if _FOLLOWS_PLANNED_TURN.get() or any(
+            is_function_result(message) for message in messages
+        ):
+            return PLANNING_ROUTE
+        user_message = self._last_user_message(messages)
+        if user_message is not None and self.router.is_small_talk(
+            user_message.text or ""
+        ):
+            return SMALL_TALK_ROUTE
+        return PLANNING_ROUTE
+
+    def chat(
+        self, messages: List[Block], tools: Optional[List[Tool]], **kwargs
+    ) -> List[Block]:
+        route = self.route_for(messages)
+        model = self.router.model_for(route)
+        with span("llm.chat", route=route, model=model) as call:
+            started_at = time.perf_counter()
+            blocks = self.router.chat_llm(model).chat(messages, tools, **kwargs)
+            seconds = time.perf_counter() - started_at
+            prompt_tokens = count_tokens(_text(messages))
+            completion_tokens = count_tokens(_text(blocks))
+            call.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        record_call(
+            route,
+            model,
+            seconds,
+            prompt_tokens,
+            completion_tokens,
+        )
+        return blocks
+
+    def complete(
+        self, prompt: str, stop: Optional[str] = None, **kwargs
+    ) -> List[Block]:
+        return self.router.llm(REWRITE_ROUTE).complete(prompt, stop=stop, **kwargs)
+
+
+class ModelRouter:
+    """Chooses the model for each route from `policy`, and builds (once) the LLMs that call them.
+
+    `is_small_talk` decides whether a user's message is small talk. `llm_factory(model, chat)` builds the LLM for a
+    model: a ChatLLM if `chat` is true, else a completion LLM. It defaults to Steamship's OpenAI plugin.
+    """
+
+    def __init__(
+        self,
+        client,
+        policy: Optional[Dict[str, str]] = None,
+        is_small_talk: Optional[Callable[[str], bool]] = None,
+        llm_factory: Optional[Callable[[str, bool], Union[LLM, ChatLLM]]] = None,
+    ):
+        self.client = client
+        self.policy = {**DEFAULT_POLICY, **(policy or {})}
+        self.is_small_talk = is_small_talk or (lambda text: False)
+        self.llm_factory = llm_factory or self._openai
+        self._llms: Dict[Any, Union[LLM, ChatLLM]] = {}
+        self._llms_lock = threading.Lock()
+
+    def _openai(self, model: str, chat: bool) -> Union[LLM, ChatLLM]:
+        if chat:
+            return ChatOpenAI(self.client, model_name=model)
+        return OpenAI(self.client, model_name=model)
+
+    def model_for(self, route: str) -> str:
+        return self.policy.get(route) or self.policy[PLANNING_ROUTE]
+
+    def _build(self, model: str, chat: bool) -> Union[LLM, ChatLLM]:
+        with self._llms_lock:
+            if (model, chat) not in self._llms:
+                self._llms[(model, chat)] = self.llm_factory(model, chat)
+            return self._llms[(model, chat)]
+
+    def chat_llm(self, model: str) -> ChatLLM:
+        """Return the ChatLLM for `model`."""
+        return self._build(model, True)
+
+    def llm(self, route: str) -> RoutedLLM:
+        """Return the completion LLM for `route`, which records its calls against the route."""
+        model = self.model_for(route)
+        return RoutedLLM(route=route, model=model, llm=self._build(model, False))
+
+    def planner(self) -> RoutingChatLLM:
+        """Return a ChatLLM for the agent that routes each planning step to the small talk or planning model."""
+        return RoutingChatLLM(router=self)
@@ -0,0 +1,174 @@
+"""Run the tool calls of one planning step concurrently.
+
+FunctionsBasedAgent asks the LLM for one function call per planning step. When a model wants several tools at once
+(say, the QuestionTool for "how much should Fido eat?" and the PictureTool for "...and show me him eating"), it asks
+for them in a single call to OpenAI's `multi_tool_use.parallel` pseudo-function. ParallelFunctionsOutputParser turns
+such a call into a ParallelAction, and a ConcurrentActionExecutor runs its actions on a thread pool rather than in
+turn, so the step takes as long as its slowest tool instead of the sum of them.
+
+This is inert with the SDK's ChatOpenAI, which sends the model the legacy `functions` list: OpenAI only offers
+`multi_tool_use.parallel`, and several calls in one response, to requests that send `tools`. Until the agent's LLM does
+that, each step has one function call and runs as before; the parser and executor are ready for when it does.
+
+- Actions are recorded in the context's completed steps in the order the LLM asked for them, whatever order they
+  finish in.
+- If all of a step's tools are final, their outputs, in order, are the response. Otherwise the outputs go back to the
+  planner, as they would one at a time, so that it can write the reply from them rather than the reply being the raw
+  output of, say, a search. The outputs of the step's final tools are held (see `hold_final_output`) and added to
+  the reply the planner writes.
+- Each tool runs at most `tool_concurrency[tool]` calls at once across the process, so a burst of requests can't,
+  for example, start more image generations than the generator can take.
+"""
+import contextvars
+import json
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+from steamship import Block
+from steamship.agents.functional.output_parser import FunctionsBasedOutputParser
+from steamship.agents.schema import Action, AgentContext
+
+PARALLEL_FUNCTION_NAME = "multi_tool_use.parallel"
+
+_HELD_FINAL_OUTPUT_KEY = "held_final_output"
+
+_TOOL_SEMAPHORES: Dict[str, threading.BoundedSemaphore] = {}
+_TOOL_SEMAPHORES_LOCK = threading.Lock()
+
+
+def hold_final_output(blocks: List[Block], context: AgentContext):
+    """Keep the output of a final tool run alongside others, to be added to the reply with `with_held_final_output`."""
+    context.metadata.setdefault(_HELD_FINAL_OUTPUT_KEY, []).extend(blocks)
+
+
+def with_held_final_output(action: Action, context: AgentContext) -> Action:
+    """Add the output held for `context` to the start of a final `action`'s output, unless the planner already did."""
+    held = context.metadata.pop(_HELD_FINAL_OUTPUT_KEY, None)
+    if held:
+        sent = {block.id for block in action.output or [] if block.id}
+        action.output = [
+            block for block in held if not block.id or block.id not in sent
+        ] + list(action.output or [])
+    return action
+
+
+class ParallelAction(Action):
+    """Several tool calls chosen in one planning step, to be run together."""
+
+    tool = PARALLEL_FUNCTION_NAME
+    input: List[Block] = []
+    actions: List[Action]
+
+
+class ParallelFunctionsOutputParser(FunctionsBasedOutputParser):
+    """FunctionsBasedOutputParser that also accepts a `multi_tool_use.parallel` call of several functions."""
+
+    def _extract_action_from_function_call(
+        self, text: str, context: AgentContext
+    ) -> Action:
+        function_call = json.loads(text).get("function_call") or {}
+        if function_call.get("name") != PARALLEL_FUNCTION_NAME:
+            return super()._extract_action_from_function_call(text, context)
+
+        arguments = json.loads(function_call.get("arguments") or "{}")
+        actions = []
+        for tool_use in arguments.get("tool_uses") or []:
+            call = {
+                "function_call": {
+                    "name": tool_use.get("recipient_name", ""),
+                    "arguments": json.dumps(tool_use.get("parameters") or {}),
+                }
+            }
+            actions.append(
+                super()._extract_action_from_function_call(json.dumps(call), context)
+            )
+        if len(actions) == 1:
+            return actions[0]
+        return ParallelAction(actions=actions)
+
+
+class ConcurrentActionExecutor:
+    """Runs the actions of a ParallelAction on a thread pool of up to `max_workers` threads (see the module docstring).
+
+    Tools missing from `tool_concurrency` may run `default_tool_concurrency` calls at once.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 4,
+        tool_concurrency: Optional[Dict[str, int]] = None,
+        default_tool_concurrency: int = 2,
+    ):
+        self.max_workers = max_workers
+        self.tool_concurrency = tool_concurrency or {}
+        self.default_tool_concurrency = default_tool_concurrency
+
+    def semaphore(self, tool: str) -> threading.BoundedSemaphore:
+        """Return the process-wide semaphore that caps concurrent calls of `tool`."""
+        limit = self.tool_concurrency.get(tool, self.default_tool_concurrency)
+        key = f"{tool}:{limit}"
+        with _TOOL_SEMAPHORES_LOCK:
+            if key not in _TOOL_SEMAPHORES:
+                _TOOL_SEMAPHORES[key] = threading.BoundedSemaphore(limit)
+            return _TOOL_SEMAPHORES[key]
+
+    def _run_one(self, run_action: Callable[[Action], None], action: Action):
+        with self.semaphore(action.tool):
+            run_action(action)
+
+    def run(
+        self,
+        run_action: Callable[[Action], None],
+        parallel: ParallelAction,
+        context: AgentContext,
+    ):
+        """Run each of `parallel`'s actions with `run_action`, which runs one action and records it in `context`."""
+        actions = parallel.actions
+        logging.info(
+            f"Running {len(actions)} tools concurrently: {[action.tool for action in actions]}"
+        )
+        if len(actions) == 1 or self.max_workers <= 1:
+            for action in actions:
+                self._run_one(run_action, action)
+        else:
+            # Deferred so that loading the agent doesn't import the thread pool until a step needs it.
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(
+                max_workers=min(self.max_workers, len(actions))
+            ) as pool:
+                # Each action runs in a copy of this thread's context, so that its spans join the turn's trace.
+                futures = [
+                    pool.submit(
+                        contextvars.copy_context().run,
+                        self._run_one,
+                        run_action,
+                        action,
+                    )
+                    for action in actions
+                ]
+                for future in futures:
+                    future.result()
+
+        # Record the actions in the order they were asked for, not the order they finished in.
+        ids = {id(action) for action in actions}
+        context.completed_steps = [
+            step for step in context.completed_steps if id(step) not in ids
+        ] + actions
+
+        parallel.is_final = all(action.is_final for action in actions)
+        if parallel.is_final:
+            parallel.output = [
+                block for action in actions for block in action.output or []
+            ]
+            return
+        for action in actions:
+            if action.is_final:
+                hold_final_output(action.output or [], context)
+        parallel.output = [
+            block
+            for action in actions
+            if not action.is_final
+            for block in action.output or []
+        ]
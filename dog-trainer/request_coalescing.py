@@ -0,0 +1,192 @@
+"""Run the agent once per Slack or Telegram message, however many times the message is delivered.
+
+Slack and Telegram retry a webhook when the agent doesn't respond quickly enough. Each retry arrives as a new request,
+which would run the agent again: the user is answered twice, and the duplicate runs slow the agent down further.
+
+A RequestCoalescer sits in front of `AgentService.run_agent` and keys each run by the transport's id for the message:
+
+- A duplicate that arrives while the original is still running in the same process is dropped at once.
+- A duplicate that arrives after the original has finished, or while it runs in another process, finds the short-lived
+  record that the original's run keeps of the message, under a key of its own, in a KeyValueStore, and is dropped too.
+
+In both cases the transport has already sent (or is sending) the original run's reply, so a duplicate emits nothing,
+and it never holds its webhook request open waiting for the original. If the original run fails, or its process dies
+and its record expires, the next delivery of the message runs the agent again. Expired records are deleted whenever a
+run claims a message, so the store only ever holds the messages of the last few minutes.
+"""
+import logging
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional, Set
+
+from steamship.agents.schema import AgentContext
+from steamship.invocable import get
+from steamship.invocable.package_mixin import PackageMixin
+from steamship.utils.kv_store import KeyValueStore
+
+COALESCING_STORE_IDENTIFIER = "request-coalescing"
+
+COALESCED_TRANSPORTS = {
+    "steamship.agents.mixins.transports.slack": "slack",
+    "steamship.agents.mixins.transports.telegram": "telegram",
+}
+"""The transports that retry deliveries, by the module their emit functions are defined in.
+
+The Steamship web widget gives every message a new id, so its messages are never coalesced.
+"""
+
+
+def message_key(context: AgentContext) -> Optional[str]:
+    """Identify the transport message that `context` is answering, or return None if it didn't come from Slack or
+    Telegram."""
+    transports = {
+        COALESCED_TRANSPORTS.get(getattr(emit_func, "__module__", None))
+        for emit_func in context.emit_funcs
+    } - {None}
+    message = context.chat_history.last_user_message
+    if not transports or message is None or message.message_id is None:
+        return None
+    return f"{min(transports)}:{message.chat_id}:{message.message_id}"
+
+
+_IN_FLIGHT: Set[str] = set()
+"""The messages that runs in this process are answering."""
+_IN_FLIGHT_LOCK = threading.Lock()
+
+_COUNTERS = {"runs": 0, "attached": 0, "replayed": 0}
+_COUNTERS_LOCK = threading.Lock()
+
+
+class RequestCoalescer:
+    """Coalesces runs of the agent for the same transport message (see the module docstring)."""
+
+    TTL_SECONDS = 600
+    """How long a finished run is remembered. Slack stops retrying after about five minutes."""
+
+    RUNNING_TTL_SECONDS = 300
+    """How long a run that never recorded finishing (because its process died) holds off duplicates."""
+
+    RECORD_PREFIX = "message:"
+    """Each message's record is kept under this prefix and the message's key."""
+
+    def __init__(self, client: Any, enabled: bool = True):
+        self.client = client
+        self.enabled = enabled
+        self._store: Optional[KeyValueStore] = None
+
+    @property
+    def store(self) -> KeyValueStore:
+        if self._store is None:
+            self._store = KeyValueStore(
+                self.client, store_identifier=COALESCING_STORE_IDENTIFIER
+            )
+        return self._store
+
+    def _record(self, key: str) -> Optional[dict]:
+        """Return the record of the message's latest run, or None if it has none or it has expired.
+
+        Deletes every expired record on the way, as the whole store is read to look the message up anyway.
+        """
+        now = time.time()
+        found = None
+        for record_key, record in self.store.items():
+            if not record_key.startswith(self.RECORD_PREFIX):
+                continue
+            if record["expires_at"] <= now:
+                self.store.delete(record_key)
+            elif record_key == self.RECORD_PREFIX + key:
+                found = record
+        return found
+
+    def _set_record(self, key: str, status: str, owner: str):
+        ttl = self.RUNNING_TTL_SECONDS if status == "running" else self.TTL_SECONDS
+        self.store.set(
+            self.RECORD_PREFIX + key,
+            {"status": status, "owner": owner, "expires_at": time.time() + ttl},
+        )
+
+    def _claim(self, key: str, owner: str) -> bool:
+        """Record the message as running under `owner`, unless another run has it. Return whether this run does.
+
+        KeyValueStore has no compare-and-set, so the claim writes a marker naming `owner` and reads it back: of two
+        runs that claim the message at once, the one whose marker was overwritten sees the other's, and backs off. This
+        narrows, but can't close, the window in which two processes both run the agent.
+        """
+        record = self._record(key)
+        if record is not None and record["status"] != "failed":
+            return False
+        self._set_record(key, "running", owner)
+        record = self.store.get(self.RECORD_PREFIX + key)
+        return record is not None and record["owner"] == owner
+
+    @staticmethod
+    def _count(counter: str):
+        with _COUNTERS_LOCK:
+            _COUNTERS[counter] += 1
+
+    def _suppress(self, context: AgentContext, key: str, counter: str):
+        """Count a duplicate delivery, and remove the copy of the message that the transport added to the history."""
+        logging.info(f"Not running the agent again for duplicate message {key}")
+        self._count(counter)
+        duplicate = context.chat_history.last_user_message
+        if duplicate is not None and duplicate.id is not None:
+            duplicate.delete()
+            context.chat_history.refresh()
+
+    def run(self, context: AgentContext, run: Callable[[], Any]) -> Any:
+        """Call `run`, which runs the agent for `context`, unless its message is a duplicate delivery."""
+        key = message_key(context) if self.enabled else None
+        if key is None:
+            return run()
+
+        with _IN_FLIGHT_LOCK:
+            in_flight = key in _IN_FLIGHT
+            _IN_FLIGHT.add(key)
+        if in_flight:
+            self._suppress(context, key, "attached")
+            return None
+
+        owner = uuid.uuid4().hex
+        try:
+            if not self._claim(key, owner):
+                self._suppress(context, key, "replayed")
+                return None
+            self._count("runs")
+            try:
+                result = run()
+            except BaseException:
+                self._set_record(key, "failed", owner)
+                raise
+            self._set_record(key, "done", owner)
+            return result
+        finally:
+            with _IN_FLIGHT_LOCK:
+                _IN_FLIGHT.discard(key)
+
+    def stats(self) -> Dict[str, int]:
+        """Return how many runs this process made, and how many duplicate deliveries it dropped while the original
+        ran in this process ("attached") or after finding its record ("replayed")."""
+        with _COUNTERS_LOCK:
+            counters = dict(_COUNTERS)
+        now = time.time()
+        return {
+            **counters,
+            "suppressed": counters["attached"] + counters["replayed"],
+            "recent_messages": sum(
+                key.startswith(self.RECORD_PREFIX) and record["expires_at"] > now
+                for key, record in self.store.items()
+            ),
+        }
+
+
+class RequestCoalescingMixin(PackageMixin):
+    """Provides an endpoint reporting how many duplicate runs of the agent were suppressed."""
+
+    def __init__(self, coalescer: RequestCoalescer):
+        self.coalescer = coalescer
+
+    @get("request_coalescing_stats")
+    def request_coalescing_stats(self) -> dict:
+        """Return how many runs of the agent there were, and how many duplicate deliveries didn't cause one."""
+        return self.coalescer.stats()
@@ -0,0 +1,174 @@
+"""Start a tool's dog rewrite while the planner is still choosing the tool.
+
+Answering "How much should Fido eat?" takes two LLM round trips back to back: the planning call that picks the
+QuestionTool, and then the QuestionTool's own call that rewrites the question with Fido's breed. The rewrite only needs
+the user's message, so it can run at the same time as planning instead.
+
+When speculation is enabled, DogTrainer guesses which tool the planner will pick for the user's message (the
+PictureTool if the message asks for a picture, the QuestionTool otherwise) and starts that tool's rewrite in the
+background. The guess is only made when the message mentions a known dog, since otherwise there is nothing to rewrite.
+
+If the planner then calls the guessed tool with the user's message as its input, the tool takes the rewrite instead of
+making its own LLM call. If the planner picks a different tool, or rephrases the message, the rewrite is discarded.
+
+Counters of speculations used and wasted, and of the seconds saved and spent for nothing, are kept for the life of the
+process and reported by `speculation_stats`.
+"""
+import contextvars
+import logging
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from steamship.agents.schema import Action, AgentContext
+
+_SPECULATION_KEY = "speculative_rewrite"
+
+PICTURE_REQUEST_PATTERN = re.compile(
+    r"\b(picture|photo|pic|image|selfie|draw|show me)\b", re.IGNORECASE
+)
+
+_COUNTERS: Dict[str, float] = {
+    "started": 0,
+    "used": 0,
+    "wasted": 0,
+    "saved_seconds": 0.0,
+    "wasted_seconds": 0.0,
+}
+_COUNTERS_LOCK = threading.Lock()
+
+
+def normalize_request(text: str) -> str:
+    """Normalize a tool input so that the planner's copy of the user's message matches the original."""
+    return re.sub(r"\s+", " ", text or "").strip(" \t\n.!?").casefold()
+
+
+def _count(outcome: str, seconds: float):
+    with _COUNTERS_LOCK:
+        _COUNTERS[outcome] += 1
+        _COUNTERS[f"{'saved' if outcome == 'used' else 'wasted'}_seconds"] += seconds
+
+
+class SpeculativeRewrite:
+    """A rewrite of `request` by the tool named `tool_name`, running in a background thread."""
+
+    def __init__(self, tool_name: str, request: str, rewrite: Callable[[], str]):
+        self.tool_name = tool_name
+        self.request = request
+        self.started_at = time.perf_counter()
+        self.finished_at: Optional[float] = None
+        self.result: Optional[str] = None
+        self.settled = False
+        """Whether the rewrite has been used or discarded."""
+
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        with _COUNTERS_LOCK:
+            _COUNTERS["started"] += 1
+        # Run in a copy of the caller's context, so that the rewrite's LLM call joins the turn's trace.
+        threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(self._run, rewrite),
+            daemon=True,
+        ).start()
+
+    def _run(self, rewrite: Callable[[], str]):
+        try:
+            self.result = rewrite()
+        except Exception as e:
+            logging.warning(f"Speculative rewrite for {self.tool_name} failed: {e}")
+        finally:
+            self.finished_at = time.perf_counter()
+            self._done.set()
+
+    def matches(self, tool_name: str, request: str) -> bool:
+        return tool_name == self.tool_name and normalize_request(
+            request
+        ) == normalize_request(self.request)
+
+    def _settle(self) -> bool:
+        """Mark the rewrite used or discarded. Return False if it already was."""
+        with self._lock:
+            if self.settled:
+                return False
+            self.settled = True
+            return True
+
+    def take(self, tool_name: str, request: str) -> Optional[str]:
+        """Return the rewrite, waiting for it if necessary, if it was made by `tool_name` for `request`."""
+        if not self.matches(tool_name, request) or not self._settle():
+            return None
+        taken_at = time.perf_counter()
+        self._done.wait()
+        if self.result is None:
+            _count("wasted", self.finished_at - self.started_at)
+            return None
+        # Without speculation, the rewrite would only have started now.
+        _count("used", min(self.finished_at, taken_at) - self.started_at)
+        return self.result
+
+    def discard(self):
+        """Give up on the rewrite, counting the time it spent (so far) as wasted."""
+        if self._settle():
+            _count(
+                "wasted", (self.finished_at or time.perf_counter()) - self.started_at
+            )
+
+
+def start_speculative_rewrite(
+    context: AgentContext, tools: List[Any], request: str
+) -> Optional[SpeculativeRewrite]:
+    """Start the rewrite of `request` by the tool the planner is likely to pick, if there is anything to rewrite."""
+    tool_name = (
+        "PictureTool" if PICTURE_REQUEST_PATTERN.search(request) else "QuestionTool"
+    )
+    tool = next((tool for tool in tools if tool.name == tool_name), None)
+    if tool is None or not tool.get_registry().find(request):
+        return None
+    rewrite = (
+        (lambda: tool.stable_diffusion_prompt(request, context))
+        if tool_name == "PictureTool"
+        else (lambda: tool.rewrite_question_with_better_details(request, context))
+    )
+    speculation = SpeculativeRewrite(tool_name, request, rewrite)
+    context.metadata[_SPECULATION_KEY] = speculation
+    return speculation
+
+
+def get_speculative_rewrite(context: AgentContext) -> Optional[SpeculativeRewrite]:
+    """Retrieve the SpeculativeRewrite started for `context`, if any."""
+    return context.metadata.get(_SPECULATION_KEY)
+
+
+def take_speculative_rewrite(
+    context: AgentContext, tool_name: str, request: str
+) -> Optional[str]:
+    """Return the rewrite of `request` started for `context` by the tool named `tool_name`, if there is one."""
+    speculation = get_speculative_rewrite(context)
+    return speculation.take(tool_name, request) if speculation else None
+
+
+def discard_unless_chosen(context: AgentContext, action: Action):
+    """Discard the rewrite started for `context` unless `action` (or one of its parallel actions) will use it."""
+    speculation = get_speculative_rewrite(context)
+    if speculation is None:
+        return
+    actions = getattr(action, "actions", None) or [action]
+    if not any(
+        speculation.matches(candidate.tool, candidate.input[0].text)
+        for candidate in actions
+        if candidate.input and candidate.input[0].text
+    ):
+        speculation.discard()
+
+
+def speculation_stats() -> Dict[str, Any]:
+    """Return how many speculative rewrites were used and wasted, and the seconds saved and wasted, in this process."""
+    with _COUNTERS_LOCK:
+        counters = dict(_COUNTERS)
+    settled = counters["used"] + counters["wasted"]
+    return {
+        **counters,
+        "hit_ratio": counters["used"] / settled if settled else 0.0,
+    }
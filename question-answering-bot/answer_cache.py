@@ -0,0 +1,287 @@
+"""Semantic cache for answers to questions about the indexed documents.
+
+People ask the same things over and over, often in slightly different words. Answering a question costs a vector search
+and an LLM completion, so we remember each answer along with an embedding of its question, and reuse it when a later
+question is identical or, if enabled, close enough in meaning.
+
+Cached answers are only valid for the documents that were indexed when they were written, so the cache is emptied
+whenever anything new is indexed (see document_indexer.py).
+"""
+import hashlib
+import re
+import threading
+import unicodedata
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from embeddings import normalize
+from steamship import Block, Tag
+
+INDEX_KEY = "__answer-cache-index__"
+"""The store key under which the cached keys, in the order they were added, and the invalidation count are saved."""
+
+EMBEDDING_DECIMALS = 6
+"""Stored embeddings are rounded to this many decimals to keep the entries small."""
+
+_COUNTERS: Dict[str, Dict[str, Any]] = {}
+_EMBEDDINGS: Dict[str, "_QuestionEmbeddings"] = {}
+_LOCK = threading.Lock()
+
+
+def _new_counters() -> Dict[str, Any]:
+    return {"exact_hits": 0, "similar_hits": 0, "misses": 0, "saved_seconds": 0.0}
+
+
+def normalize_question(question: str) -> str:
+    """Normalize a question so that trivially different renderings of it share a cache entry."""
+    question = unicodedata.normalize("NFC", question or "").casefold()
+    return re.sub(r"\s+", " ", question).strip()
+
+
+class AnswerLookup(NamedTuple):
+    """The result of looking a question up in the AnswerCache."""
+
+    blocks: Optional[List[Block]]
+    """The cached answer, or None on a miss."""
+
+    match: str
+    """One of "exact", "similar" or "miss"."""
+
+    similarity: float
+    """Cosine similarity between the question and the closest cached question (1.0 for an exact match)."""
+
+    embedding: Optional[List[float]]
+    """The question's normalized embedding, if one had to be computed. Pass it back to `put` to avoid recomputing it."""
+
+
+class _QuestionEmbeddings:
+    """This process's copy of the cached questions' embeddings, as the rows of one matrix.
+
+    It is brought up to date with the store's index before each similarity lookup: entries added by other processes
+    are read, by key, and an invalidation since the copy was made discards it.
+    """
+
+    def __init__(self, invalidations: int):
+        self.invalidations = invalidations
+        self.keys: List[str] = []
+        self.rows: List[List[float]] = []
+        self._matrix = None
+        self._lock = threading.Lock()
+
+    def add(self, key: str, embedding: List[float]):
+        with self._lock:
+            self._add(key, embedding)
+
+    def _add(self, key: str, embedding: List[float]):
+        if embedding and key not in self.keys:
+            self.keys.append(key)
+            self.rows.append(embedding)
+            self._matrix = None
+
+    def sync(self, store, index: Dict[str, Any]):
+        """Add the embeddings of entries in `index` that this copy doesn't have, and drop those evicted."""
+        wanted = set(index["keys"])
+        with self._lock:
+            missing = [key for key in index["keys"] if key not in set(self.keys)]
+        # Read outside the lock, so that lookups of other questions don't wait on the store.
+        fetched = store.items(filter_keys=missing) if missing else []
+        with self._lock:
+            for key, entry in fetched:
+                self._add(key, (entry or {}).get("embedding"))
+            self._drop_all_but(wanted)
+
+    def _drop_all_but(self, wanted: set):
+        if any(key not in wanted for key in self.keys):
+            kept = [(k, row) for k, row in zip(self.keys, self.rows) if k in wanted]
+            self.keys = [k for k, _ in kept]
+            self.rows = [row for _, row in kept]
+            self._matrix = None
+
+    def closest(self, embedding: List[float]) -> Tuple[Optional[str], float]:
+        # Deferred so that loading the agent doesn't import numpy until a similar question is looked up.
+        import numpy as np
+
+        with self._lock:
+            if not self.keys:
+                return None, -1.0
+            if self._matrix is None:
+                self._matrix = np.asarray(self.rows, dtype=np.float32)
+            matrix, keys = self._matrix, self.keys
+        similarities = matrix @ np.asarray(embedding, dtype=np.float32)
+        best = int(np.argmax(similarities))
+        return keys[best], float(similarities[best])
+
+
+class AnswerCache:
+    """A size-bounded cache from questions to answers, which evicts the oldest answers first.
+
+    A question first matches an entry for the same normalized text. If `similarity_threshold` is below 1.0, it is then
+    embedded, and matches the entry whose question embedding has the highest cosine similarity, provided it is at
+    least `similarity_threshold`. The default of 1.0 only ever reuses answers to identical questions, and never embeds.
+    Embedding models score unrelated questions about the same documents as very similar (ada-002 puts most pairs above
+    0.9), so a threshold below about 0.98 reuses answers to questions they don't answer.
+
+    Entries live in any store offering the `items` / `set` / `delete` / `reset` methods of Steamship's KeyValueStore.
+    A lookup reads the question's own entry and the index, in one `items` call, and writes nothing. Similarity is
+    computed against this process's copy of the cached embeddings, which reads only the entries it is missing, and a
+    similar match reads its entry. Hit and miss counters are kept per process.
+
+    Like KeyValueStore itself, the index isn't safe to update from two processes at once: an answer put at the same
+    time as another may be left out of it, and is then never reused, until the next invalidation clears it.
+    """
+
+    def __init__(
+        self,
+        store,
+        similarity_threshold: float = 1.0,
+        max_entries: int = 200,
+        cache_key: Optional[str] = None,
+    ):
+        self.store = store
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.cache_key = cache_key or str(getattr(store, "store_identifier", id(store)))
+        """Names this cache's counters and embeddings in the process, so that they outlive the service instance."""
+
+    @staticmethod
+    def key_for(question: str) -> str:
+        digest = hashlib.sha256(normalize_question(question).encode("utf-8"))
+        return f"answer-{digest.hexdigest()}"
+
+    @staticmethod
+    def _load_index(entries: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        index = entries.get(INDEX_KEY) or {}
+        return {
+            "keys": index.get("keys", []),
+            "invalidations": index.get("invalidations", 0),
+        }
+
+    def _count(self, counter: str, amount: float = 1):
+        with _LOCK:
+            counters = _COUNTERS.setdefault(self.cache_key, _new_counters())
+            counters[counter] += amount
+
+    def _embeddings(self, index: Dict[str, Any]) -> _QuestionEmbeddings:
+        """Return this process's copy of the cached embeddings, up to date with `index`."""
+        with _LOCK:
+            embeddings = _EMBEDDINGS.get(self.cache_key)
+            if embeddings is None or embeddings.invalidations != index["invalidations"]:
+                embeddings = _QuestionEmbeddings(index["invalidations"])
+                _EMBEDDINGS[self.cache_key] = embeddings
+        embeddings.sync(self.store, index)
+        return embeddings
+
+    def lookup(
+        self, question: str, embed: Callable[[str], List[float]]
+    ) -> AnswerLookup:
+        """Return the cached answer for `question`, if any, and count the hit or miss.
+
+        `embed` is only called if there is no exact match and similarity matching is enabled.
+        """
+        key = AnswerCache.key_for(question)
+        entries = dict(self.store.items(filter_keys=[key, INDEX_KEY]))
+        index = self._load_index(entries)
+        match, similarity, embedding = "miss", 0.0, None
+
+        if key in index["keys"] and entries.get(key):
+            match, similarity = "exact", 1.0
+        elif self.similarity_threshold < 1.0:
+            # Embedded even when there is nothing to compare with, since `put` stores the embedding with the answer.
+            embedding = normalize(embed(question))
+            closest, similarity = (
+                self._embeddings(index).closest(embedding)
+                if index["keys"]
+                else (None, 0.0)
+            )
+            if closest is not None and similarity >= self.similarity_threshold:
+                entry = dict(self.store.items(filter_keys=[closest])).get(closest)
+                if entry:
+                    match, key = "similar", closest
+                    entries[key] = entry
+
+        if match == "miss":
+            self._count("misses")
+            return AnswerLookup(None, match, similarity, embedding)
+
+        entry = entries[key]
+        self._count(f"{match}_hits")
+        self._count("saved_seconds", entry.get("answer_seconds", 0.0))
+        blocks = [
+            Block(text=block["text"], tags=[Tag(**tag) for tag in block["tags"]])
+            for block in entry["blocks"]
+        ]
+        return AnswerLookup(blocks, match, similarity, embedding)
+
+    def put(
+        self,
+        question: str,
+        blocks: List[Block],
+        answer_seconds: float,
+        embedding: Optional[List[float]] = None,
+    ):
+        """Remember `blocks` as the answer to `question`, which took `answer_seconds` to produce.
+
+        `embedding` should be the normalized embedding of `question` if similarity matching is enabled.
+        """
+        rounded = [round(x, EMBEDDING_DECIMALS) for x in embedding or []]
+        entry = {
+            "question": normalize_question(question),
+            "embedding": rounded,
+            "answer_seconds": answer_seconds,
+            "blocks": [
+                {
+                    "text": block.text,
+                    "tags": [
+                        tag.dict(include={"kind", "name", "value"}, exclude_none=True)
+                        for tag in block.tags or []
+                    ],
+                }
+                for block in blocks
+            ],
+        }
+        key = AnswerCache.key_for(question)
+        index = self._load_index(dict(self.store.items(filter_keys=[INDEX_KEY])))
+        self.store.set(key, entry)
+        if key in index["keys"]:
+            index["keys"].remove(key)
+        index["keys"].append(key)
+        while len(index["keys"]) > self.max_entries:
+            self.store.delete(index["keys"].pop(0))
+        self.store.set(INDEX_KEY, index)
+        with _LOCK:
+            embeddings = _EMBEDDINGS.get(self.cache_key)
+            if (
+                embeddings is not None
+                and embeddings.invalidations == index["invalidations"]
+            ):
+                embeddings.add(key, rounded)
+
+    def invalidate(self):
+        """Forget every cached answer."""
+        index = self._load_index(dict(self.store.items(filter_keys=[INDEX_KEY])))
+        if not index["keys"]:
+            return
+        self.store.reset()
+        index["keys"] = []
+        index["invalidations"] += 1
+        self.store.set(INDEX_KEY, index)
+        with _LOCK:
+            _EMBEDDINGS.pop(self.cache_key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return this process's hit/miss counters and the latency hits saved, and the current size of the cache."""
+        index = self._load_index(dict(self.store.items(filter_keys=[INDEX_KEY])))
+        with _LOCK:
+            counters = dict(_COUNTERS.get(self.cache_key) or _new_counters())
+        hits = counters["exact_hits"] + counters["similar_hits"]
+        lookups = hits + counters["misses"]
+        return {
+            "entries": len(index["keys"]),
+            "max_entries": self.max_entries,
+            "similarity_threshold": self.similarity_threshold,
+            "exact_hits": counters["exact_hits"],
+            "similar_hits": counters["similar_hits"],
+            "misses": counters["misses"],
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "saved_seconds": counters["saved_seconds"],
+            "invalidations": index["invalidations"],
+        }
@@ -1,6 +1,14 @@
+import logging
 from typing import List, Type
 
+from answer_cache import AnswerCache
+from document_indexer import DocumentIndexerMixin, DocumentIndexerPipelineMixin
+from document_qa_tool import DocumentQATool
+from history_window import ConversationHistoryManager, ConversationHistoryMixin
+from index_manifest import IndexManifest
+from lazy_mixins import add_lazy_mixin
 from pydantic import Field
+from request_coalescing import RequestCoalescer, RequestCoalescingMixin
 from steamship.agents.functional import FunctionsBasedAgent
 from steamship.agents.llms.openai import ChatOpenAI
 from steamship.agents.mixins.transports.slack import (
@@ -12,14 +20,13 @@ from steamship.agents.mixins.transports.telegram import (
     TelegramTransport,
     TelegramTransportConfig,
 )
-from steamship.agents.schema import Tool
+from steamship.agents.schema import Agent, AgentContext, Tool
 from steamship.agents.service.agent_service import AgentService
-from steamship.agents.tools.question_answering import VectorSearchQATool
-from steamship.invocable import Config
+from steamship.invocable import Config, get
 from steamship.invocable.mixins.blockifier_mixin import BlockifierMixin
 from steamship.invocable.mixins.file_importer_mixin import FileImporterMixin
-from steamship.invocable.mixins.indexer_mixin import IndexerMixin
-from steamship.invocable.mixins.indexer_pipeline_mixin import IndexerPipelineMixin
+from steamship.invocable.mixins.indexer_mixin import DEFAULT_EMBEDDING_INDEX_HANDLE
+from steamship.utils.kv_store import KeyValueStore
 
 
 class DocumentQAAgentService(AgentService):
@@ -33,20 +40,40 @@ class DocumentQAAgentService(AgentService):
         /index_text
         { text }
 
+        /index_batch
+        { items: [{ url }, { text }, ...], dry_run }
+
+        /reindex_url
+        { url, dry_run }
+
     - An unauthenticated endpoint for answering questions about what it has learned
 
+    - An endpoint reporting how often questions are answered from the answer cache:
+
+        /answer_cache_stats
+
+    - An endpoint reporting how many tokens of conversation history are sent to the LLM:
+
+        /history_stats
+
+    - An endpoint reporting how many retried Slack and Telegram deliveries didn't run the agent again:
+
+        /request_coalescing_stats
+
     This agent provides a starter project for special purpose QA agents that can answer questions about documents
     you provide.
     """
 
     USED_MIXIN_CLASSES = [
-        IndexerPipelineMixin,
+        DocumentIndexerPipelineMixin,
         FileImporterMixin,
         BlockifierMixin,
-        IndexerMixin,
+        DocumentIndexerMixin,
         SteamshipWidgetTransport,
         TelegramTransport,
         SlackTransport,
+        ConversationHistoryMixin,
+        RequestCoalescingMixin,
     ]
     """USED_MIXIN_CLASSES tells Steamship what additional HTTP endpoints to register on your AgentService."""
 
@@ -56,6 +83,52 @@ class DocumentQAAgentService(AgentService):
         telegram_bot_token: str = Field(
             "", description="[Optional] Secret token for connecting to Telegram"
         )
+        answer_cache_enabled: bool = Field(
+            True, description="Reuse answers to questions that have been asked before"
+        )
+        answer_cache_similarity_threshold: float = Field(
+            1.0,
+            description="How similar (0-1) a question must be to an earlier one to reuse its answer. 1 only reuses answers to identical questions. Below 1, each new question is embedded to look for a similar one; keep it at 0.98 or more, since unrelated questions about the same documents often score above 0.9.",
+        )
+        vector_index_backend: str = Field(
+            "steamship",
+            description="Where to keep and search the document index: steamship (the Steamship embedding index), numpy (a local index searched exhaustively) or ivf (a local index searched by cluster, for millions of chunks).",
+        )
+        local_vector_index_path: str = Field(
+            "",
+            description="The directory for local document indexes, required by the numpy and ivf backends, hybrid search and the embedding cache. It must persist between requests, and be shared by the processes that index documents and those that answer questions.",
+        )
+        hybrid_search_enabled: bool = Field(
+            False,
+            description="Also look up questions in a keyword index kept next to the document index, to find identifiers and exact phrases. Like local document indexes, it is kept on local disk.",
+        )
+        rerank_enabled: bool = Field(
+            False,
+            description="With hybrid search, reorder the combined results by how similar they are to the question. Costs an extra embedding call per question.",
+        )
+        context_token_budget: int = Field(
+            0,
+            description="How many tokens of document text may be sent to the LLM to answer each question. 0 sends about as "
+            "many as the two best chunks take (100 tokens).",
+        )
+        embedding_cache_enabled: bool = Field(
+            False,
+            description="Keep the embeddings of document chunks on local disk, keyed by their text, so that a chunk indexed again or from another document isn't embedded twice. Used with local document indexes and reranking. Requires local_vector_index_path.",
+        )
+        history_window_tokens: int = Field(
+            0,
+            description="How many tokens of the most recent conversation to send to the LLM with each message. 0 sends "
+            "none, as by default.",
+        )
+        history_summary_enabled: bool = Field(
+            True,
+            description="With a history window, summarize the conversation before it, in the background, and send the "
+            "summary with each message.",
+        )
+        request_coalescing_enabled: bool = Field(
+            True,
+            description="Run the agent only once for a Slack or Telegram message that is delivered more than once, such as when a webhook is retried.",
+        )
 
     config: DocumentQAAgentServiceConfig
     """The configuration block that users who create an instance of this agent will provide."""
@@ -63,6 +136,15 @@ class DocumentQAAgentService(AgentService):
     tools: List[Tool]
     """The list of Tools that this agent is capable of using."""
 
+    history_manager: ConversationHistoryManager
+    """Chooses the part of each conversation to send to the LLM, and keeps conversations' summaries and token metrics."""
+
+    request_coalescer: RequestCoalescer
+    """Keeps retried deliveries of a Slack or Telegram message from running the agent again."""
+
+    answer_cache: AnswerCache
+    """Answers to earlier questions, emptied whenever new documents are indexed."""
+
     @classmethod
     def config_cls(cls) -> Type[Config]:
         """Return the Configuration class so that Steamship can auto-generate a web UI upon agent creation time."""
@@ -78,7 +160,66 @@ class DocumentQAAgentService(AgentService):
         # they can be stateful -- using Key-Valued storage and conversation history.
         #
         # See https://docs.steamship.com for a full list of supported Tools.
-        self.tools = [VectorSearchQATool()]
+        self.answer_cache = AnswerCache(
+            KeyValueStore(self.client, store_identifier="answer-cache"),
+            similarity_threshold=self.config.answer_cache_similarity_threshold,
+            cache_key=f"{self.client.config.workspace_id}/answer-cache",
+        )
+        embedding_cache_enabled = self.config.embedding_cache_enabled
+        if embedding_cache_enabled and not self.config.local_vector_index_path:
+            logging.warning(
+                "The embedding cache is off: it needs local_vector_index_path to be set."
+            )
+            embedding_cache_enabled = False
+        vector_index_dir = vector_index = keyword_index = None
+        if (
+            self.config.vector_index_backend != "steamship"
+            or self.config.hybrid_search_enabled
+            or embedding_cache_enabled
+        ):
+            # Deferred so that the agent doesn't import numpy unless it keeps an index on local disk.
+            from keyword_index import open_keyword_index
+            from vector_index import local_index_dir, open_vector_index
+
+            vector_index_dir = local_index_dir(
+                self.client, self.config.local_vector_index_path
+            )
+            vector_index = open_vector_index(
+                self.config.vector_index_backend,
+                vector_index_dir,
+                DEFAULT_EMBEDDING_INDEX_HANDLE,
+            )
+            if self.config.hybrid_search_enabled:
+                keyword_index = open_keyword_index(
+                    vector_index_dir, DEFAULT_EMBEDDING_INDEX_HANDLE
+                )
+        manifest_store_identifier = IndexManifest.store_identifier(
+            DEFAULT_EMBEDDING_INDEX_HANDLE
+        )
+        self.tools = [
+            DocumentQATool(
+                answer_cache=(
+                    self.answer_cache if self.config.answer_cache_enabled else None
+                ),
+                index_manifest=(
+                    IndexManifest(
+                        KeyValueStore(
+                            self.client, store_identifier=manifest_store_identifier
+                        ),
+                        cache_key=f"{self.client.config.workspace_id}/{manifest_store_identifier}",
+                    )
+                    if vector_index is None
+                    else None
+                ),
+                vector_index=vector_index,
+                keyword_index=keyword_index,
+                rerank=self.config.rerank_enabled,
+                context_token_budget=self.config.context_token_budget,
+                embedding_cache_dir=(
+                    vector_index_dir if embedding_cache_enabled else None
+                ),
+            )
+        ]
 
         # Agent Setup
         # ---------------------
@@ -101,35 +242,99 @@ class DocumentQAAgentService(AgentService):
         #    3) Store the text in a vector index
         #
         # That vector index is then available to the question answering tool, below.
-        self.add_mixin(IndexerPipelineMixin(self.client, self))
+        #
+        # Cached answers may be out of date once new documents are indexed, so the answer cache is emptied whenever
+        # the index changes.
+        #
+        # With a local `vector_index_backend`, chunks are embedded by the Mixin and kept on local disk, where the
+        # question answering tool searches them without a network hop.
+        self.add_mixin(
+            DocumentIndexerPipelineMixin(
+                self.client,
+                self,
+                on_index_changed=[self.answer_cache.invalidate],
+                vector_index_backend=self.config.vector_index_backend,
+                vector_index_dir=vector_index_dir,
+                keyword_search_enabled=self.config.hybrid_search_enabled,
+                embedding_cache_enabled=embedding_cache_enabled,
+            )
+        )
+
+        # Conversation History Setup
+        # --------------------------
+
+        # By default the agent sends the LLM no earlier messages of the conversation. With `history_window_tokens` set,
+        # each message is sent with the most recent `history_window_tokens` tokens of the conversation, and a summary
+        # of everything before them, which is brought up to date in the background by the `/summarize_history`
+        # endpoint. `/history_stats` reports how many tokens each conversation has sent, and how many more that is
+        # than without the window. See history_window.py.
+        self.history_manager = ConversationHistoryManager(
+            self,
+            window_tokens=self.config.history_window_tokens,
+            summary_enabled=self.config.history_summary_enabled,
+            baseline_selector=self.get_default_agent().message_selector,
+        )
+        if self.history_manager.enabled:
+            self.get_default_agent().message_selector = self.history_manager.selector()
+        self.add_mixin(ConversationHistoryMixin(self.history_manager))
+
+        # Request Coalescing Setup
+        # ------------------------
+
+        # Slack and Telegram deliver a message again when the agent is slow to respond. Runs of the agent are keyed by
+        # the message's id, so a retried delivery waits for or reuses the original run rather than answering twice.
+        # `/request_coalescing_stats` reports how many duplicate runs were avoided. See request_coalescing.py.
+        self.request_coalescer = RequestCoalescer(
+            self.client, enabled=self.config.request_coalescing_enabled
+        )
+        self.add_mixin(RequestCoalescingMixin(self.request_coalescer))
 
         # Communication Transport Setup
         # -----------------------------
 
+        # Each transport's endpoints are registered now, but the transport itself is only constructed when a request
+        # arrives on one of those endpoints. See lazy_mixins.py.
+
         # Support Steamship's web client
-        self.add_mixin(
-            SteamshipWidgetTransport(
+        add_lazy_mixin(
+            self,
+            SteamshipWidgetTransport,
+            lambda: SteamshipWidgetTransport(
                 client=self.client,
                 agent_service=self,
-            )
+            ),
         )
 
         # Support Slack
-        self.add_mixin(
-            SlackTransport(
+        add_lazy_mixin(
+            self,
+            SlackTransport,
+            lambda: SlackTransport(
                 client=self.client,
                 config=SlackTransportConfig(),
                 agent_service=self,
-            )
+            ),
         )
 
         # Support Telegram
-        self.add_mixin(
-            TelegramTransport(
+        add_lazy_mixin(
+            self,
+            TelegramTransport,
+            lambda: TelegramTransport(
                 client=self.client,
                 config=TelegramTransportConfig(
                     bot_token=self.config.telegram_bot_token
                 ),
                 agent_service=self,
-            )
+            ),
         )
+
+    def run_agent(self, agent: Agent, context: AgentContext):
+        """Run the agent, unless the message is a duplicate delivery of one it has already run for."""
+        run_agent = super().run_agent
+        return self.request_coalescer.run(context, lambda: run_agent(agent, context))
+
+    @get("/answer_cache_stats")
+    def answer_cache_stats(self) -> dict:
+        """Return how often questions were answered from the answer cache, and roughly how much time that saved."""
+        return self.answer_cache.stats()
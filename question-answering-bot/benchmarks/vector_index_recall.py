@@ -0,0 +1,95 @@
+"""Measure the recall and latency of the local vector index backends on synthetic corpora.
+
+Chunk embeddings are drawn around a few thousand random topics, and each question near one of them, which is roughly
+how real embeddings cluster. Recall@k is measured against the exact results of the brute force index. No network
+access or Steamship workspace is needed. Run from the question-answering-bot folder with:
+
+    python -m benchmarks.vector_index_recall
+
+A million chunks of 128 dimensions take about 0.5GB of disk, in a temporary directory that is removed afterwards.
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+from vector_index import BruteForceIndex, IVFIndex, LocalVectorStore
+
+ADD_BATCH_SIZE = 10000
+
+
+class SyntheticCorpus:
+    def __init__(self, dim: int, topics: int, spread: float, seed: int = 0):
+        self.rng = np.random.default_rng(seed)
+        self.topics = self.rng.normal(size=(topics, dim)).astype(np.float32)
+        self.spread = spread
+
+    def sample(self, count: int) -> np.ndarray:
+        topics = self.topics[self.rng.integers(0, len(self.topics), count)]
+        noise = self.rng.normal(size=topics.shape).astype(np.float32)
+        return topics + self.spread * noise
+
+
+def build(index: BruteForceIndex, corpus: SyntheticCorpus, size: int) -> float:
+    started_at = time.perf_counter()
+    for start in range(0, size, ADD_BATCH_SIZE):
+        count = min(ADD_BATCH_SIZE, size - start)
+        items = [{"text": f"chunk {start + i}", "value": {}} for i in range(count)]
+        index.add(corpus.sample(count), items)
+    return time.perf_counter() - started_at
+
+
+def run_queries(index: BruteForceIndex, queries: np.ndarray, k: int):
+    """Return the ids found for each query, and the latency of each search in milliseconds."""
+    results, latencies = [], []
+    for query in queries:
+        started_at = time.perf_counter()
+        results.append({i for i, _ in index.search(query, k)})
+        latencies.append(1000 * (time.perf_counter() - started_at))
+    return results, np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10000, 100000, 1000000]
+    )
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--topics", type=int, default=2000)
+    parser.add_argument("--spread", type=float, default=0.5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[8, 16, 32])
+    args = parser.parse_args()
+
+    print(
+        f"{'chunks':>9}{'backend':>10}{'n_probe':>9}{'recall@' + str(args.k):>11}"
+        f"{'p50 ms':>9}{'p95 ms':>9}{'build s':>9}"
+    )
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as path:
+            corpus = SyntheticCorpus(args.dim, args.topics, args.spread)
+            ivf = IVFIndex(LocalVectorStore(path))
+            build_seconds = build(ivf, corpus, size)
+            queries = corpus.sample(args.queries)
+
+            # The brute force index searches the same files as the IVF index, just without the clusters.
+            exact, latencies = run_queries(BruteForceIndex(ivf.store), queries, args.k)
+            print(
+                f"{size:>9}{'numpy':>10}{'-':>9}{1:>11.3f}{np.percentile(latencies, 50):>9.2f}"
+                f"{np.percentile(latencies, 95):>9.2f}{build_seconds:>9.1f}"
+            )
+            for n_probe in args.n_probe:
+                ivf.n_probe = n_probe
+                found, latencies = run_queries(ivf, queries, args.k)
+                recall = np.mean(
+                    [len(a & b) / len(a) for a, b in zip(exact, found) if a]
+                )
+                print(
+                    f"{size:>9}{'ivf':>10}{n_probe:>9}{recall:>11.3f}{np.percentile(latencies, 50):>9.2f}"
+                    f"{np.percentile(latencies, 95):>9.2f}{build_seconds:>9.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""Choosing which retrieved chunks to send to the LLM, within a budget of tokens.
+
+Search results often repeat themselves: the same passage indexed from two versions of a document, or neighbouring
+chunks of one page that share the `context_window_overlap` characters between them. The packer drops chunks that add
+nothing, merges neighbouring chunks into one passage, and then fills the budget with the most relevant passages that
+fit in it. By default the budget is about what the `load_docs_count` best chunks would take (see `default_token_budget`),
+so packing sends the same amount of text as the agent did without it, with less of it repeated.
+"""
+import hashlib
+import logging
+import math
+import os
+import re
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from index_manifest import SOURCE_KEY, chunk_hash
+from steamship import Tag
+
+TIKTOKEN_ENCODING = "cl100k_base"
+"""The encoding of the OpenAI chat models the agent uses."""
+
+TIKTOKEN_VOCABULARY_URL = (
+    "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken"
+)
+"""Where tiktoken downloads the vocabulary of TIKTOKEN_ENCODING from."""
+
+TIKTOKEN_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "tiktoken_cache"
+)
+"""Where tiktoken's vocabulary is read from, unless the TIKTOKEN_CACHE_DIR environment variable says otherwise.
+
+It is deployed with the package, so that counting tokens never downloads it on the request path. Fill it with:
+
+    TIKTOKEN_CACHE_DIR=tiktoken_cache python -c "import tiktoken; tiktoken.get_encoding('cl100k_base')"
+"""
+
+CHARACTERS_PER_TOKEN = 4
+"""About how many characters of English text make up a token."""
+
+MIN_MERGE_OVERLAP_CHARACTERS = 20
+"""How many characters the end of one chunk and the start of another must share for them to be merged."""
+
+_WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """Load the tiktoken encoding once per process, or return None if it can't be loaded.
+
+    The encoding is only loaded if its vocabulary is in the tiktoken cache directory, since tiktoken would otherwise
+    download it, which is slow and fails without network access. Token counts are then estimated instead.
+    """
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            os.environ.setdefault("TIKTOKEN_CACHE_DIR", TIKTOKEN_CACHE_DIR)
+            vocabulary_path = os.path.join(
+                os.environ["TIKTOKEN_CACHE_DIR"],
+                hashlib.sha1(TIKTOKEN_VOCABULARY_URL.encode()).hexdigest(),
+            )
+            try:
+                if not os.path.exists(vocabulary_path):
+                    raise FileNotFoundError(
+                        f"its vocabulary isn't cached at {vocabulary_path}"
+                    )
+                import tiktoken
+
+                _encoding = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+            except Exception as e:
+                logging.warning(
+                    f"Could not load the {TIKTOKEN_ENCODING} tokenizer, so token counts will be estimated: {e}"
+                )
+            _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Count the tokens in `text`, or estimate them as about one per word or punctuation mark."""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text or "", disallowed_special=()))
+    return max(
+        len(_WORD_PATTERN.findall(text or "")),
+        len(text or "") // CHARACTERS_PER_TOKEN,
+    )
+
+
+def default_token_budget(load_docs_count: int, chunk_characters: int) -> int:
+    """Return about how many tokens the `load_docs_count` best chunks of `chunk_characters` characters take."""
+    return load_docs_count * math.ceil(chunk_characters / CHARACTERS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Return the start of `text` that fits in `max_tokens`."""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.decode(
+            encoding.encode(text, disallowed_special=())[:max_tokens]
+        )
+    words = list(_WORD_PATTERN.finditer(text))
+    if len(words) <= max_tokens and len(text) // CHARACTERS_PER_TOKEN <= max_tokens:
+        return text
+    end = min(
+        words[max_tokens - 1].end() if max_tokens else 0,
+        max_tokens * CHARACTERS_PER_TOKEN,
+    )
+    return text[:end]
+
+
+def _overlap(first: str, second: str) -> int:
+    """Return how many characters at the end of `first` are also the start of `second`."""
+    for size in range(
+        min(len(first), len(second)), MIN_MERGE_OVERLAP_CHARACTERS - 1, -1
+    ):
+        if first.endswith(second[:size]):
+            return size
+    return 0
+
+
+class Passage:
+    """One or more neighbouring chunks of a document, to be sent to the LLM as one piece of text."""
+
+    def __init__(self, tag: Tag, score: float):
+        self.text = tag.text
+        self.score = score
+        self.parts = [(tag, score)]
+        self._tokens: Optional[int] = None
+
+    @property
+    def group(self) -> Tuple[Any, Any, Any]:
+        """Passages can only be merged with others from the same block of the same document."""
+        value = self.parts[0][0].value or {}
+        return value.get(SOURCE_KEY), value.get("file_id"), value.get("block_id")
+
+    @property
+    def tokens(self) -> int:
+        if self._tokens is None:
+            self._tokens = count_tokens(self.text)
+        return self._tokens
+
+    def merge(self, other: "Passage") -> bool:
+        """Absorb `other` if it overlaps with the end or the start of this passage, or one contains the other."""
+        if other.text in self.text:
+            self.score = max(self.score, other.score)
+        elif self.text in other.text:
+            self.text = other.text
+            self.score = max(self.score, other.score)
+        elif overlap := _overlap(self.text, other.text):
+            self.text += other.text[overlap:]
+            self.score += other.score
+        elif overlap := _overlap(other.text, self.text):
+            self.text = other.text + self.text[overlap:]
+            self.score += other.score
+        else:
+            return False
+        self.parts += other.parts
+        self._tokens = None
+        return True
+
+    def split(self) -> List["Passage"]:
+        """Return the chunks this passage was merged from, as passages of their own."""
+        return [Passage(tag, score) for tag, score in self.parts]
+
+    def to_tag(self) -> Tag:
+        """A tag for the passage, with the metadata of its first chunk."""
+        return Tag(text=self.text, value=dict(self.parts[0][0].value or {}))
+
+
+class PackedContext(NamedTuple):
+    tags: List[Tag]
+    """The passages to send to the LLM, most relevant first."""
+
+    metrics: Dict[str, Any]
+    """How much was retrieved, deduplicated, merged and sent, in chunks and in tokens."""
+
+
+class ContextPacker:
+    """Packs scored search results into at most `token_budget` tokens, and at most `max_passages` passages."""
+
+    def __init__(
+        self, token_budget: Optional[int] = None, max_passages: Optional[int] = None
+    ):
+        self.token_budget = token_budget
+        self.max_passages = max_passages
+
+    @staticmethod
+    def deduplicate(results: List[Tuple[Tag, float]]) -> List[Passage]:
+        """Drop chunks whose text has already been seen, keeping the best score for it."""
+        passages: Dict[str, Passage] = {}
+        for tag, score in results:
+            if not tag.text:
+                continue
+            key = chunk_hash(tag.text)
+            if key in passages:
+                passages[key].score = max(passages[key].score, score)
+            else:
+                passages[key] = Passage(tag, score)
+        return list(passages.values())
+
+    @staticmethod
+    def merge(passages: List[Passage]) -> List[Passage]:
+        """Merge passages that overlap, or that are contained in one another, within each group.
+
+        Passages are merged until no more can be, since merging two may join them with a third.
+        """
+        while True:
+            merged: List[Passage] = []
+            for passage in passages:
+                if not any(
+                    other.group == passage.group and other.merge(passage)
+                    for other in merged
+                ):
+                    merged.append(passage)
+            if len(merged) == len(passages):
+                return merged
+            passages = merged
+
+    def fill(self, passages: List[Passage]) -> List[Passage]:
+        """Choose passages in order of relevance, skipping those that don't fit in what is left of the budget.
+
+        Relevance, rather than relevance per token, decides, so that a short chunk doesn't displace a more relevant
+        longer one. A merged passage that doesn't fit is split back into its chunks, which are considered on their own.
+        """
+        if self.token_budget is None:
+            chosen = passages
+        else:
+            chosen, tokens = [], 0
+            candidates = sorted(passages, key=lambda p: p.score, reverse=True)
+            while candidates:
+                passage = candidates.pop(0)
+                if tokens + passage.tokens <= self.token_budget:
+                    chosen.append(passage)
+                    tokens += passage.tokens
+                elif len(passage.parts) > 1:
+                    candidates = sorted(
+                        candidates + passage.split(),
+                        key=lambda p: p.score,
+                        reverse=True,
+                    )
+            chosen = ContextPacker.merge(chosen)
+            if not chosen and passages:
+                best = max(passages, key=lambda p: p.score)
+                best.text = truncate_to_tokens(best.text, self.token_budget)
+                best._tokens = None
+                chosen = [best]
+        chosen = sorted(chosen, key=lambda p: p.score, reverse=True)
+        return chosen[: self.max_passages] if self.max_passages else chosen
+
+    def pack(self, results: List[Tuple[Tag, float]]) -> PackedContext:
+        """Pack search results, given as (tag, score) pairs with higher scores more relevant."""
+        passages = ContextPacker.deduplicate(results)
+        unique = len(passages)
+        passages = ContextPacker.merge(passages)
+        merged = len(passages)
+        tokens_retrieved = sum(passage.tokens for passage in passages)
+        chosen = self.fill(passages)
+        tokens_sent = sum(passage.tokens for passage in chosen)
+        return PackedContext(
+            tags=[passage.to_tag() for passage in chosen],
+            metrics={
+                "chunks_retrieved": len(results),
+                "duplicates_dropped": len(results) - unique,
+                "chunks_merged": unique - merged,
+                "passages_sent": len(chosen),
+                "chunks_sent": sum(len(passage.parts) for passage in chosen),
+                "tokens_retrieved": tokens_retrieved,
+                "tokens_sent": tokens_sent,
+                "token_budget": self.token_budget,
+                "budget_used": (
+                    tokens_sent / self.token_budget if self.token_budget else None
+                ),
+            },
+        )
@@ -0,0 +1,676 @@
+"""Indexing mixins that report changes to the index and can index many documents at once."""
+import logging
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+from embeddings import embed_texts, use_embedder
+from index_manifest import (
+    CHUNK_HASH_KEY,
+    SOURCE_KEY,
+    IndexManifest,
+    ManifestDiff,
+)
+from pipeline import Pipeline, PipelineStage
+from pydantic import BaseModel, Field
+from retrieval import reciprocal_rank_fusion
+from steamship import Block, DocTag, File, Steamship, SteamshipError, Tag
+from steamship.data import TagKind, TagValueKey
+from steamship.data.plugin.index_plugin_instance import SearchResult, SearchResults
+from steamship.data.plugin.plugin_instance import PluginInstance
+from steamship.invocable import PackageService, post
+from steamship.invocable.mixins.blockifier_mixin import BlockifierMixin
+from steamship.invocable.mixins.file_importer_mixin import FileImporterMixin
+from steamship.invocable.mixins.indexer_mixin import (
+    DEFAULT_EMBEDDING_INDEX_HANDLE,
+    IndexerMixin,
+)
+from steamship.invocable.mixins.indexer_pipeline_mixin import IndexerPipelineMixin
+from steamship.utils.file_tags import update_file_status
+from steamship.utils.kv_store import KeyValueStore
+from steamship.utils.text_chunker import chunk_text
+
+if TYPE_CHECKING:
+    from embedding_cache import EmbeddingCache
+    from keyword_index import BM25Index
+    from vector_index import BruteForceIndex, LocalIndex
+
+
+class DocumentIndexerMixin(IndexerMixin):
+    """IndexerMixin that indexes Files incrementally, and calls each of `on_index_changed` when the index changes.
+
+    Chunks of a File indexed from a URL are recorded in an IndexManifest. Indexing the same URL again only inserts
+    the chunks that are new, and marks the ones that have disappeared as stale (see index_manifest.py).
+
+    With a `vector_index_backend` other than `steamship`, chunks are embedded here and kept in a local index under
+    `vector_index_dir` instead (see vector_index.py). Stale chunks are then deleted from the local index outright.
+
+    With `keyword_search_enabled`, chunks are also added to a keyword index under `vector_index_dir` (see
+    keyword_index.py).
+
+    With `embedding_cache_enabled`, chunks that this mixin embeds are looked up in an EmbeddingCache under
+    `vector_index_dir` first, so that a chunk indexed from several sources is only embedded once.
+
+    Every endpoint of IndexerMixin goes through the above, including `/index_block` and `/search_index`.
+    """
+
+    on_index_changed: List[Callable[[], None]]
+
+    def __init__(
+        self,
+        client: Steamship,
+        on_index_changed: Optional[List[Callable[[], None]]] = None,
+        vector_index_backend: str = "steamship",
+        vector_index_dir: Optional[str] = None,
+        keyword_search_enabled: bool = False,
+        embedding_cache_enabled: bool = False,
+        **kwargs,
+    ):
+        super().__init__(client, **kwargs)
+        self.on_index_changed = on_index_changed or []
+        self.manifests: Dict[str, IndexManifest] = {}
+        self.vector_index_backend = vector_index_backend
+        self.vector_index_dir = vector_index_dir
+        self.keyword_search_enabled = keyword_search_enabled
+        self.embedding_cache_enabled = embedding_cache_enabled
+        self._embedder: Optional[PluginInstance] = None
+
+    def index_changed(self):
+        for callback in self.on_index_changed:
+            callback()
+
+    def tags_for_text(self, text: str, metadata: Optional[dict] = None) -> List[Tag]:
+        """Split `text` into the chunks that `index_text` would insert, without inserting them."""
+        return [
+            Tag(text=chunk, value=dict(metadata or {}))
+            for chunk in chunk_text(
+                text,
+                chunk_size=self.context_window_size,
+                chunk_overlap=self.context_window_overlap,
+            )
+        ]
+
+    def tags_for_file(self, file: File, metadata: Optional[dict] = None) -> List[Tag]:
+        """Split a blockified File into the chunks that `index_file` would insert, without inserting them."""
+        file_metadata = {}
+        if file.mime_type:
+            file_metadata["mime_type"] = file.mime_type
+        for tag in file.tags or []:
+            if tag.kind == TagKind.DOCUMENT and tag.name == DocTag.TITLE:
+                if title := tag.value.get(TagValueKey.STRING_VALUE):
+                    file_metadata["title"] = title
+        file_metadata.update(metadata or {})
+
+        tags = []
+        for block in file.blocks or []:
+            tags.extend(self.tags_for_block(block, file_metadata))
+        return tags
+
+    def tags_for_block(
+        self, block: Block, metadata: Optional[dict] = None
+    ) -> List[Tag]:
+        """Split a Block into the chunks that `index_block` would insert, without inserting them."""
+        if not block.text:
+            return []
+        block_metadata = {
+            **(metadata or {}),
+            "file_id": block.file_id,
+            "block_id": block.id,
+            "page": self._get_page(block),
+        }
+        return self.tags_for_text(block.text, block_metadata)
+
+    def local_index(
+        self, index_handle: Optional[str] = None
+    ) -> Optional["BruteForceIndex"]:
+        """The local index `index_handle`, or None if chunks are kept in the Steamship embedding index."""
+        if self.vector_index_backend == "steamship":
+            return None
+        # Deferred, like the other local indexes, so that the agent doesn't import numpy unless it keeps one.
+        from vector_index import open_vector_index
+
+        return open_vector_index(
+            self.vector_index_backend,
+            self.vector_index_dir,
+            index_handle or DEFAULT_EMBEDDING_INDEX_HANDLE,
+        )
+
+    def keyword_index(
+        self, index_handle: Optional[str] = None
+    ) -> Optional["BM25Index"]:
+        """The keyword index kept alongside the index `index_handle`, or None if keyword search is off."""
+        if not self.keyword_search_enabled:
+            return None
+        from keyword_index import open_keyword_index
+
+        return open_keyword_index(
+            self.vector_index_dir, index_handle or DEFAULT_EMBEDDING_INDEX_HANDLE
+        )
+
+    def local_indexes(self, index_handle: Optional[str] = None) -> List["LocalIndex"]:
+        return [
+            index
+            for index in (
+                self.local_index(index_handle),
+                self.keyword_index(index_handle),
+            )
+            if index is not None
+        ]
+
+    def embedder(self) -> PluginInstance:
+        if self._embedder is None:
+            self._embedder = use_embedder(self.client, self.embedding_index_config)
+        return self._embedder
+
+    def embedding_cache(self) -> Optional["EmbeddingCache"]:
+        if not self.embedding_cache_enabled or self.vector_index_dir is None:
+            return None
+        from embedding_cache import open_embedding_cache
+
+        return open_embedding_cache(self.vector_index_dir, self.embedding_index_config)
+
+    def embed_chunks(self, texts: List[str]) -> Tuple[List[List[float]], List[bool]]:
+        """Embed `texts` in one go, except for those in the embedding cache. Also return which those were."""
+        cache = self.embedding_cache()
+        if cache is None:
+            return embed_texts(self.embedder(), texts), [False] * len(texts)
+        return cache.embed(texts, lambda missing: embed_texts(self.embedder(), missing))
+
+    def cached_embeddings(
+        self, tags: List[Tag], index_handle: Optional[str] = None
+    ) -> int:
+        """Count how many of `tags` `insert_tags` would take embeddings for from the cache, without inserting them."""
+        cache = self.embedding_cache()
+        if cache is None or self.local_index(index_handle) is None:
+            return 0
+        return sum(
+            embedding is not None
+            for embedding in cache.get_many([tag.text for tag in tags])
+        )
+
+    def insert_tags(
+        self, tags: List[Tag], index_handle: Optional[str] = None, batch_size: int = 100
+    ) -> List[bool]:
+        """Insert `tags` into the embedding index, `batch_size` at a time. Each insert embeds its tags in one go.
+
+        Return whether the embedding of each tag came from the embedding cache.
+        """
+        cached: List[bool] = []
+        local_index = self.local_index(index_handle)
+        keyword_index = self.keyword_index(index_handle)
+        index = self._get_index(index_handle) if local_index is None else None
+        for start in range(0, len(tags), batch_size):
+            batch = tags[start : start + batch_size]
+            items = [{"text": tag.text, "value": tag.value or {}} for tag in batch]
+            if local_index is None:
+                index.insert(batch)
+                batch_cached = [False] * len(batch)
+            else:
+                embeddings, batch_cached = self.embed_chunks(
+                    [tag.text for tag in batch]
+                )
+                local_index.add(embeddings, items)
+            if keyword_index is not None:
+                keyword_index.add(items)
+            self.record_inserted(batch, index_handle)
+            cached += batch_cached
+        return cached
+
+    def record_inserted(self, tags: List[Tag], index_handle: Optional[str] = None):
+        """Record the inserted chunks among `tags` that have a source in the manifest, so that retries skip them."""
+        hashes_by_source: Dict[str, set] = {}
+        for tag in tags:
+            value = tag.value or {}
+            if value.get(SOURCE_KEY) and value.get(CHUNK_HASH_KEY):
+                hashes_by_source.setdefault(value[SOURCE_KEY], set()).add(
+                    value[CHUNK_HASH_KEY]
+                )
+        if hashes_by_source:
+            self.manifest(index_handle).record_inserted(hashes_by_source)
+
+    def manifest(self, index_handle: Optional[str] = None) -> IndexManifest:
+        handle = index_handle or DEFAULT_EMBEDDING_INDEX_HANDLE
+        if handle not in self.manifests:
+            store_identifier = IndexManifest.store_identifier(handle)
+            self.manifests[handle] = IndexManifest(
+                KeyValueStore(self.client, store_identifier=store_identifier),
+                cache_key=f"{self.client.config.workspace_id}/{store_identifier}",
+            )
+        return self.manifests[handle]
+
+    def diff_tags(
+        self, tags: List[Tag], index_handle: Optional[str] = None
+    ) -> ManifestDiff:
+        """Work out which of `tags` need inserting. Tags without a source URL always do."""
+        source = next(
+            (
+                tag.value[SOURCE_KEY]
+                for tag in tags
+                if (tag.value or {}).get(SOURCE_KEY)
+            ),
+            None,
+        )
+        if source is None:
+            return ManifestDiff(None, tags, 0, 0, 0, [], [])
+        return self.manifest(index_handle).diff(source, tags)
+
+    def apply_diffs(
+        self,
+        diffs: List[ManifestDiff],
+        index_handle: Optional[str] = None,
+        batch_size: int = 100,
+    ) -> List[int]:
+        """Insert the new chunks of each of `diffs` and record them in the manifest.
+
+        Return how many embeddings of each diff's chunks came from the embedding cache.
+        """
+        cached = self.insert_tags(
+            [tag for diff in diffs for tag in diff.to_insert],
+            index_handle=index_handle,
+            batch_size=batch_size,
+        )
+        local_indexes = self.local_indexes(index_handle)
+        for diff in diffs:
+            if diff.source is None:
+                continue
+            for local_index in local_indexes:
+                local_index.delete_chunks(diff.source, set(diff.stale))
+                local_index.restore_chunks(diff.source, set(diff.live))
+            self.manifest(index_handle).commit(diff)
+
+        counts, start = [], 0
+        for diff in diffs:
+            counts.append(sum(cached[start : start + len(diff.to_insert)]))
+            start += len(diff.to_insert)
+        return counts
+
+    def index_tags(
+        self, tags: List[Tag], index_handle: Optional[str] = None, dry_run: bool = False
+    ) -> Dict[str, Any]:
+        """Index `tags` incrementally, returning what was (or with `dry_run`, would have been) done."""
+        diff = self.diff_tags(tags, index_handle)
+        if dry_run:
+            cached = self.cached_embeddings(diff.to_insert, index_handle)
+        else:
+            cached = self.apply_diffs([diff], index_handle)[0]
+            if diff.changes_index:
+                self.index_changed()
+        return {**diff.report(), "embeddings_cached": cached, "dry_run": dry_run}
+
+    @post("/index_text")
+    def index_text(
+        self,
+        text: str,
+        metadata: Optional[dict] = None,
+        index_handle: Optional[str] = None,
+    ) -> bool:
+        """Load text into an embedding index.
+
+        Optional arguments:
+        - index_handle (uses your default index if blank)
+        - metadata (returned on embedding results for source attribution)
+        """
+        self.index_tags(self.tags_for_text(text, metadata), index_handle=index_handle)
+        return True
+
+    @post("/index_block")
+    def index_block(
+        self,
+        block_id: str,
+        metadata: Optional[dict] = None,
+        index_handle: Optional[str] = None,
+    ) -> bool:
+        """Load a Steamship Block into an embedding index.
+
+        Optional arguments:
+        - index_handle (uses your default index if blank)
+        - metadata (returned on embedding results for source attribution)
+        """
+        block = Block.get(self.client, _id=block_id)
+        self.index_tags(self.tags_for_block(block, metadata), index_handle=index_handle)
+        return True
+
+    @post("/index_file")
+    def index_file(
+        self,
+        file_id: str,
+        metadata: Optional[dict] = None,
+        index_handle: Optional[str] = None,
+    ) -> bool:
+        """Load a Steamship File into an embedding index.
+
+        Optional arguments:
+        - index_handle (uses your default index if blank)
+        - metadata (returned on embedding results for source attribution)
+        """
+        file = File.get(self.client, _id=file_id)
+        update_file_status(self.client, file, "Indexing")
+        self.index_tags(self.tags_for_file(file, metadata), index_handle=index_handle)
+        update_file_status(self.client, file, "Indexed")
+        return True
+
+    def search_tags(
+        self, query: str, index_handle: Optional[str] = None, k: int = 5
+    ) -> List[Tuple[Tag, float]]:
+        """Return the `k` chunks that best match `query`, as DocumentQATool would find them, with their scores.
+
+        Chunks removed from their source are left out, and with keyword search, keyword matches are fused in.
+        """
+        local_index = self.local_index(index_handle)
+        if local_index is not None:
+            query_embedding = embed_texts(self.embedder(), [query])[0]
+            results = [
+                (Tag(text=item["text"], value=item["value"]), score)
+                for item, score in local_index.search_items(query_embedding, k)
+            ]
+        else:
+            manifest = self.manifest(index_handle)
+            task = self._get_index(index_handle).search(
+                query, k=manifest.search_limit(k)
+            )
+            task.wait()
+            results = manifest.drop_stale(
+                [
+                    (item.tag, item.score or 0.0)
+                    for item in task.output.items
+                    if item.tag and item.tag.text
+                ]
+            )[:k]
+
+        keyword_index = self.keyword_index(index_handle)
+        if keyword_index is not None:
+            keyword_results = [
+                (Tag(text=item["text"], value=item["value"]), score)
+                for item, score in keyword_index.search_items(query, k)
+            ]
+            results = reciprocal_rank_fusion([results, keyword_results])[:k]
+        return results
+
+    @post("/search_index")
+    def search_index(
+        self, query: str, index_handle: Optional[str] = None, k: int = 5
+    ) -> SearchResults:
+        """Search an embedding index.
+
+        Optional arguments:
+        - index_handle (uses your default index if blank)
+        """
+        return SearchResults(
+            items=[
+                SearchResult(tag=tag, score=score)
+                for tag, score in self.search_tags(query, index_handle, k)
+            ]
+        )
+
+
+class BatchIndexItem(BaseModel):
+    """One document to index with `/index_batch`: either a `url` or some `text`."""
+
+    url: Optional[str] = Field(None, description="A URL to import, as with /index_url")
+    text: Optional[str] = Field(None, description="Text to index, as with /index_text")
+    metadata: Optional[dict] = Field(
+        None, description="Returned on embedding results for source attribution"
+    )
+    mime_type: Optional[str] = Field(
+        None, description="The MIME type of the URL, if it can't be guessed"
+    )
+
+
+class BatchDocument(BaseModel):
+    """A BatchIndexItem on its way through the indexing pipeline."""
+
+    item: BatchIndexItem
+    file: Optional[File] = None
+    import_task_id: Optional[str] = None
+    tags: List[Tag] = []
+
+
+class DocumentIndexerPipelineMixin(IndexerPipelineMixin):
+    """IndexerPipelineMixin that indexes with a DocumentIndexerMixin.
+
+    List this class and DocumentIndexerMixin in USED_MIXIN_CLASSES in place of IndexerPipelineMixin and IndexerMixin.
+    """
+
+    indexer_mixin: DocumentIndexerMixin
+
+    BATCH_STAGE_WORKERS = {"import": 8, "blockify": 8, "chunk": 2, "index": 2}
+    """How many items each stage of `/index_batch` works on at once.
+
+    Importing and blockifying mostly wait on Steamship, so they can run wide. Chunking is local and fast.
+    """
+
+    BATCH_QUEUE_SIZE = 32
+    """How many items may wait in front of each stage of `/index_batch` before the stage before it pauses."""
+
+    BATCH_INDEX_SIZE = 100
+    """How many chunks are embedded and inserted into the index per call."""
+
+    BATCH_BLOCKIFY_TIMEOUT_SECONDS = 600
+    """How long to wait for a single document to be imported and blockified."""
+
+    def __init__(
+        self,
+        client: Steamship,
+        invocable: PackageService,
+        on_index_changed: Optional[List[Callable[[], None]]] = None,
+        vector_index_backend: str = "steamship",
+        vector_index_dir: Optional[str] = None,
+        keyword_search_enabled: bool = False,
+        embedding_cache_enabled: bool = False,
+    ):
+        # Deliberately not calling IndexerPipelineMixin.__init__, which would add a plain IndexerMixin.
+        self.client = client
+        self.invocable = invocable
+
+        self.importer_mixin = FileImporterMixin(client)
+        self.invocable.add_mixin(self.importer_mixin)
+
+        self.blockifier_mixin = BlockifierMixin(client)
+        self.invocable.add_mixin(self.blockifier_mixin)
+
+        self.indexer_mixin = DocumentIndexerMixin(
+            client,
+            on_index_changed=on_index_changed,
+            vector_index_backend=vector_index_backend,
+            vector_index_dir=vector_index_dir,
+            keyword_search_enabled=keyword_search_enabled,
+            embedding_cache_enabled=embedding_cache_enabled,
+        )
+        self.invocable.add_mixin(self.indexer_mixin)
+
+    # Batch indexing
+    # --------------
+
+    def _import(self, document: BatchDocument) -> BatchDocument:
+        if document.item.url:
+            file, task = self.importer_mixin.import_url_to_file_and_task(
+                document.item.url
+            )
+            document.file = file
+            document.import_task_id = task.task_id if task else None
+        elif not document.item.text:
+            raise SteamshipError(message="Each item needs either a `url` or `text`.")
+        return document
+
+    def _blockify(self, document: BatchDocument) -> BatchDocument:
+        if document.file is not None:
+            task = self.blockifier_mixin.blockify(
+                file_id=document.file.id,
+                mime_type=document.item.mime_type,
+                after_task_id=document.import_task_id,
+            )
+            task.wait(max_timeout_s=self.BATCH_BLOCKIFY_TIMEOUT_SECONDS)
+            document.file = File.get(self.client, _id=document.file.id)
+        return document
+
+    def _chunk(self, document: BatchDocument) -> BatchDocument:
+        metadata = dict(document.item.metadata or {})
+        if document.file is not None:
+            metadata = {"url": document.item.url, **metadata}
+            document.tags = self.indexer_mixin.tags_for_file(document.file, metadata)
+        else:
+            document.tags = self.indexer_mixin.tags_for_text(
+                document.item.text, metadata
+            )
+        if not document.tags:
+            raise SteamshipError(message="No text was found to index.")
+        return document
+
+    def _index(
+        self, documents: List[BatchDocument], index_handle: Optional[str], dry_run: bool
+    ) -> List[Dict[str, Any]]:
+        diffs = [
+            self.indexer_mixin.diff_tags(document.tags, index_handle)
+            for document in documents
+        ]
+        if dry_run:
+            cached = [
+                self.indexer_mixin.cached_embeddings(diff.to_insert, index_handle)
+                for diff in diffs
+            ]
+        else:
+            cached = self.indexer_mixin.apply_diffs(
+                diffs, index_handle=index_handle, batch_size=self.BATCH_INDEX_SIZE
+            )
+            for document in documents:
+                if document.file is not None:
+                    update_file_status(self.client, document.file, "Indexed")
+
+        reports = []
+        for document, diff, embeddings_cached in zip(documents, diffs, cached):
+            report = diff.report()
+            report["embeddings_cached"] = embeddings_cached
+            del report["source"]
+            report["file_id"] = document.file.id if document.file else None
+            report["changes_index"] = diff.changes_index
+            reports.append(report)
+        return reports
+
+    def batch_pipeline(
+        self, index_handle: Optional[str] = None, dry_run: bool = False
+    ) -> Pipeline:
+        """Build the pipeline that `/index_batch` runs: import, blockify, chunk, then embed and index in batches."""
+        workers = self.BATCH_STAGE_WORKERS
+        return Pipeline(
+            [
+                PipelineStage(
+                    "import",
+                    run=self._import,
+                    workers=workers["import"],
+                    queue_size=self.BATCH_QUEUE_SIZE,
+                ),
+                PipelineStage(
+                    "blockify",
+                    run=self._blockify,
+                    workers=workers["blockify"],
+                    queue_size=self.BATCH_QUEUE_SIZE,
+                ),
+                PipelineStage(
+                    "chunk",
+                    run=self._chunk,
+                    workers=workers["chunk"],
+                    queue_size=self.BATCH_QUEUE_SIZE,
+                ),
+                PipelineStage(
+                    "index",
+                    run_batch=lambda documents: self._index(
+                        documents, index_handle, dry_run
+                    ),
+                    workers=workers["index"],
+                    queue_size=self.BATCH_QUEUE_SIZE,
+                    batch_size=self.BATCH_INDEX_SIZE,
+                    weight=lambda document: len(document.tags),
+                ),
+            ]
+        )
+
+    @post("/index_batch")
+    def index_batch(
+        self,
+        items: List[dict],
+        index_handle: Optional[str] = None,
+        dry_run: bool = False,
+    ) -> Dict[str, Any]:
+        """Load many URLs and texts into an embedding index at once.
+
+        Each item is a dict with either a `url` or `text`, and optionally `metadata` and `mime_type` (see /index_url
+        and /index_text). Items are imported, blockified, chunked and indexed concurrently, with chunks from several
+        documents embedded and inserted together. The call returns once every item has been indexed or has failed.
+
+        The result reports, for each item in order, whether it was indexed and how many chunks it produced, or at
+        which stage it failed and why; and for each stage, how many items it processed and how long it spent on them.
+
+        Documents with a URL are indexed incrementally: if the URL has been indexed before, only its new chunks are
+        embedded and inserted. With `dry_run`, documents are still imported and chunked, but nothing is indexed; the
+        result shows how many chunks would have been inserted and how many embeddings would have been saved.
+
+        `embeddings_cached` counts the chunks that were new to their URL, but whose embeddings were found in the
+        embedding cache because the same text had been embedded before.
+
+        A single call is bounded by the request timeout, so send large corpora as several batches of a few hundred
+        items.
+        """
+        started_at = time.perf_counter()
+        documents = []
+        for item in items:
+            try:
+                documents.append(BatchDocument(item=BatchIndexItem.parse_obj(item)))
+            except Exception as e:
+                raise SteamshipError(message=f"Invalid item {item}: {e}")
+
+        pipeline = self.batch_pipeline(index_handle, dry_run)
+        outcomes = pipeline.run(documents)
+
+        reports = []
+        for position, (document, outcome) in enumerate(zip(documents, outcomes)):
+            report = {
+                "item": position,
+                "source": document.item.url or "text",
+                "status": (
+                    ("checked" if dry_run else "indexed") if outcome.ok else "failed"
+                ),
+            }
+            if outcome.ok:
+                report.update(outcome.output)
+            else:
+                report.update(failed_stage=outcome.failed_stage, error=outcome.error)
+                logging.warning(
+                    f"Failed to index item {position} at stage {outcome.failed_stage}: {outcome.error}"
+                )
+            reports.append(report)
+
+        succeeded = [outcome.output for outcome in outcomes if outcome.ok]
+        if not dry_run and any(report["changes_index"] for report in succeeded):
+            self.indexer_mixin.index_changed()
+
+        return {
+            "indexed": 0 if dry_run else len(succeeded),
+            "failed": len(outcomes) - len(succeeded),
+            "dry_run": dry_run,
+            "inserted": sum(report["inserted"] for report in succeeded),
+            "embeddings_saved": sum(report["embeddings_saved"] for report in succeeded),
+            "embeddings_cached": sum(
+                report["embeddings_cached"] for report in succeeded
+            ),
+            "seconds": time.perf_counter() - started_at,
+            "stages": {name: stats.to_dict() for name, stats in pipeline.stats.items()},
+            "items": reports,
+        }
+
+    @post("/reindex_url")
+    def reindex_url(
+        self,
+        url: str,
+        metadata: Optional[dict] = None,
+        index_handle: Optional[str] = None,
+        mime_type: Optional[str] = None,
+        dry_run: bool = False,
+    ) -> Dict[str, Any]:
+        """Index a new version of a URL, only embedding the chunks that changed since it was last indexed.
+
+        Unlike /index_url, this waits for the import and returns what was done: how many chunks were inserted, left
+        unchanged or removed. With `dry_run`, nothing is indexed, and the result shows what would have been.
+        """
+        item = {"url": url, "metadata": metadata, "mime_type": mime_type}
+        return self.index_batch([item], index_handle=index_handle, dry_run=dry_run)[
+            "items"
+        ][0]
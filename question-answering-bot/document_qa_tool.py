@@ -0,0 +1,254 @@
+"""Answers questions about the indexed documents, reusing earlier answers where it can."""
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from answer_cache import AnswerCache
+from context_packer import ContextPacker, PackedContext, default_token_budget
+from embeddings import dot, embed_texts, normalize, use_embedder
+from index_manifest import IndexManifest
+from pydantic import PrivateAttr
+from retrieval import reciprocal_rank_fusion
+from steamship import Block, DocTag, Steamship, Tag
+from steamship.agents.llms import OpenAI
+from steamship.agents.logging import AgentLogging
+from steamship.agents.schema import AgentContext
+from steamship.agents.tools.question_answering import VectorSearchQATool
+from steamship.agents.utils import get_llm
+from steamship.data import TagKind
+from steamship.data.plugin.index_plugin_instance import EmbeddingIndexPluginInstance
+from steamship.data.plugin.plugin_instance import PluginInstance
+
+
+class DocumentQATool(VectorSearchQATool):
+    """VectorSearchQATool with an AnswerCache in front of it, and which ignores chunks removed from their source.
+
+    A question that matches a cached one is answered without a vector search or an LLM completion.
+
+    With a `keyword_index`, each question is also looked up by keyword, and the two sets of results are combined with
+    reciprocal-rank fusion, so that chunks containing identifiers or exact phrases from the question aren't missed.
+
+    The results are packed into `context_token_budget` tokens before they are sent to the LLM: duplicates are dropped,
+    overlapping chunks merged, and the most relevant passages that fit chosen.
+    """
+
+    answer_cache: Optional[AnswerCache] = None
+    """Where answers are remembered. Leave unset to always search and complete."""
+
+    index_manifest: Optional[IndexManifest] = None
+    """The manifest of the embedding index, used to drop stale chunks from search results."""
+
+    vector_index: Optional[Any] = None
+    """A local copy of the embedding index (a BruteForceIndex) to search instead of the Steamship one (see
+    vector_index.py). Typed loosely so that this module doesn't import numpy.
+
+    Stale chunks are deleted from a local index, so `index_manifest` isn't needed with one.
+    """
+
+    keyword_index: Optional[Any] = None
+    """A keyword index (a BM25Index) of the same chunks. Leave unset to only search by embedding."""
+
+    search_candidates: int = 6
+    """How many results to take from each index, before they are combined and packed.
+
+    A few more than `load_docs_count`, so that chunks dropped as duplicates or merged into others can be replaced.
+    """
+
+    rerank: bool = False
+    """Whether to reorder combined results by how similar their embeddings are to the question's."""
+
+    context_token_budget: Optional[int] = None
+    """How many tokens of passages may be sent to the LLM per question (see context_packer.py).
+
+    Leave unset for about as many as the `load_docs_count` best chunks of `chunk_characters` characters take.
+    """
+
+    chunk_characters: int = 200
+    """How many characters the indexer puts in each chunk (its `context_window_size`)."""
+
+    embedding_cache_dir: Optional[str] = None
+    """Where the EmbeddingCache that reranking takes chunk embeddings from is kept. Leave unset to embed every time."""
+
+    _embedding_index: Optional[EmbeddingIndexPluginInstance] = PrivateAttr(default=None)
+    _embedder: Optional[PluginInstance] = PrivateAttr(default=None)
+    _question_embeddings: Dict[str, List[float]] = PrivateAttr(default_factory=dict)
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def get_embedding_index(self, client: Steamship) -> EmbeddingIndexPluginInstance:
+        """Fetch the embedding index once, since both the cache and the search need it."""
+        if self._embedding_index is None:
+            self._embedding_index = super().get_embedding_index(client)
+        return self._embedding_index
+
+    def embed_question(self, question: str, context: AgentContext) -> List[float]:
+        """Embed `question` with the same embedder the index uses, once per question, for the cache and the search."""
+        if question not in self._question_embeddings:
+            self._question_embeddings[question] = embed_texts(
+                self.get_embedder(context.client), [question]
+            )[0]
+        return self._question_embeddings[question]
+
+    def get_embedder(self, client: Steamship) -> PluginInstance:
+        if self._embedder is None:
+            self._embedder = use_embedder(client, self.embedding_index_config)
+        return self._embedder
+
+    def vector_search(
+        self, question: str, k: int, context: AgentContext
+    ) -> List[Tuple[Tag, float]]:
+        """Return the `k` chunks whose embeddings are most similar to that of `question`, with their similarities."""
+        if self.vector_index is not None:
+            results = self.vector_index.search_items(
+                self.embed_question(question, context), k
+            )
+            return [
+                (Tag(text=item["text"], value=item["value"]), score)
+                for item, score in results
+            ]
+
+        limit = k
+        if self.index_manifest is not None:
+            k = self.index_manifest.search_limit(k)
+        task = self.get_embedding_index(context.client).search(question, k=k)
+        task.wait()
+        results = [
+            (item.tag, item.score or 0.0)
+            for item in task.output.items
+            if item.tag and item.tag.text
+        ]
+
+        if self.index_manifest is not None:
+            results = self.index_manifest.drop_stale(results)
+        return results[:limit]
+
+    def keyword_search(self, question: str, k: int) -> List[Tuple[Tag, float]]:
+        """Return the `k` chunks that best match the words of `question`, with their BM25 scores."""
+        return [
+            (Tag(text=item["text"], value=item["value"]), score)
+            for item, score in self.keyword_index.search_items(question, k)
+        ]
+
+    def rerank_by_embedding(
+        self, question: str, results: List[Tuple[Tag, float]], context: AgentContext
+    ) -> List[Tuple[Tag, float]]:
+        """Rescore `results` by the similarity of their embeddings to that of `question`, embedding them in one go."""
+        if len(results) < 2:
+            return results
+        question_embedding = normalize(self.embed_question(question, context))
+        texts = [tag.text for tag, _ in results]
+        if self.embedding_cache_dir is None:
+            embeddings = embed_texts(self.get_embedder(context.client), texts)
+        else:
+            # Deferred so that loading the agent doesn't import numpy unless the embedding cache is used.
+            from embedding_cache import open_embedding_cache
+
+            embeddings, _ = open_embedding_cache(
+                self.embedding_cache_dir, self.embedding_index_config
+            ).embed(
+                texts,
+                lambda missing: embed_texts(self.get_embedder(context.client), missing),
+            )
+        rescored = [
+            (tag, dot(question_embedding, normalize(embedding)))
+            for (tag, _), embedding in zip(results, embeddings)
+        ]
+        return sorted(rescored, key=lambda result: result[1], reverse=True)
+
+    def retrieve(self, question: str, context: AgentContext) -> PackedContext:
+        """Search for chunks relevant to `question`, and pack them into the context to send to the LLM."""
+        k = max(self.search_candidates, self.load_docs_count)
+        if self.keyword_index is None:
+            results = self.vector_search(question, k, context)
+        else:
+            results = reciprocal_rank_fusion(
+                [
+                    self.vector_search(question, k, context),
+                    self.keyword_search(question, k),
+                ]
+            )[:k]
+            if self.rerank:
+                results = self.rerank_by_embedding(question, results, context)
+
+        packer = ContextPacker(
+            token_budget=self.context_token_budget
+            or default_token_budget(self.load_docs_count, self.chunk_characters)
+        )
+        packed = packer.pack(results)
+        logging.info(
+            f"Tool {self.name}: sending {packed.metrics['tokens_sent']} of {packed.metrics['tokens_retrieved']} "
+            f"retrieved tokens (budget {packed.metrics['token_budget']})",
+            extra={AgentLogging.TOOL_NAME: self.name, "context": packed.metrics},
+        )
+        return packed
+
+    def search(self, question: str, context: AgentContext) -> List[Tag]:
+        """Return the passages most relevant to `question`, best first, within the token budget."""
+        return self.retrieve(question, context).tags
+
+    def complete_answer(
+        self,
+        question: str,
+        sources: List[Tag],
+        context: AgentContext,
+        context_metrics: Optional[Dict[str, Any]] = None,
+    ) -> List[Block]:
+        """Ask the LLM to answer `question` from `sources`, tagging the answer with where it came from.
+
+        `context_metrics` from packing the sources are recorded on the same tag.
+        """
+        final_prompt = self.question_answering_prompt.format(
+            source_text="\n".join(
+                self.source_document_prompt.format(text=tag.text) for tag in sources
+            ),
+            question=question,
+        )
+        logging.info(
+            f"Tool {self.name}: sending prompt to LLM",
+            extra={
+                AgentLogging.TOOL_NAME: self.name,
+                AgentLogging.IS_MESSAGE: True,
+                AgentLogging.MESSAGE_TYPE: AgentLogging.OBSERVATION,
+                AgentLogging.MESSAGE_AUTHOR: AgentLogging.TOOL,
+                "prompt": final_prompt,
+            },
+        )
+        llm = get_llm(context) or OpenAI(client=context.client)
+        output_blocks = llm.complete(prompt=final_prompt)
+
+        source_metadata = [dict(tag.value or {}) for tag in sources]
+        for output_block in output_blocks:
+            output_block.tags = (output_block.tags or []) + [
+                Tag(
+                    kind=TagKind.DOCUMENT,
+                    name=DocTag.SOURCE,
+                    value={"sources": source_metadata, "context": context_metrics},
+                )
+            ]
+        return output_blocks
+
+    def answer_question(self, question: str, context: AgentContext) -> List[Block]:
+        if self.answer_cache is None:
+            packed = self.retrieve(question, context)
+            return self.complete_answer(question, packed.tags, context, packed.metrics)
+
+        lookup = self.answer_cache.lookup(
+            question, lambda text: self.embed_question(text, context)
+        )
+        if lookup.blocks is not None:
+            logging.info(
+                f"Tool {self.name}: answered from cache ({lookup.match} match, similarity {lookup.similarity:.3f})"
+            )
+            return lookup.blocks
+
+        started_at = time.perf_counter()
+        packed = self.retrieve(question, context)
+        blocks = self.complete_answer(question, packed.tags, context, packed.metrics)
+        self.answer_cache.put(
+            question,
+            blocks,
+            answer_seconds=time.perf_counter() - started_at,
+            embedding=lookup.embedding,
+        )
+        return blocks
@@ -0,0 +1,164 @@
+"""A content-addressed cache of chunk embeddings on local disk.
+
+Overlapping corpora, such as two versions of the same manual indexed from different URLs, share many identical chunks.
+The IndexManifest only knows about chunks indexed from the same URL, so without this cache each copy would be embedded
+again. Embeddings are keyed by the hash of the chunk's text, in a separate cache per embedding model.
+
+Only embeddings computed by this package are cached: those of chunks added to a local vector index, and of chunks
+reranked by DocumentQATool. The Steamship embedding index embeds chunks itself when they are inserted.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from index_manifest import chunk_hash
+
+
+def model_key(embedding_index_config: dict) -> str:
+    """Name the embedding model an index uses, so that its embeddings are never mixed with another model's."""
+    embedder = embedding_index_config["embedder"]
+    description = json.dumps(
+        [
+            embedder.get("plugin_handle"),
+            embedder.get("plugin_instance_handle") or embedder.get("instance_handle"),
+            embedder.get("version"),
+            embedder.get("config"),
+        ],
+        sort_keys=True,
+    )
+    readable = re.sub(
+        r"[^a-zA-Z0-9_.-]+", "-", str((embedder.get("config") or {}).get("model"))
+    )
+    return f"{readable}-{hashlib.sha256(description.encode('utf-8')).hexdigest()[:12]}"
+
+
+class EmbeddingCache:
+    """Embeddings of one model, keyed by chunk hash, in a directory on local disk.
+
+    Embeddings are appended as float32 rows to `vectors.f32` and read through a memory map. `keys.bin` holds the
+    16-byte chunk hash of each row, and is read into a dict from hash to row when the cache is opened.
+
+    Like KeyValueStore, a cache on disk is only safe to write from one process at a time.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        meta = self._read_meta()
+        self.dim: Optional[int] = meta.get("dim")
+        self.count: int = meta.get("count", 0)
+        self.hits = 0
+        self.misses = 0
+        self._rows: Dict[bytes, int] = {}
+        if self.count:
+            keys = np.fromfile(self._file("keys.bin"), dtype="S16", count=self.count)
+            self._rows = {key: row for row, key in enumerate(keys.tolist())}
+        self._vectors: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _read_meta(self) -> dict:
+        if not os.path.exists(self._file("meta.json")):
+            return {}
+        with open(self._file("meta.json")) as f:
+            return json.load(f)
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return bytes.fromhex(chunk_hash(text))
+
+    @property
+    def vectors(self) -> np.ndarray:
+        if self._vectors is None:
+            self._vectors = np.memmap(
+                self._file("vectors.f32"),
+                dtype=np.float32,
+                mode="r",
+                shape=(self.count, self.dim),
+            )
+        return self._vectors
+
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Return the cached embedding of each of `texts`, or None where there isn't one."""
+        with self._lock:
+            rows = [self._rows.get(EmbeddingCache._key(text)) for text in texts]
+            found = [row for row in rows if row is not None]
+            vectors = iter(self.vectors[found].tolist() if found else [])
+            return [None if row is None else next(vectors) for row in rows]
+
+    def put_many(self, texts: List[str], embeddings: List[List[float]]):
+        """Cache the embedding of each of `texts`, unless it is already cached."""
+        with self._lock:
+            new: Dict[bytes, List[float]] = {}
+            for text, embedding in zip(texts, embeddings):
+                key = EmbeddingCache._key(text)
+                if key not in self._rows:
+                    new[key] = embedding
+            if not new:
+                return
+            vectors = np.asarray(list(new.values()), dtype=np.float32)
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            for name, expected_size, data in (
+                ("vectors.f32", self.count * self.dim * 4, vectors.tobytes()),
+                ("keys.bin", self.count * 16, b"".join(new)),
+            ):
+                with open(self._file(name), "ab") as f:
+                    f.truncate(expected_size)
+                    f.write(data)
+            for row, key in enumerate(new, start=self.count):
+                self._rows[key] = row
+            self.count += len(new)
+            self._vectors = None
+            with open(self._file("meta.json.tmp"), "w") as f:
+                json.dump({"dim": self.dim, "count": self.count}, f)
+            os.replace(self._file("meta.json.tmp"), self._file("meta.json"))
+
+    def embed(
+        self, texts: List[str], embed: Callable[[List[str]], List[List[float]]]
+    ) -> Tuple[List[List[float]], List[bool]]:
+        """Return the embedding of each of `texts`, and whether each came from the cache.
+
+        The texts that aren't cached are embedded with one call to `embed`, and cached.
+        """
+        embeddings = self.get_many(texts)
+        cached = [embedding is not None for embedding in embeddings]
+        missing = [i for i, hit in enumerate(cached) if not hit]
+        if missing:
+            computed = embed([texts[i] for i in missing])
+            for i, embedding in zip(missing, computed):
+                embeddings[i] = embedding
+            self.put_many([texts[i] for i in missing], computed)
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        return embeddings, cached
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": self.count, "hits": self.hits, "misses": self.misses}
+
+
+_OPEN_CACHES: Dict[str, EmbeddingCache] = {}
+_OPEN_CACHES_LOCK = threading.Lock()
+
+
+def open_embedding_cache(
+    index_dir: str, embedding_index_config: dict
+) -> EmbeddingCache:
+    """Return the cache of embeddings made with the embedder of `embedding_index_config`, kept under `index_dir`.
+
+    Like local indexes, opened caches are kept for the life of the process.
+    """
+    path = os.path.abspath(
+        os.path.join(index_dir, "embedding-cache", model_key(embedding_index_config))
+    )
+    with _OPEN_CACHES_LOCK:
+        if path not in _OPEN_CACHES:
+            _OPEN_CACHES[path] = EmbeddingCache(path)
+        return _OPEN_CACHES[path]
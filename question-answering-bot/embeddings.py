@@ -0,0 +1,53 @@
+"""Helpers for turning text into embedding vectors and comparing them."""
+import math
+from typing import List, Sequence
+
+from steamship import Block, File, Steamship
+from steamship.data import TagKind, TagValueKey
+from steamship.data.plugin.plugin_instance import PluginInstance
+
+
+def use_embedder(client: Steamship, embedding_index_config: dict) -> PluginInstance:
+    """Return the embedder plugin that an embedding index created with `embedding_index_config` uses."""
+    embedder = embedding_index_config["embedder"]
+    return client.use_plugin(
+        plugin_handle=embedder["plugin_handle"],
+        instance_handle=embedder.get("plugin_instance_handle")
+        or embedder.get("instance_handle"),
+        config=embedder.get("config"),
+        version=embedder.get("version"),
+        fetch_if_exists=embedder.get("fetch_if_exists", True),
+    )
+
+
+def embed_texts(embedder: PluginInstance, texts: List[str]) -> List[List[float]]:
+    """Embed each of `texts` with `embedder`, in a single round trip.
+
+    The texts are sent as the blocks of one inline File, and the embedding tag of each block is read back in order.
+    """
+    if not texts:
+        return []
+    task = embedder.tag(doc=File(blocks=[Block(text=text) for text in texts]))
+    task.wait()
+    embeddings = []
+    for block in task.output.file.blocks:
+        tag = next(
+            (tag for tag in block.tags or [] if tag.kind == TagKind.EMBEDDING), None
+        )
+        if tag is None:
+            raise ValueError(f"Embedder returned no embedding for block: {block.text}")
+        embeddings.append(tag.value[TagValueKey.VECTOR_VALUE])
+    return embeddings
+
+
+def normalize(vector: Sequence[float]) -> List[float]:
+    """Scale `vector` to unit length, so that cosine similarity becomes a dot product."""
+    norm = math.sqrt(sum(x * x for x in vector))
+    if norm == 0:
+        return list(vector)
+    return [x / norm for x in vector]
+
+
+def dot(a: Sequence[float], b: Sequence[float]) -> float:
+    """Return the dot product of `a` and `b`, which is their cosine similarity if both are normalized."""
+    return sum(x * y for x, y in zip(a, b))
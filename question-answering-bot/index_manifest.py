@@ -0,0 +1,255 @@
+"""Record of which chunks of each source document are in an embedding index.
+
+Documents that are re-indexed regularly (a nightly export, a wiki page) usually change very little between versions.
+The manifest remembers a hash of every chunk indexed for each source URL. When the source is indexed again, only
+chunks with new hashes need to be embedded and inserted.
+
+The embedding index can't delete individual items, so chunks that disappear from a source are marked stale in the
+manifest instead, and DocumentQATool drops stale chunks from search results. If a stale chunk reappears in a later
+version of the source, it is marked live again without being re-inserted.
+
+The stale chunks of every source are also kept together in one entry, with a version that changes whenever they do.
+Each process keeps a copy of them, and only re-reads the version every STALE_RECHECK_SECONDS, so searching doesn't
+cost a round trip to the store.
+"""
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from steamship import Tag
+
+CHUNK_HASH_KEY = "chunk_hash"
+"""The metadata key under which each indexed chunk records its hash."""
+
+SOURCE_KEY = "url"
+"""The metadata key that identifies the source document of a chunk."""
+
+MAX_STALE_OVERFETCH = 50
+"""The most extra chunks to search for, to make up for the stale chunks that will be dropped from the results.
+
+Searches ask for as many extra chunks as there are stale chunks, up to this. Past it, some searches may return fewer
+chunks than they asked for, and the documents are better indexed again into a new index.
+"""
+
+STALE_KEY = "__stale__"
+"""The store key under which the stale chunk hashes of every source, and their version, are kept."""
+
+VERSION_KEY = "__version__"
+"""The store key under which the version of STALE_KEY is kept on its own, so that it is cheap to check."""
+
+STALE_RECHECK_SECONDS = 10.0
+"""How long a process uses its copy of the stale chunks before checking that they haven't changed."""
+
+
+class _StaleChunks(NamedTuple):
+    """A process's copy of the stale chunk hashes of an index."""
+
+    version: int
+    hashes: Dict[str, Set[str]]
+    count: int
+    checked_at: float
+
+
+_STALE_CHUNKS: Dict[str, _StaleChunks] = {}
+_STALE_CHUNKS_LOCK = threading.Lock()
+
+
+def chunk_hash(text: str) -> str:
+    """Hash the normalized text of a chunk."""
+    text = re.sub(r"\s+", " ", unicodedata.normalize("NFC", text or "")).strip()
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+class ManifestDiff(NamedTuple):
+    """How a new version of a source differs from what is already in the index."""
+
+    source: Optional[str]
+    to_insert: List[Tag]
+    """Chunks that need to be embedded and inserted."""
+
+    unchanged: int
+    """Chunks that are already in the index and live."""
+
+    revived: int
+    """Chunks that are already in the index but were stale, and will become live again."""
+
+    removed: int
+    """Live chunks that are no longer in the source, and will become stale."""
+
+    live: List[str]
+    stale: List[str]
+
+    @property
+    def changes_index(self) -> bool:
+        """Whether applying this diff changes what searches can return."""
+        return bool(self.to_insert or self.revived or self.removed)
+
+    def report(self) -> Dict[str, Any]:
+        chunks = len(self.to_insert) + self.unchanged + self.revived
+        return {
+            "source": self.source,
+            "chunks": chunks,
+            "inserted": len(self.to_insert),
+            "unchanged": self.unchanged,
+            "revived": self.revived,
+            "removed": self.removed,
+            "embeddings_saved": self.unchanged + self.revived,
+        }
+
+
+class IndexManifest:
+    """Chunk hashes per source for one embedding index, kept in a KeyValueStore next to it.
+
+    Like KeyValueStore itself, this is only safe to write from one process at a time; within a process, writes are
+    serialized.
+    """
+
+    def __init__(self, store, cache_key: Optional[str] = None):
+        self.store = store
+        self._lock = threading.Lock()
+        self.cache_key = cache_key or str(getattr(store, "store_identifier", id(store)))
+        """Names this manifest's copy of the stale chunks in the process, so that it outlives the service instance."""
+
+    @staticmethod
+    def store_identifier(index_handle: str) -> str:
+        """The KeyValueStore identifier of the manifest for the index `index_handle`."""
+        return f"index-manifest-{index_handle}"
+
+    @staticmethod
+    def key_for(source: str) -> str:
+        return f"source-{hashlib.sha256(source.encode('utf-8')).hexdigest()[:32]}"
+
+    def diff(self, source: str, tags: List[Tag]) -> ManifestDiff:
+        """Compare the chunks of a new version of `source` with the manifest.
+
+        Each tag is given its hash under CHUNK_HASH_KEY. Duplicate chunks within the source are only inserted once.
+        """
+        entry = self.store.get(IndexManifest.key_for(source)) or {}
+        live, stale = set(entry.get("live", [])), set(entry.get("stale", []))
+
+        new_hashes: Set[str] = set()
+        to_insert = []
+        for tag in tags:
+            tag.value = dict(tag.value or {})
+            tag.value[CHUNK_HASH_KEY] = tag.value.get(CHUNK_HASH_KEY) or chunk_hash(
+                tag.text
+            )
+            digest = tag.value[CHUNK_HASH_KEY]
+            if digest not in new_hashes and digest not in live | stale:
+                to_insert.append(tag)
+            new_hashes.add(digest)
+
+        return ManifestDiff(
+            source=source,
+            to_insert=to_insert,
+            unchanged=len(new_hashes & live),
+            revived=len(new_hashes & stale),
+            removed=len(live - new_hashes),
+            live=sorted(new_hashes),
+            stale=sorted((live | stale) - new_hashes),
+        )
+
+    def commit(self, diff: ManifestDiff):
+        """Record that the chunks of `diff` have been inserted."""
+        with self._lock:
+            summary = self._load_stale()
+            self.store.set(
+                IndexManifest.key_for(diff.source),
+                {"source": diff.source, "live": diff.live, "stale": diff.stale},
+            )
+            if (
+                summary["version"]
+                and summary["stale"].get(diff.source, []) == diff.stale
+            ):
+                return
+            if diff.stale:
+                summary["stale"][diff.source] = diff.stale
+            else:
+                summary["stale"].pop(diff.source, None)
+            summary["version"] += 1
+            self.store.set(STALE_KEY, summary)
+            self.store.set(VERSION_KEY, {"version": summary["version"]})
+            self._keep_stale(summary)
+
+    def record_inserted(self, hashes_by_source: Dict[str, Set[str]]):
+        """Record that the chunks of each source with the given hashes are in the index, ahead of `commit`.
+
+        Called as each batch of a diff is inserted, so that if indexing fails part way, retrying it doesn't insert the
+        chunks that made it into the index again.
+        """
+        keys = {IndexManifest.key_for(source): source for source in hashes_by_source}
+        with self._lock:
+            entries = dict(self.store.items(filter_keys=list(keys)))
+            for key, source in keys.items():
+                entry = entries.get(key) or {"source": source, "stale": []}
+                entry["live"] = sorted(
+                    set(entry.get("live", [])) | hashes_by_source[source]
+                )
+                self.store.set(key, entry)
+
+    def _load_stale(self) -> Dict[str, Any]:
+        """Read the stale chunks of every source, and their version, from the store.
+
+        A manifest written before they were kept together has them only in its sources' entries, so they're gathered
+        from those, as version 0.
+        """
+        summary = self.store.get(STALE_KEY)
+        if summary is not None:
+            return summary
+        return {
+            "version": 0,
+            "stale": {
+                entry["source"]: entry["stale"]
+                for key, entry in self.store.items()
+                if key.startswith("source-") and entry.get("stale")
+            },
+        }
+
+    def _keep_stale(self, summary: Dict[str, Any]) -> _StaleChunks:
+        hashes = {source: set(stale) for source, stale in summary["stale"].items()}
+        stale_chunks = _StaleChunks(
+            version=summary["version"],
+            hashes=hashes,
+            count=sum(len(stale) for stale in hashes.values()),
+            checked_at=time.time(),
+        )
+        with _STALE_CHUNKS_LOCK:
+            _STALE_CHUNKS[self.cache_key] = stale_chunks
+        return stale_chunks
+
+    def stale_chunks(self) -> _StaleChunks:
+        """Return the stale chunk hashes of every source, from this process's copy if it is recent or still current."""
+        with _STALE_CHUNKS_LOCK:
+            stale_chunks = _STALE_CHUNKS.get(self.cache_key)
+        if stale_chunks is not None:
+            if time.time() - stale_chunks.checked_at < STALE_RECHECK_SECONDS:
+                return stale_chunks
+            entry = self.store.get(VERSION_KEY) or {"version": 0}
+            if entry["version"] == stale_chunks.version:
+                with _STALE_CHUNKS_LOCK:
+                    stale_chunks = _STALE_CHUNKS[self.cache_key] = (
+                        stale_chunks._replace(checked_at=time.time())
+                    )
+                return stale_chunks
+        return self._keep_stale(self._load_stale())
+
+    def search_limit(self, k: int) -> int:
+        """How many chunks to search for so that `k` are left once stale chunks are dropped (see MAX_STALE_OVERFETCH)."""
+        return k + min(self.stale_chunks().count, MAX_STALE_OVERFETCH)
+
+    def drop_stale(self, results: List[Tuple[Tag, float]]) -> List[Tuple[Tag, float]]:
+        """Drop the search results that are chunks since removed from their source."""
+        stale_hashes = self.stale_chunks().hashes
+        return [
+            (tag, score)
+            for tag, score in results
+            if not self.is_stale(tag, stale_hashes)
+        ]
+
+    def is_stale(self, tag: Tag, stale_hashes: Dict[str, Set[str]]) -> bool:
+        """Whether the search result `tag` is a chunk that has since been removed from its source."""
+        value = tag.value or {}
+        return value.get(CHUNK_HASH_KEY) in stale_hashes.get(value.get(SOURCE_KEY), ())
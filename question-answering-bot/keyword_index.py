@@ -0,0 +1,132 @@
+"""A BM25 keyword index of document chunks, kept on local disk next to the embedding index.
+
+Embeddings capture what a chunk is about, but not the exact strings in it: a question about part number `AB-1234` or
+version `2.17.28` is as likely to find chunks about similar parts or versions as the one it asked about. The keyword
+index finds chunks that contain the words of the question, so that DocumentQATool can combine both kinds of results.
+
+Chunks are kept in a LocalVectorStore without vectors. The inverted index itself is only kept in memory, and is rebuilt
+from the stored chunks the first time the index is opened in a process. Chunks that other processes add afterwards are
+added to it before the next search.
+"""
+import math
+import os
+import re
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from vector_index import (
+    LOCAL_INDEX_PATH_REQUIRED,
+    LocalIndex,
+    LocalVectorStore,
+    open_local_index,
+    top_k,
+)
+
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./:#]\w+)*")
+"""Words, and identifiers such as `AB-1234`, `v2.17.28` or `foo.bar`, which are kept whole."""
+
+TOKEN_SEPARATOR_PATTERN = re.compile(r"[-./:#]")
+
+STOP_WORDS = frozenset(
+    "a an and are as at be but by can do does for from has have how i if in into is it its me my no not of on or our "
+    "so than that the their then there these they this to was we were what when where which who why will with you "
+    "your".split()
+)
+"""Words too common to say anything about which chunks are relevant."""
+
+
+def tokenize(text: str) -> List[str]:
+    """Split `text` into lowercase terms. An identifier is indexed whole and also as each of its parts."""
+    terms = []
+    for token in TOKEN_PATTERN.findall((text or "").lower()):
+        parts = TOKEN_SEPARATOR_PATTERN.split(token)
+        if len(parts) > 1:
+            terms.append(token)
+            terms.extend(part for part in parts if part not in STOP_WORDS)
+        elif token not in STOP_WORDS:
+            terms.append(token)
+    return terms
+
+
+class BM25Index(LocalIndex):
+    """Ranks the chunks in a LocalVectorStore by the Okapi BM25 score of their terms against the query's."""
+
+    K1 = 1.2
+    """How quickly repeating a term in a chunk stops making the chunk more relevant."""
+
+    B = 0.75
+    """How much a chunk's score is scaled down for being longer than average."""
+
+    def __init__(self, store: LocalVectorStore):
+        super().__init__(store)
+        self._reload(0)
+
+    def _reload(self, previous_count: int):
+        """Index the chunks added since the store held `previous_count`, or all of them if it has shrunk."""
+        if previous_count == 0 or self.store.count < len(self._lengths):
+            self._postings: Dict[str, Tuple[array, array]] = {}
+            """The ids of the chunks each term appears in, and how many times it appears in each."""
+
+            self._lengths = array("I")
+            self._total_length = 0
+        for i, item in enumerate(
+            self.store.iter_items(len(self._lengths)), start=len(self._lengths)
+        ):
+            self._index(i, item.get("text"))
+
+    def _index(self, i: int, text: str):
+        counts = Counter(tokenize(text))
+        for term, count in counts.items():
+            ids, term_counts = self._postings.setdefault(term, (array("I"), array("H")))
+            ids.append(i)
+            term_counts.append(min(count, 65535))
+        length = sum(counts.values())
+        self._lengths.append(length)
+        self._total_length += length
+
+    def add(self, items: List[dict]):
+        """Add chunks, as `{"text": ..., "value": {...}}` dicts."""
+        with self._lock:
+            self.refresh()
+            ids = self.store.append(None, items)
+            for i, item in zip(ids, items):
+                self._index(int(i), item.get("text"))
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Return the ids and BM25 scores of the `k` chunks that best match the text `query`, best first."""
+        with self._lock:
+            self.refresh()
+            count = self.store.count
+            if count == 0 or k <= 0:
+                return []
+            lengths = np.array(self._lengths, dtype=np.float32)
+            length_norm = self.K1 * (
+                1 - self.B + self.B * lengths / max(1.0, self._total_length / count)
+            )
+            scores = np.zeros(count, dtype=np.float32)
+            for term in set(tokenize(query)):
+                if term not in self._postings:
+                    continue
+                ids = np.array(self._postings[term][0], dtype=np.int64)
+                term_counts = np.array(self._postings[term][1], dtype=np.float32)
+                idf = math.log(1 + (count - len(ids) + 0.5) / (len(ids) + 0.5))
+                scores[ids] += (
+                    idf * term_counts * (self.K1 + 1) / (term_counts + length_norm[ids])
+                )
+            matches = np.flatnonzero((scores > 0) & ~self.store.deleted)
+            ids, match_scores = top_k(matches, scores[matches], k)
+        return [(int(i), float(score)) for i, score in zip(ids, match_scores)]
+
+
+def open_keyword_index(index_dir: Optional[str], index_handle: str) -> BM25Index:
+    """Return the keyword index kept alongside the index `index_handle` in `index_dir`.
+
+    Its inverted index is built the first time it is needed in this process. Raises a ValueError without an `index_dir`.
+    """
+    if not index_dir:
+        raise ValueError(LOCAL_INDEX_PATH_REQUIRED.format(what="The keyword index"))
+    return open_local_index(
+        os.path.join(index_dir, f"{index_handle}-keywords"), BM25Index
+    )
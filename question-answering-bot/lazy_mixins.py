@@ -0,0 +1,78 @@
+"""Register a mixin's HTTP endpoints without constructing the mixin until one of them is called.
+
+Every request to an AgentService constructs the service, and with it every transport. A request only ever arrives on
+one transport, though, and some transports do real work when constructed (the Telegram transport, for example,
+looks up its bot token in a KeyValueStore). Registering transports lazily means each request only pays for the
+transport whose route it actually hits.
+"""
+import logging
+import threading
+import time
+from typing import Any, Callable, Generic, Optional, Type, TypeVar
+
+from steamship.invocable import PackageService
+from steamship.invocable.package_mixin import PackageMixin
+
+M = TypeVar("M", bound=PackageMixin)
+
+
+class LazyMixin(Generic[M]):
+    """Stands in for a mixin of type `mixin_class`, building it with `factory` the first time it is used.
+
+    Routes registered for the lazy mixin are bound to this object. When a route runs, any attribute it reads or
+    writes on `self` is forwarded to the real mixin, which is constructed at that moment.
+    """
+
+    mixin_class: Type[M]
+    construction_seconds: Optional[float]
+    """How long the real mixin took to construct, or None if it hasn't been needed yet."""
+
+    def __init__(self, mixin_class: Type[M], factory: Callable[[], M]):
+        object.__setattr__(self, "mixin_class", mixin_class)
+        object.__setattr__(self, "construction_seconds", None)
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_mixin", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    @property
+    def is_constructed(self) -> bool:
+        return self._mixin is not None
+
+    def get(self) -> M:
+        """Return the real mixin, constructing it if this is the first use."""
+        if self._mixin is None:
+            with self._lock:
+                if self._mixin is None:
+                    started_at = time.perf_counter()
+                    mixin = self._factory()
+                    object.__setattr__(
+                        self, "construction_seconds", time.perf_counter() - started_at
+                    )
+                    object.__setattr__(self, "_mixin", mixin)
+                    logging.info(
+                        f"Constructed {self.mixin_class.__name__} on first use in {self.construction_seconds:.3f}s"
+                    )
+        return self._mixin
+
+    def instance_init(self):
+        self.get().instance_init()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.get(), name)
+
+    def __setattr__(self, name: str, value: Any):
+        setattr(self.get(), name, value)
+
+
+def add_lazy_mixin(
+    service: PackageService, mixin_class: Type[M], factory: Callable[[], M]
+) -> LazyMixin[M]:
+    """Like `service.add_mixin(factory())`, except that `factory` is only called when one of the routes is hit.
+
+    `mixin_class` must be the class `factory` returns, and should be listed in the service's USED_MIXIN_CLASSES, just
+    as it would be for an eagerly added mixin.
+    """
+    mixin = LazyMixin(mixin_class, factory)
+    PackageService.scan_mixin(service._package_spec, mixin_class, mixin)
+    service.mixins.append(mixin)
+    return mixin
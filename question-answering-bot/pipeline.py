@@ -0,0 +1,187 @@
+"""A small staged pipeline in which every stage has its own worker threads and a bounded input queue.
+
+Items flow through the stages in order. While one item is being blockified, the next can be importing and the one
+before it indexing. Each queue is bounded, so a slow stage makes the stages before it wait rather than pile up work in
+memory. An item that fails at any stage is reported with the stage and the error, and the other items carry on.
+"""
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+_DONE = object()
+"""Sent down a queue once per worker when no more items are coming."""
+
+
+class PipelineStage(NamedTuple):
+    """One step of a pipeline.
+
+    Set `run` to process one item at a time, or `run_batch` to process lists of items. A batch is collected until the
+    `weight` of its items reaches `batch_size`, or no new item arrives for `batch_wait_seconds`. If a batch fails, its
+    items are retried one by one, so that the error is only reported against the item that caused it.
+    """
+
+    name: str
+    run: Optional[Callable[[Any], Any]] = None
+    run_batch: Optional[Callable[[List[Any]], List[Any]]] = None
+    workers: int = 1
+    queue_size: int = 16
+    batch_size: int = 1
+    weight: Callable[[Any], int] = lambda item: 1
+    batch_wait_seconds: float = 0.1
+
+
+class ItemOutcome(NamedTuple):
+    """What became of one item: the output of the last stage, or where and why it failed."""
+
+    output: Any = None
+    failed_stage: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.failed_stage is None
+
+
+class StageStats:
+    """Counters for one stage, safe to update from its worker threads."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.processed = 0
+        self.failed = 0
+        self.batches = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, processed: int, failed: int, seconds: float):
+        with self._lock:
+            self.processed += processed
+            self.failed += failed
+            self.batches += 1
+            self.busy_seconds += seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "processed": self.processed,
+            "failed": self.failed,
+            "batches": self.batches,
+            "busy_seconds": self.busy_seconds,
+        }
+
+
+def _error_message(e: BaseException) -> str:
+    return getattr(e, "message", None) or str(e) or type(e).__name__
+
+
+class Pipeline:
+    """Runs a list of items through `stages`. Create one per batch of items."""
+
+    def __init__(self, stages: List[PipelineStage]):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage.")
+        self.stages = stages
+        self.stats = {stage.name: StageStats(stage.workers) for stage in stages}
+        self._queues = [queue.Queue(maxsize=stage.queue_size) for stage in stages]
+        self._workers_left = [stage.workers for stage in stages]
+        self._lock = threading.Lock()
+        self._outcomes: List[ItemOutcome] = []
+
+    def run(self, items: List[Any]) -> List[ItemOutcome]:
+        """Process `items`, returning one outcome per item, in the same order."""
+        self._outcomes = [ItemOutcome() for _ in items]
+        threads = [
+            threading.Thread(target=self._work, args=(i,), daemon=True)
+            for i, stage in enumerate(self.stages)
+            for _ in range(stage.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for position, item in enumerate(items):
+            self._queues[0].put((position, item))
+        for _ in range(self.stages[0].workers):
+            self._queues[0].put(_DONE)
+        for thread in threads:
+            thread.join()
+        return self._outcomes
+
+    def _forward(self, stage_index: int, position: int, output: Any):
+        if stage_index + 1 < len(self.stages):
+            self._queues[stage_index + 1].put((position, output))
+        else:
+            self._outcomes[position] = ItemOutcome(output=output)
+
+    def _fail(self, stage_index: int, position: int, e: BaseException):
+        self._outcomes[position] = ItemOutcome(
+            failed_stage=self.stages[stage_index].name, error=_error_message(e)
+        )
+
+    def _next_batch(self, stage_index: int) -> Tuple[List[Tuple[int, Any]], bool]:
+        """Wait for the next batch of jobs. Also return whether the stage has been told no more are coming."""
+        stage, jobs_queue = self.stages[stage_index], self._queues[stage_index]
+        job = jobs_queue.get()
+        if job is _DONE:
+            return [], True
+        jobs, weight = [job], stage.weight(job[1])
+        while weight < stage.batch_size:
+            try:
+                job = jobs_queue.get(timeout=stage.batch_wait_seconds)
+            except queue.Empty:
+                break
+            if job is _DONE:
+                return jobs, True
+            jobs.append(job)
+            weight += stage.weight(job[1])
+        return jobs, False
+
+    def _run_batch(self, stage_index: int, jobs: List[Tuple[int, Any]]) -> int:
+        """Run `jobs` through a batch stage, splitting the batch up if it fails. Return the number of failures."""
+        try:
+            outputs = self.stages[stage_index].run_batch([item for _, item in jobs])
+        except Exception as e:
+            if len(jobs) == 1:
+                self._fail(stage_index, jobs[0][0], e)
+                return 1
+            return sum(self._run_batch(stage_index, [job]) for job in jobs)
+        for (position, _), output in zip(jobs, outputs):
+            self._forward(stage_index, position, output)
+        return 0
+
+    def _run_each(self, stage_index: int, jobs: List[Tuple[int, Any]]) -> int:
+        """Run `jobs` through a stage one at a time. Return the number of failures."""
+        failed = 0
+        for position, item in jobs:
+            try:
+                output = self.stages[stage_index].run(item)
+            except Exception as e:
+                failed += 1
+                self._fail(stage_index, position, e)
+                continue
+            self._forward(stage_index, position, output)
+        return failed
+
+    def _process(self, stage_index: int, jobs: List[Tuple[int, Any]]):
+        stage = self.stages[stage_index]
+        started_at = time.perf_counter()
+        if stage.run_batch is not None:
+            failed = self._run_batch(stage_index, jobs)
+        else:
+            failed = self._run_each(stage_index, jobs)
+        self.stats[stage.name].record(
+            len(jobs), failed, time.perf_counter() - started_at
+        )
+
+    def _work(self, stage_index: int):
+        done = False
+        while not done:
+            jobs, done = self._next_batch(stage_index)
+            if jobs:
+                self._process(stage_index, jobs)
+
+        with self._lock:
+            self._workers_left[stage_index] -= 1
+            last_worker = self._workers_left[stage_index] == 0
+        if last_worker and stage_index + 1 < len(self.stages):
+            for _ in range(self.stages[stage_index + 1].workers):
+                self._queues[stage_index + 1].put(_DONE)
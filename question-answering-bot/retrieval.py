@@ -0,0 +1,33 @@
+"""Combining the results of several searches into the chunks that are sent to the LLM."""
+from typing import Dict, List, Optional, Tuple
+
+from index_manifest import SOURCE_KEY, chunk_hash
+from steamship import Tag
+
+RRF_K = 60
+"""Damps the weight of the first few ranks in reciprocal-rank fusion. 60 is the value from the original paper."""
+
+
+def chunk_key(tag: Tag) -> Tuple[Optional[str], str]:
+    """Identify the chunk `tag` is a search result for, whichever index it came from."""
+    return (tag.value or {}).get(SOURCE_KEY), chunk_hash(tag.text)
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[Tuple[Tag, float]]], k: int = RRF_K
+) -> List[Tuple[Tag, float]]:
+    """Merge several rankings of (chunk, score) pairs into one, best first, with the fused scores.
+
+    Each chunk scores 1 / (k + rank) for every ranking it appears in, so chunks that rank well in several rankings
+    come first. Only ranks are used, so the rankings' own scores don't need to be comparable.
+    """
+    scores: Dict[Tuple[Optional[str], str], float] = {}
+    tags: Dict[Tuple[Optional[str], str], Tag] = {}
+    for ranking in rankings:
+        for rank, (tag, _) in enumerate(ranking, start=1):
+            key = chunk_key(tag)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            tags.setdefault(key, tag)
+    return [
+        (tags[key], scores[key]) for key in sorted(scores, key=scores.get, reverse=True)
+    ]
@@ -0,0 +1,536 @@
+"""Vector indexes kept on local disk, so that searching for the chunks relevant to a question needs no network hop.
+
+Two backends are available, both over the same LocalVectorStore:
+
+- `numpy` (BruteForceIndex) compares the question with every chunk. It is exact, and fast enough for up to a few
+  hundred thousand chunks.
+- `ivf` (IVFIndex) groups the chunks into clusters and only compares the question with the chunks in the clusters
+  nearest to it. It trades a little recall for searches that stay fast into the millions of chunks.
+
+See benchmarks/vector_index_recall.py for recall and latency at different corpus sizes.
+
+Local indexes must be kept in a persistent directory, `local_vector_index_path`, that both the processes that index
+documents and those that answer questions can read: an index in a temporary directory would be lost, and never seen by
+the other. Each process notices what others have added or deleted before it searches (see `LocalIndex.refresh`).
+
+Like KeyValueStore, an index on disk is only safe to write from one process at a time.
+"""
+import json
+import os
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+from index_manifest import CHUNK_HASH_KEY, SOURCE_KEY
+from steamship import Steamship
+
+VECTOR_INDEX_BACKENDS = ("steamship", "numpy", "ivf")
+"""The choices for `vector_index_backend`. `steamship` uses the Steamship embedding index plugin, with no local index."""
+
+LOCAL_INDEX_PATH_REQUIRED = (
+    "{what} is kept on local disk, so set local_vector_index_path to a persistent directory that the processes which "
+    "index documents and those which answer questions share."
+)
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    """Return `vectors` as a 2D float32 array of unit-length rows, so that cosine similarity becomes a dot product."""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def top_k(ids: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the `k` best `ids` and their `scores`, best first."""
+    if len(ids) > k:
+        best = np.argpartition(-scores, k - 1)[:k]
+        ids, scores = ids[best], scores[best]
+    order = np.argsort(-scores, kind="stable")
+    return ids[order], scores[order]
+
+
+class LocalVectorStore:
+    """Unit-length float32 vectors, and the chunk each one was embedded from, in a directory on local disk.
+
+    Vectors are appended to `vectors.f32` and read through a memory map, so a large index is paged in by the OS as it
+    is searched rather than loaded up front. A store that is only used for its chunks (see keyword_index.py) holds no
+    vectors. Chunks are appended to `items.jsonl`, and `offsets.u64` records where
+    each one starts, so that a search only reads the chunks it returns. `keys.tsv` records the source and hash of each
+    chunk, so that chunks removed from a source can be found and deleted. Deleted chunks are only marked as such.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Read the size of the store, and which chunks are deleted, from disk."""
+        self._stamp = self._stat()
+        meta = self._read_json("meta.json") or {}
+        self.dim: Optional[int] = meta.get("dim")
+        self.count: int = meta.get("count", 0)
+        self.items_size: int = meta.get("items_size", 0)
+        self.keys_size: int = meta.get("keys_size", 0)
+        self.deleted = np.zeros(self.count, dtype=bool)
+        self.deleted[self._read_json("deleted.json") or []] = True
+        self._vectors: Optional[np.ndarray] = None
+        self._offsets: Optional[np.ndarray] = None
+        self._keys: Optional[Dict[str, Dict[str, List[int]]]] = None
+
+    def _stat(self) -> Tuple[Optional[Tuple[int, int]], ...]:
+        stamps = []
+        for name in ("meta.json", "deleted.json"):
+            try:
+                stat = os.stat(self._file(name))
+                stamps.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                stamps.append(None)
+        return tuple(stamps)
+
+    def refresh(self) -> bool:
+        """Re-read the store if another process has written to it since, returning whether it was re-read.
+
+        A memory map only covers the vectors there were when it was made, so without this, chunks added by another
+        process would never be searched.
+        """
+        if self._stat() == self._stamp:
+            return False
+        self._load()
+        return True
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _read_json(self, name: str):
+        if not os.path.exists(self._file(name)):
+            return None
+        with open(self._file(name)) as f:
+            return json.load(f)
+
+    def _write_json(self, name: str, value):
+        with open(self._file(name + ".tmp"), "w") as f:
+            json.dump(value, f)
+        os.replace(self._file(name + ".tmp"), self._file(name))
+        # This process's own writes don't need re-reading.
+        self._stamp = self._stat()
+
+    def _append(self, name: str, expected_size: int, data: bytes):
+        """Append `data` to a file, first dropping anything past `expected_size` left by an interrupted append."""
+        with open(self._file(name), "ab") as f:
+            f.truncate(expected_size)
+            f.write(data)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """All vectors, deleted or not, as a read-only (count, dim) array."""
+        if self._vectors is None:
+            if self.count == 0:
+                return np.zeros((0, self.dim or 0), dtype=np.float32)
+            self._vectors = np.memmap(
+                self._file("vectors.f32"),
+                dtype=np.float32,
+                mode="r",
+                shape=(self.count, self.dim),
+            )
+        return self._vectors
+
+    @property
+    def offsets(self) -> np.ndarray:
+        if self._offsets is None:
+            if self.count == 0:
+                return np.zeros(1, dtype=np.uint64)
+            self._offsets = np.memmap(
+                self._file("offsets.u64"),
+                dtype=np.uint64,
+                mode="r",
+                shape=(self.count + 1,),
+            )
+        return self._offsets
+
+    def append(self, vectors: Optional[np.ndarray], items: List[dict]) -> np.ndarray:
+        """Add unit-length `vectors` and the chunk each was embedded from, returning their ids."""
+        if vectors is None:
+            pass
+        elif len(vectors) != len(items):
+            raise ValueError("Every vector needs an item.")
+        elif self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(
+                f"This index holds vectors of {self.dim} dimensions, not {vectors.shape[1]}."
+            )
+
+        lines = [(json.dumps(item) + "\n").encode("utf-8") for item in items]
+        ends = self.items_size + np.cumsum(
+            [len(line) for line in lines], dtype=np.uint64
+        )
+        item_keys = [
+            (str(value.get(SOURCE_KEY) or ""), str(value.get(CHUNK_HASH_KEY) or ""))
+            for value in (item.get("value") or {} for item in items)
+        ]
+        keys = "".join(f"{source}\t{digest}\n" for source, digest in item_keys)
+        keys = keys.encode("utf-8")
+
+        if vectors is not None:
+            self._append(
+                "vectors.f32",
+                self.count * self.dim * 4,
+                np.ascontiguousarray(vectors, dtype=np.float32).tobytes(),
+            )
+        self._append("items.jsonl", self.items_size, b"".join(lines))
+        if self.count == 0:
+            ends = np.concatenate([np.zeros(1, dtype=np.uint64), ends])
+        self._append(
+            "offsets.u64", (self.count + 1) * 8 if self.count else 0, ends.tobytes()
+        )
+        self._append("keys.tsv", self.keys_size, keys)
+
+        ids = np.arange(self.count, self.count + len(items))
+        self.count += len(items)
+        self.items_size += sum(len(line) for line in lines)
+        self.keys_size += len(keys)
+        self.deleted = np.concatenate([self.deleted, np.zeros(len(items), dtype=bool)])
+        self._vectors = self._offsets = None
+        if self._keys is not None:
+            for i, key in zip(ids, item_keys):
+                self._add_key(i, *key)
+        self._write_json(
+            "meta.json",
+            {
+                "dim": self.dim,
+                "count": self.count,
+                "items_size": self.items_size,
+                "keys_size": self.keys_size,
+            },
+        )
+        return ids
+
+    def iter_items(self, start: int = 0) -> Iterator[dict]:
+        """Read every chunk from id `start` on, deleted or not, in id order."""
+        if self.count <= start:
+            return
+        with open(self._file("items.jsonl"), "rb") as f:
+            f.seek(int(self.offsets[start]))
+            for _, line in zip(range(self.count - start), f):
+                yield json.loads(line)
+
+    def items(self, ids) -> List[dict]:
+        """Read the chunks with the given ids."""
+        offsets = self.offsets
+        items = []
+        with open(self._file("items.jsonl"), "rb") as f:
+            for i in ids:
+                f.seek(int(offsets[i]))
+                items.append(json.loads(f.read(int(offsets[i + 1] - offsets[i]))))
+        return items
+
+    def _add_key(self, i: int, source: str, digest: str):
+        self._keys.setdefault(source, {}).setdefault(digest, []).append(int(i))
+
+    def ids_for(
+        self, source: str, hashes: Set[str], deleted: bool = False
+    ) -> List[int]:
+        """Return the ids of the chunks of `source` with one of `hashes` that are live (or with `deleted`, deleted)."""
+        if self._keys is None:
+            self._keys = {}
+            if self.count:
+                with open(self._file("keys.tsv"), encoding="utf-8") as f:
+                    for i, line in zip(range(self.count), f):
+                        self._add_key(i, *line.rstrip("\n").split("\t"))
+        by_hash = self._keys.get(source, {})
+        return [
+            i
+            for digest in hashes
+            for i in by_hash.get(digest, [])
+            if self.deleted[i] == deleted
+        ]
+
+    def delete(self, ids: List[int], deleted: bool = True):
+        """Mark the chunks with the given ids as deleted, or with `deleted=False`, as live again."""
+        if not ids:
+            return
+        self.deleted[ids] = deleted
+        self._write_json("deleted.json", np.flatnonzero(self.deleted).tolist())
+
+
+class LocalIndex:
+    """A search index over the chunks in a LocalVectorStore. Subclasses say how a query is matched with chunks."""
+
+    def __init__(self, store: LocalVectorStore):
+        self.store = store
+        self._lock = threading.RLock()
+
+    def refresh(self):
+        """Catch up with chunks that other processes have added to, or deleted from, the store since it was read.
+
+        Called before every search and write, at the cost of two `stat` calls when nothing has changed.
+        """
+        with self._lock:
+            previous_count = self.store.count
+            if self.store.refresh():
+                self._reload(previous_count)
+
+    def _reload(self, previous_count: int):
+        """Bring whatever the index keeps in memory up to date with the store, which held `previous_count` chunks."""
+
+    @property
+    def count(self) -> int:
+        """The number of chunks that searches can return."""
+        return self.store.count - int(self.store.deleted.sum())
+
+    def delete_chunks(self, source: str, hashes: Set[str]) -> int:
+        """Delete the chunks of `source` with one of `hashes`, returning how many were deleted."""
+        with self._lock:
+            self.refresh()
+            ids = self.store.ids_for(source, hashes)
+            self.store.delete(ids)
+            return len(ids)
+
+    def restore_chunks(self, source: str, hashes: Set[str]) -> int:
+        """Undo `delete_chunks` for the chunks of `source` with one of `hashes`, returning how many were restored."""
+        with self._lock:
+            self.refresh()
+            ids = self.store.ids_for(source, hashes, deleted=True)
+            self.store.delete(ids, deleted=False)
+            return len(ids)
+
+    def search(self, query, k: int) -> List[Tuple[int, float]]:
+        """Return the ids and scores of the `k` chunks that best match `query`, best first."""
+        raise NotImplementedError()
+
+    def search_items(self, query, k: int) -> List[Tuple[dict, float]]:
+        """Like `search`, but return the chunks themselves rather than their ids."""
+        results = self.search(query, k)
+        with self._lock:
+            items = self.store.items([i for i, _ in results])
+        return list(zip(items, [score for _, score in results]))
+
+
+class BruteForceIndex(LocalIndex):
+    """Searches a LocalVectorStore by comparing the question with every chunk in it."""
+
+    SCAN_ROWS = 65536
+    """How many vectors are scored at once, which bounds the memory a search needs."""
+
+    def add(self, vectors, items: List[dict]) -> np.ndarray:
+        """Add embeddings of chunks, and the chunks themselves as `{"text": ..., "value": {...}}` dicts."""
+        with self._lock:
+            self.refresh()
+            return self.store.append(normalize_rows(vectors), items)
+
+    def _score(self, ids: np.ndarray, query: np.ndarray) -> np.ndarray:
+        scores = self.store.vectors[ids] @ query
+        scores[self.store.deleted[ids]] = -np.inf
+        return scores
+
+    def _search_all(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        vectors, deleted = self.store.vectors, self.store.deleted
+        best_ids, best_scores = np.zeros(0, dtype=np.int64), np.zeros(0, np.float32)
+        for start in range(0, len(vectors), self.SCAN_ROWS):
+            scores = vectors[start : start + self.SCAN_ROWS] @ query
+            scores[deleted[start : start + self.SCAN_ROWS]] = -np.inf
+            ids, scores = top_k(np.arange(start, start + len(scores)), scores, k)
+            best_ids, best_scores = top_k(
+                np.concatenate([best_ids, ids]),
+                np.concatenate([best_scores, scores]),
+                k,
+            )
+        return best_ids, best_scores
+
+    def _search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self._search_all(query, k)
+
+    def search(self, query, k: int) -> List[Tuple[int, float]]:
+        """Return the ids and cosine similarities of the `k` chunks most similar to the embedding `query`, best first."""
+        with self._lock:
+            self.refresh()
+            if self.store.count == 0 or k <= 0:
+                return []
+            ids, scores = self._search(normalize_rows(query)[0], k)
+        return [
+            (int(i), float(score)) for i, score in zip(ids, scores) if score != -np.inf
+        ]
+
+
+class IVFIndex(BruteForceIndex):
+    """Searches a LocalVectorStore by comparing the question only with the chunks in the clusters nearest to it.
+
+    The clusters are found with k-means once the store holds MIN_TRAIN_SIZE chunks, and found again each time it grows
+    RETRAIN_GROWTH times larger. Chunks added in between join the cluster with the nearest centroid. Until the first
+    clustering, every chunk is searched.
+    """
+
+    MIN_TRAIN_SIZE = 50000
+    """Below this many chunks, searching them all is fast enough and clustering them isn't worth it."""
+
+    RETRAIN_GROWTH = 4
+    """Cluster again when the store has grown this many times larger than when it was last clustered."""
+
+    TRAIN_SAMPLE_PER_LIST = 64
+    """How many chunks per cluster k-means is trained on. The rest are only assigned to the nearest centroid."""
+
+    TRAIN_ITERATIONS = 10
+
+    ASSIGN_ROWS = 16384
+    """How many vectors are assigned to clusters at once, which bounds the memory clustering needs."""
+
+    def __init__(
+        self,
+        store: LocalVectorStore,
+        n_lists: Optional[int] = None,
+        n_probe: int = 16,
+        seed: int = 0,
+    ):
+        """Search the `n_probe` nearest of `n_lists` clusters. `n_lists` defaults to the square root of the size."""
+        super().__init__(store)
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self.trained_count = 0
+        """How many chunks the store held when it was last clustered."""
+        self._lists: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._load_clusters()
+
+    def _load_clusters(self):
+        if os.path.exists(self.store._file("ivf_centroids.npy")):
+            self.trained_count = self.store._read_json("ivf.json")["trained_count"]
+            self.centroids = np.load(self.store._file("ivf_centroids.npy"))
+            self.assignments = np.fromfile(
+                self.store._file("ivf_assignments.i32"), dtype=np.int32
+            )[: self.store.count]
+            self._lists = None
+
+    def _reload(self, previous_count: int):
+        self._load_clusters()
+
+    def add(self, vectors, items: List[dict]) -> np.ndarray:
+        with self._lock:
+            ids = super().add(vectors, items)
+            count, trained = self.store.count, self.trained_count
+            if count >= self.MIN_TRAIN_SIZE and count >= trained * self.RETRAIN_GROWTH:
+                self.train()
+            elif self.centroids is not None:
+                assignments = self._assign(self.store.vectors[ids])
+                self.store._append(
+                    "ivf_assignments.i32",
+                    len(self.assignments) * 4,
+                    assignments.tobytes(),
+                )
+                self.assignments = np.concatenate([self.assignments, assignments])
+                self._lists = None
+            return ids
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        return np.concatenate(
+            [
+                np.argmax(
+                    vectors[start : start + self.ASSIGN_ROWS] @ self.centroids.T, axis=1
+                )
+                for start in range(0, len(vectors), self.ASSIGN_ROWS)
+            ]
+        ).astype(np.int32)
+
+    def train(self):
+        """Cluster every chunk in the store with spherical k-means, and save the clusters next to it."""
+        with self._lock:
+            vectors = self.store.vectors
+            n_lists = self.n_lists or max(1, int(np.sqrt(len(vectors))))
+            rng = np.random.default_rng(self.seed)
+            sample_size = min(len(vectors), n_lists * self.TRAIN_SAMPLE_PER_LIST)
+            sample = vectors[
+                np.sort(rng.choice(len(vectors), sample_size, replace=False))
+            ]
+
+            self.centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+            for _ in range(self.TRAIN_ITERATIONS):
+                assignments = self._assign(sample)
+                sums = np.zeros_like(self.centroids)
+                np.add.at(sums, assignments, sample)
+                empty = ~sums.any(axis=1)
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+                self.centroids = normalize_rows(sums)
+
+            self.assignments = self._assign(vectors)
+            self.trained_count = len(vectors)
+            self._lists = None
+            np.save(self.store._file("ivf_centroids.npy"), self.centroids)
+            self.assignments.tofile(self.store._file("ivf_assignments.i32"))
+            self.store._write_json("ivf.json", {"trained_count": self.trained_count})
+
+    def _inverted_lists(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the ids of all chunks sorted by cluster, and where each cluster starts in them."""
+        if self._lists is None:
+            order = np.argsort(self.assignments, kind="stable")
+            bounds = np.searchsorted(
+                self.assignments[order], np.arange(len(self.centroids) + 1)
+            )
+            self._lists = (order, bounds)
+        return self._lists
+
+    def _search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if self.centroids is None:
+            return self._search_all(query, k)
+        order, bounds = self._inverted_lists()
+        n_probe = min(self.n_probe, len(self.centroids))
+        probe = np.argpartition(-(self.centroids @ query), n_probe - 1)[:n_probe]
+        ids = np.sort(np.concatenate([order[bounds[c] : bounds[c + 1]] for c in probe]))
+        return top_k(ids, self._score(ids, query), k)
+
+
+def local_index_dir(client: Steamship, path: Optional[str] = None) -> Optional[str]:
+    """The directory under `path` that holds the local indexes of `client`'s workspace, one subdirectory per index.
+
+    Returns None if `path` isn't set: there is then nowhere to keep local indexes.
+    """
+    if not path:
+        return None
+    workspace = (
+        client.config.workspace_handle or client.config.workspace_id or "default"
+    )
+    return os.path.join(path, workspace)
+
+
+_OPEN_INDEXES: Dict[Tuple[Callable, str], LocalIndex] = {}
+_OPEN_INDEXES_LOCK = threading.Lock()
+
+
+def open_local_index(
+    path: str, factory: Callable[[LocalVectorStore], LocalIndex]
+) -> LocalIndex:
+    """Return the index at `path`, opening its store with `factory` the first time it is needed in this process.
+
+    Opened indexes are kept for the life of the process, so that an index is only opened (and an IVF index's clusters
+    only loaded) once, not per request.
+    """
+    key = (factory, os.path.abspath(path))
+    with _OPEN_INDEXES_LOCK:
+        if key not in _OPEN_INDEXES:
+            _OPEN_INDEXES[key] = factory(LocalVectorStore(path))
+        return _OPEN_INDEXES[key]
+
+
+def open_vector_index(
+    backend: str, index_dir: Optional[str], index_handle: str
+) -> Optional[BruteForceIndex]:
+    """Return the local index `index_handle` in `index_dir` for `backend`, or None for the `steamship` backend.
+
+    Raises a ValueError for a local backend without an `index_dir` (see `local_index_dir`).
+    """
+    if backend not in VECTOR_INDEX_BACKENDS:
+        raise ValueError(
+            f"Unknown vector index backend {backend!r}. Choose one of {', '.join(VECTOR_INDEX_BACKENDS)}."
+        )
+    if backend == "steamship":
+        return None
+    if not index_dir:
+        raise ValueError(
+            LOCAL_INDEX_PATH_REQUIRED.format(what=f"The {backend} vector index")
+        )
+    return open_local_index(
+        os.path.join(index_dir, index_handle),
+        IVFIndex if backend == "ivf" else BruteForceIndex,
+    )
@@ -0,0 +1,404 @@
+"""Report, record and check the end-to-end turn latency of each example package, without network access.
+
+Each example's AgentService is driven through a scripted multi-turn conversation, first by one user and then by
+several users at once, with every backend it calls (OpenAI, Stable Diffusion, ElevenLabs, the SERP API, vector search
+and the KeyValueStore) replaced by the stand-ins in offline_backends.py. For each number of concurrent users, this
+script reports the 50th, 95th and 99th percentile latency of a turn, the throughput in turns per second, and how many
+LLM calls a conversation takes.
+
+Every turn constructs the service anew and runs the agent as a transport would, so the timings include the service's
+start-up work as well as planning, tools and emitting the reply. Backend waits are shortened by `--time-scale`, so the
+latencies are a fraction of what they would be live, but their proportions are kept.
+
+Usage (from the repository root):
+
+    python scripts/latency_benchmark.py            # print a report
+    python scripts/latency_benchmark.py --record   # save budgets to scripts/latency_budgets.json
+    python scripts/latency_benchmark.py --check    # exit non-zero if an example is over budget
+
+Run `--check` after changing how an example plans, calls tools or replies; if a change is intended, re-run `--record`
+and commit the new budgets.
+"""
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BUDGETS_PATH = os.path.join(REPO_ROOT, "scripts", "latency_budgets.json")
+
+EXAMPLES = [
+    "ai-character-with-dynamic-prompt",
+    "ai-character-with-stable-diffusion",
+    "ai-character-with-voice",
+    "dog-trainer",
+    "question-answering-bot",
+]
+
+CONVERSATIONS: Dict[str, List[List[str]]] = {
+    "ai-character-with-dynamic-prompt": [
+        ["Hi there!", "What do you like to do for fun?", "Thanks, bye!"],
+    ],
+    "ai-character-with-stable-diffusion": [
+        ["Hi there!", "Draw me a picture of a cat wearing a hat", "Thanks!"],
+    ],
+    "ai-character-with-voice": [
+        ["Hi there!", "Draw me a picture of a cat wearing a hat", "Thanks!"],
+    ],
+    "dog-trainer": [
+        [
+            "Hi!",
+            "How much should Fido eat?",
+            "Show me a picture of Fido swimming",
+            "Thanks!",
+        ],
+    ],
+    "question-answering-bot": [
+        [
+            "Hello!",
+            "What does the document say about pricing?",
+            "Who wrote the document?",
+        ],
+    ],
+}
+"""The turns of the conversations each user has with each example, in order."""
+
+PLANS: Dict[str, str] = {
+    "Draw me a picture of a cat wearing a hat": "StableDiffusionTool",
+    "How much should Fido eat?": "QuestionTool",
+    "Show me a picture of Fido swimming": "PictureTool",
+    "What does the document say about pricing?": "VectorSearchQATool",
+    "Who wrote the document?": "VectorSearchQATool",
+}
+"""The tool the planner calls for each user message that needs one (see FakeChatOpenAI.plans)."""
+
+PROMPT_ARGUMENTS: Dict[str, dict] = {
+    "dog-trainer": {
+        "dogs": [{"name": "Fido", "breed": "Daschund", "description": "A silly dog."}]
+    },
+}
+"""Arguments to each example's `set_prompt_arguments`, for those that need some set before they can be run."""
+
+RESPONDERS = [
+    # The dog trainer's fused picture prompt asks for the rewritten request and Stable Diffusion prompt as JSON.
+    (
+        "JSON:",
+        lambda prompt: json.dumps(
+            {
+                "rewritten_request": "A picture of Fido, a silly Daschund, swimming",
+                "prompt": "a silly daschund swimming, photograph, high detail",
+            }
+        ),
+    ),
+]
+"""Completions for prompts that need a particular form of reply (see FakeOpenAI.responders)."""
+
+HEADROOM_RATIO = 1.5
+"""Recorded latency budgets are `measured * HEADROOM_RATIO`, so that timing noise doesn't fail the check."""
+
+LLM_CALL_PREFIXES = ("ChatOpenAI", "OpenAI")
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """The nearest-rank percentile of `values`: the smallest value at least `fraction` of them are no greater than."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def load_service_class() -> type:
+    """Import `api` from the working directory and return the AgentService it defines."""
+    sys.path.insert(0, os.getcwd())
+    import api
+    from steamship.agents.service.agent_service import AgentService
+
+    return next(
+        value
+        for value in vars(api).values()
+        if isinstance(value, type)
+        and issubclass(value, AgentService)
+        and value.__module__ == "api"
+    )
+
+
+def run_turn(new_service: Callable[[], Any], history, text: str) -> float:
+    """Send `text` to a newly constructed service, as a transport would, and return how long it took to reply."""
+    from steamship.agents.schema import AgentContext
+    from steamship.agents.utils import with_llm
+
+    history.append_user_message(text)
+    started_at = time.perf_counter()
+    service = new_service()
+    agent = service.get_default_agent()
+    context = with_llm(agent.llm, AgentContext())
+    context.client = service.client
+    context.llm_cache = context.action_cache = None
+    context.chat_history = history
+    context.emit_funcs = [
+        lambda blocks, metadata: [
+            history.append_assistant_message(block.text)
+            for block in blocks
+            if block.is_text()
+        ]
+    ]
+    service.run_agent(agent, context)
+    return time.perf_counter() - started_at
+
+
+def run_users(
+    example: str, users: int, new_service: Callable[[], Any], args: argparse.Namespace
+) -> dict:
+    """Have `users` users converse with `example` at once, and return their turn latencies and backend calls."""
+    import offline_backends
+
+    before = Counter(offline_backends.CALLS)
+    seconds: List[float] = []
+    seconds_lock = threading.Lock()
+    errors: List[str] = []
+
+    def converse(user: int):
+        try:
+            for repeat in range(args.repeats):
+                for number, turns in enumerate(CONVERSATIONS[example]):
+                    history = offline_backends.OfflineChatHistory(
+                        f"user-{users}-{user}-{repeat}-{number}"
+                    )
+                    for text in turns:
+                        elapsed = run_turn(new_service, history, text)
+                        with seconds_lock:
+                            seconds.append(elapsed)
+        except Exception as e:
+            errors.append(f"user {user}: {e!r}")
+
+    started_at = time.perf_counter()
+    threads = [threading.Thread(target=converse, args=(user,)) for user in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - started_at
+    if errors:
+        raise RuntimeError("\n".join(errors))
+
+    calls = Counter(offline_backends.CALLS)
+    calls.subtract(before)
+    return {
+        "seconds": seconds,
+        "wall_seconds": wall_seconds,
+        "conversations": users * args.repeats * len(CONVERSATIONS[example]),
+        "calls": {name: count for name, count in sorted(calls.items()) if count},
+    }
+
+
+def run_worker(example: str, args: argparse.Namespace) -> dict:
+    """Drive `example`'s AgentService, in this process, at each number of concurrent users.
+
+    Runs in the example's folder, in a fresh interpreter, so that the stand-ins can be installed before `api` is
+    imported.
+    """
+    import offline_backends
+    from steamship.invocable import InvocationContext
+
+    offline_backends.install()
+    offline_backends.configure(time_scale=args.time_scale, seed=args.seed)
+    offline_backends.FakeChatOpenAI.plans = PLANS
+    offline_backends.FakeOpenAI.responders = RESPONDERS
+    service_class = load_service_class()
+
+    def new_service():
+        service = service_class(
+            client=offline_backends.OfflineClient.for_workspace(f"offline-{example}"),
+            config={},
+            context=InvocationContext(invocable_instance_handle=f"offline-{example}"),
+        )
+        offline_backends.substitute_tools(service)
+        return service
+
+    offline_backends.InMemoryKeyValueStore.stores.clear()
+    if example in PROMPT_ARGUMENTS:
+        new_service().set_prompt_arguments(**PROMPT_ARGUMENTS[example])
+    return {
+        str(users): run_users(example, users, new_service, args) for users in args.users
+    }
+
+
+def benchmark(example: str, args: argparse.Namespace) -> dict:
+    """Run the worker for `example` in a fresh interpreter in its folder, and summarize each level of concurrency."""
+    result = subprocess.run(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--worker",
+            "--time-scale",
+            str(args.time_scale),
+            "--seed",
+            str(args.seed),
+            "--repeats",
+            str(args.repeats),
+            "--users",
+            *[str(users) for users in args.users],
+            "--",
+            example,
+        ],
+        cwd=os.path.join(REPO_ROOT, example),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Benchmarking {example} failed:\n{result.stderr}")
+
+    summary = {}
+    for users, level in json.loads(result.stdout.splitlines()[-1]).items():
+        llm_calls = sum(
+            count
+            for name, count in level["calls"].items()
+            if name.startswith(LLM_CALL_PREFIXES)
+        )
+        summary[users] = {
+            "p50_seconds": percentile(level["seconds"], 0.50),
+            "p95_seconds": percentile(level["seconds"], 0.95),
+            "p99_seconds": percentile(level["seconds"], 0.99),
+            "turns_per_second": len(level["seconds"]) / level["wall_seconds"],
+            "llm_calls_per_conversation": llm_calls / level["conversations"],
+            "calls": level["calls"],
+        }
+    return summary
+
+
+def print_report(example: str, summary: Dict[str, dict]):
+    print(f"\n{example}")
+    print(
+        f"  {'users':>5}  {'p50':>8}  {'p95':>8}  {'p99':>8}  {'turns/s':>8}  {'LLM calls/conversation':>22}"
+    )
+    for users, level in summary.items():
+        print(
+            f"  {users:>5}  {level['p50_seconds']:7.3f}s  {level['p95_seconds']:7.3f}s  "
+            f"{level['p99_seconds']:7.3f}s  {level['turns_per_second']:8.2f}  "
+            f"{level['llm_calls_per_conversation']:22.1f}"
+        )
+    calls = Counter()
+    for level in summary.values():
+        calls.update(level["calls"])
+    print("  backend calls: " + ", ".join(f"{n} {name}" for name, n in calls.items()))
+
+
+def budget_for(summary: Dict[str, dict], time_scale: float) -> dict:
+    """Return the budget to record for an example from `summary`, measured with `time_scale`."""
+    return {
+        "time_scale": time_scale,
+        "p95_seconds": {
+            users: round(level["p95_seconds"] * HEADROOM_RATIO, 3)
+            for users, level in summary.items()
+        },
+        "llm_calls_per_conversation": max(
+            level["llm_calls_per_conversation"] for level in summary.values()
+        ),
+    }
+
+
+def check(
+    example: str, summary: Dict[str, dict], budget: dict, time_scale: float
+) -> List[str]:
+    """Return a description of every way in which `summary`, measured with `time_scale`, is over `budget`."""
+    if budget.get("time_scale", time_scale) != time_scale:
+        return [
+            f"{example}: budgets were recorded with --time-scale {budget['time_scale']}, not {time_scale}"
+        ]
+    failures = []
+    for users, level in summary.items():
+        limit = budget.get("p95_seconds", {}).get(users)
+        if limit is not None and level["p95_seconds"] > limit:
+            failures.append(
+                f"{example}: p95 turn latency with {users} users is {level['p95_seconds']:.3f}s, over its budget "
+                f"of {limit:.3f}s"
+            )
+    calls = max(level["llm_calls_per_conversation"] for level in summary.values())
+    limit = budget.get("llm_calls_per_conversation")
+    if limit is not None and calls > limit:
+        failures.append(
+            f"{example}: a conversation takes {calls:.1f} LLM calls, over its budget of {limit:.1f}"
+        )
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--record", action="store_true", help="Save budgets from this run."
+    )
+    mode.add_argument(
+        "--check", action="store_true", help="Fail if an example is over budget."
+    )
+    mode.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument(
+        "--users",
+        type=int,
+        nargs="+",
+        default=[1, 8],
+        help="Numbers of concurrent users to benchmark with.",
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=2,
+        help="How many times each user has each conversation.",
+    )
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        default=0.1,
+        help="Fraction of each backend's latency to actually wait.",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed for backend latencies."
+    )
+    parser.add_argument(
+        "examples", nargs="*", default=EXAMPLES, help="Example folders to benchmark."
+    )
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.examples[0], args)))
+        return 0
+
+    budgets = {}
+    if os.path.exists(BUDGETS_PATH):
+        with open(BUDGETS_PATH, "r") as f:
+            budgets = json.load(f)
+
+    failures = []
+    for example in args.examples:
+        summary = benchmark(example, args)
+        print_report(example, summary)
+        if args.record:
+            budgets[example] = budget_for(summary, args.time_scale)
+        elif args.check:
+            failures.extend(
+                check(example, summary, budgets.get(example, {}), args.time_scale)
+            )
+
+    if args.record:
+        with open(BUDGETS_PATH, "w") as f:
+            json.dump(budgets, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nRecorded budgets in {os.path.relpath(BUDGETS_PATH, REPO_ROOT)}")
+
+    if failures:
+        print("\nLatency budget exceeded:")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+    if args.check:
+        print("\nAll examples are within budget.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
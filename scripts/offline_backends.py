@@ -0,0 +1,408 @@
+"""Offline stand-ins for the backends the examples call, so that their AgentServices can be run and timed locally.
+
+The stand-ins take the place of:
+
+- `ChatOpenAI` and `OpenAI`, which plan with and complete prompts on OpenAI's models
+- `StableDiffusionTool` and `GenerateSpeechTool`, which generate images and ElevenLabs speech
+- `SearchTool`, which searches the web through the SERP API
+- `VectorSearchQATool`, which answers questions from a Steamship embedding index
+- `KeyValueStore`, which keeps the examples' caches and counters in the workspace
+
+Each stand-in waits as long as its backend would, then returns a canned result. Waits are drawn from a LatencyModel
+(a median round trip with log-normal spread, plus a cost per generated token) and the number of generated tokens
+from a TokenModel, with seeded random number generators, so runs are repeatable. `configure` sets the seed, and a
+`time_scale` by which to shorten every wait so that a whole benchmark runs in seconds.
+
+Call `install()` before importing an example's `api`. It replaces the real classes in the SDK modules that define
+them (and in any module that has already imported them), so that `from steamship.agents.llms.openai import
+ChatOpenAI` in `api.py`, and subclasses such as `BackgroundStableDiffusionTool`, pick up the stand-ins.
+`VectorSearchQATool` is the exception: the question-answering bot's DocumentQATool overrides the methods that call
+the backend, so `substitute_tools` swaps such tools for the stand-in after the service is constructed.
+
+The planner stand-in calls a tool only for the user messages in `FakeChatOpenAI.plans`, and otherwise replies.
+Completions are filler text, unless one of `FakeOpenAI.responders` recognizes the prompt.
+"""
+import copy
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Any, Callable, ClassVar, Dict, List, Optional, Tuple
+
+from pydantic import SecretStr
+from steamship import Block, MimeTypes, PluginInstance, Steamship
+from steamship.agents.llms import openai
+from steamship.agents.schema import LLM, AgentContext, ChatLLM, Tool
+from steamship.agents.tools.image_generation import stable_diffusion
+from steamship.agents.tools.question_answering import VectorSearchQATool
+from steamship.agents.tools.search import search
+from steamship.agents.tools.speech_generation import generate_speech
+from steamship.agents.utils import get_llm
+from steamship.base.configuration import Configuration
+from steamship.data import TagKind
+from steamship.data.tags.tag_constants import RoleTag
+from steamship.utils import kv_store
+
+FILLER_WORDS = "sure here is what i found about that and a little more detail to help you along with it today".split()
+
+
+class LatencyModel:
+    """How long a backend takes to answer: a median round trip, spread log-normally, plus a cost per token."""
+
+    def __init__(
+        self,
+        seconds: float,
+        spread: float = 0.25,
+        seconds_per_token: float = 0.0,
+    ):
+        self.seconds = seconds
+        self.spread = spread
+        self.seconds_per_token = seconds_per_token
+
+    def sample(self, rng: random.Random, tokens: int = 0) -> float:
+        return (
+            self.seconds * rng.lognormvariate(0, self.spread)
+            + self.seconds_per_token * tokens
+        )
+
+
+class TokenModel:
+    """How many tokens a model generates: a median, spread log-normally, and at least one."""
+
+    def __init__(self, tokens: int, spread: float = 0.4):
+        self.tokens = tokens
+        self.spread = spread
+
+    def sample(self, rng: random.Random) -> int:
+        return max(1, int(round(self.tokens * rng.lognormvariate(0, self.spread))))
+
+
+LATENCY: Dict[str, LatencyModel] = {
+    "gpt-4": LatencyModel(0.8, seconds_per_token=0.03),
+    "gpt-3.5-turbo": LatencyModel(0.3, seconds_per_token=0.008),
+    "stable-diffusion": LatencyModel(3.0, spread=0.3),
+    "elevenlabs": LatencyModel(0.6, seconds_per_token=0.01),
+    "serpapi": LatencyModel(1.2, spread=0.35),
+    "vector-search": LatencyModel(0.25),
+    "key-value-store": LatencyModel(0.0),
+}
+"""The latency of each backend. Models not listed here take as long as GPT-4."""
+
+TOKENS: Dict[str, TokenModel] = {
+    "gpt-4": TokenModel(60),
+    "gpt-3.5-turbo": TokenModel(40),
+}
+"""How many tokens each model generates in a reply or completion. Models not listed here generate as many as GPT-4."""
+
+_SETTINGS = {"time_scale": 1.0, "seed": 0}
+_RNGS: Dict[str, random.Random] = {}
+_RNGS_LOCK = threading.Lock()
+
+CALLS: Counter = Counter()
+"""How many calls each backend has had, by backend and model, such as "ChatOpenAI/gpt-4"."""
+
+_CALLS_LOCK = threading.Lock()
+
+
+def configure(time_scale: float = 1.0, seed: int = 0):
+    """Shorten every wait by `time_scale`, reseed the random number generators and reset the call counts."""
+    _SETTINGS.update(time_scale=time_scale, seed=seed)
+    with _RNGS_LOCK:
+        _RNGS.clear()
+    with _CALLS_LOCK:
+        CALLS.clear()
+
+
+def _sample(backend: str, draw: Callable[[random.Random], Any]) -> Any:
+    with _RNGS_LOCK:
+        if backend not in _RNGS:
+            _RNGS[backend] = random.Random(f"{_SETTINGS['seed']}:{backend}")
+        return draw(_RNGS[backend])
+
+
+def call_backend(name: str, backend: str, tokens: int = 0):
+    """Count a call of `name` and wait as long as `backend` would take to generate `tokens` tokens."""
+    latency = LATENCY.get(backend, LATENCY["gpt-4"])
+    seconds = _sample(backend, lambda rng: latency.sample(rng, tokens))
+    with _CALLS_LOCK:
+        CALLS[name] += 1
+    time.sleep(seconds * _SETTINGS["time_scale"])
+
+
+def filler_text(model: str) -> str:
+    """Filler text as long as a reply of `model`."""
+    tokens = TOKENS.get(model, TOKENS["gpt-4"])
+    count = _sample(f"{model}:tokens", tokens.sample)
+    words = [FILLER_WORDS[i % len(FILLER_WORDS)] for i in range(count)]
+    return " ".join(words).capitalize() + "."
+
+
+def word_count(text: str) -> int:
+    return len((text or "").split())
+
+
+def is_function_result(message: Block) -> bool:
+    """Whether a chat message is the output of a tool (see Action.to_chat_messages)."""
+    return any(
+        tag.kind == TagKind.ROLE and tag.name == RoleTag.FUNCTION
+        for tag in message.tags or []
+    )
+
+
+class FakeOpenAI(LLM):
+    """Stand-in for OpenAI: completes prompts with filler text, or the reply of a matching responder."""
+
+    responders: ClassVar[List[Tuple[str, Callable[[str], str]]]] = []
+    """(phrase, responder) pairs: a prompt containing the phrase is completed with the responder's reply to it."""
+
+    client: Any = None
+    model_name: str = "gpt-3.5-turbo"
+
+    def __init__(self, client=None, model_name: str = "gpt-3.5-turbo", **kwargs):
+        super().__init__(client=client, model_name=model_name)
+
+    def complete(
+        self, prompt: str, stop: Optional[str] = None, **kwargs
+    ) -> List[Block]:
+        text = next(
+            (
+                responder(prompt)
+                for phrase, responder in FakeOpenAI.responders
+                if phrase in prompt
+            ),
+            None,
+        ) or filler_text(self.model_name)
+        call_backend(
+            f"{'ChatOpenAI' if isinstance(self, ChatLLM) else 'OpenAI'}.complete/{self.model_name}",
+            self.model_name,
+            word_count(text),
+        )
+        return [Block(text=text)]
+
+
+class FakeChatOpenAI(ChatLLM, FakeOpenAI):
+    """Stand-in for ChatOpenAI: calls the planned tool for a user message, and otherwise replies with filler text."""
+
+    plans: ClassVar[Dict[str, str]] = {}
+    """The tool to call, with the message as its input, for each user message that needs one."""
+
+    model_name: str = "gpt-4-0613"
+
+    def __init__(self, client=None, model_name: str = "gpt-4-0613", **kwargs):
+        super().__init__(client=client, model_name=model_name)
+
+    def chat(
+        self, messages: List[Block], tools: Optional[List[Tool]], **kwargs
+    ) -> List[Block]:
+        text = filler_text(self.model_name)
+        if messages and not is_function_result(messages[-1]):
+            request = messages[-1].text or ""
+            planned_tool = FakeChatOpenAI.plans.get(request)
+            if planned_tool in {tool.name for tool in tools or []}:
+                text = json.dumps(
+                    {
+                        "function_call": {
+                            "name": planned_tool,
+                            "arguments": json.dumps({"text": request}),
+                        }
+                    }
+                )
+        call_backend(
+            f"ChatOpenAI.chat/{self.model_name}", self.model_name, word_count(text)
+        )
+        return [Block(text=text)]
+
+
+def _media_block(mime_type: str, extension: str) -> Block:
+    return Block(
+        id=uuid.uuid4().hex,
+        mime_type=mime_type,
+        url=f"https://offline.invalid/{uuid.uuid4().hex}.{extension}",
+    )
+
+
+class FakeStableDiffusionTool(stable_diffusion.StableDiffusionTool):
+    """Stand-in for StableDiffusionTool: returns a placeholder image for each prompt."""
+
+    def run(self, tool_input: List[Block], context: AgentContext) -> List[Block]:
+        images = []
+        for _ in tool_input:
+            call_backend("StableDiffusionTool", "stable-diffusion")
+            images.append(_media_block(MimeTypes.PNG, "png"))
+        return images
+
+
+class FakeGenerateSpeechTool(generate_speech.GenerateSpeechTool):
+    """Stand-in for GenerateSpeechTool: returns a placeholder recording of each text, taking longer for longer ones."""
+
+    def run(self, tool_input: List[Block], context: AgentContext) -> List[Block]:
+        recordings = []
+        for block in tool_input:
+            call_backend("GenerateSpeechTool", "elevenlabs", word_count(block.text))
+            recordings.append(_media_block(MimeTypes.MP3, "mp3"))
+        return recordings
+
+
+class FakeSearchTool(search.SearchTool):
+    """Stand-in for SearchTool: answers each query with a short snippet."""
+
+    def run(self, tool_input: List[Block], context: AgentContext) -> List[Block]:
+        answers = []
+        for _ in tool_input:
+            call_backend("SearchTool", "serpapi")
+            answers.append(Block(text=filler_text("gpt-3.5-turbo")))
+        return answers
+
+
+class FakeVectorSearchQATool(VectorSearchQATool):
+    """Stand-in for VectorSearchQATool: searches an imaginary index, then completes the answer with the context's LLM."""
+
+    def answer_question(self, question: str, context: AgentContext) -> List[Block]:
+        call_backend("VectorSearchQATool.search", "vector-search")
+        llm = get_llm(context) or openai.OpenAI(client=context.client)
+        return llm.complete(
+            self.question_answering_prompt.format(
+                source_text=filler_text("gpt-3.5-turbo"), question=question
+            )
+        )
+
+
+class InMemoryKeyValueStore:
+    """Stand-in for KeyValueStore, kept in a process-wide dict.
+
+    Values are deep-copied on the way in and out, as they would be when sent to and from Steamship.
+    """
+
+    stores: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    def __init__(self, client: Any = None, store_identifier: str = "KeyValueStore"):
+        self.client = client
+        self.store_identifier = f"kv-store-{store_identifier}"
+        self._data = InMemoryKeyValueStore.stores.setdefault(self.store_identifier, {})
+
+    def get(self, key: str) -> Optional[Dict]:
+        call_backend("KeyValueStore", "key-value-store")
+        return copy.deepcopy(self._data.get(key))
+
+    def set(self, key: str, value: Dict[str, Any]):
+        call_backend("KeyValueStore", "key-value-store")
+        self._data[key] = copy.deepcopy(value)
+
+    def delete(self, key: str) -> bool:
+        call_backend("KeyValueStore", "key-value-store")
+        return self._data.pop(key, None) is not None
+
+    def items(
+        self, filter_keys: Optional[List[str]] = None
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        call_backend("KeyValueStore", "key-value-store")
+        return [
+            (key, copy.deepcopy(value))
+            for key, value in self._data.items()
+            if filter_keys is None or key in filter_keys
+        ]
+
+    def reset(self):
+        self._data.clear()
+
+
+class OfflineClient(Steamship):
+    """Enough of a Steamship client to construct an AgentService without network access.
+
+    Create one with `OfflineClient.for_workspace(...)`, which skips the API key lookup that `Steamship()` performs.
+    Plugins are never called, since the stand-ins replace everything that would call them.
+    """
+
+    @staticmethod
+    def for_workspace(workspace_id: str = "offline-workspace") -> "OfflineClient":
+        return OfflineClient.construct(
+            config=Configuration.construct(
+                workspace_id=workspace_id, api_key=SecretStr("offline")
+            )
+        )
+
+    def use_plugin(self, plugin_handle: str, *args, **kwargs) -> PluginInstance:
+        return PluginInstance.construct(handle=plugin_handle)
+
+
+class OfflineChatHistory:
+    """Stand-in for ChatHistory: the messages of one conversation, kept in memory."""
+
+    def __init__(self, conversation_id: str):
+        self.conversation_id = conversation_id
+        self.messages: List[Block] = []
+
+    def _append(self, text: str, role: RoleTag) -> Block:
+        block = Block(id=uuid.uuid4().hex, file_id=self.conversation_id, text=text)
+        block.set_chat_role(role)
+        self.messages.append(block)
+        return block
+
+    def append_user_message(self, text: str) -> Block:
+        return self._append(text, RoleTag.USER)
+
+    def append_assistant_message(self, text: str) -> Block:
+        return self._append(text, RoleTag.ASSISTANT)
+
+    @property
+    def last_user_message(self) -> Optional[Block]:
+        return next(
+            (
+                message
+                for message in reversed(self.messages)
+                if message.chat_role == RoleTag.USER
+            ),
+            None,
+        )
+
+    def is_searchable(self) -> bool:
+        return False
+
+    def select_messages(self, selector) -> List[Block]:
+        return selector.get_messages(self.messages)
+
+
+REPLACEMENTS = [
+    (openai.ChatOpenAI, FakeChatOpenAI),
+    (openai.OpenAI, FakeOpenAI),
+    (stable_diffusion.StableDiffusionTool, FakeStableDiffusionTool),
+    (generate_speech.GenerateSpeechTool, FakeGenerateSpeechTool),
+    (search.SearchTool, FakeSearchTool),
+    (kv_store.KeyValueStore, InMemoryKeyValueStore),
+]
+"""(real, stand-in) pairs that `install` swaps."""
+
+
+def install():
+    """Replace the real classes in REPLACEMENTS with their stand-ins, in every module that has loaded them."""
+    for real, fake in REPLACEMENTS:
+        for module in list(sys.modules.values()):
+            if module is not None and getattr(module, real.__name__, None) is real:
+                setattr(module, real.__name__, fake)
+
+
+def substitute_tools(service) -> List[Tool]:
+    """Swap each VectorSearchQATool of `service`'s default agent for a FakeVectorSearchQATool with the same fields."""
+    agent = service.get_default_agent()
+    substitutes = {}
+    for tool in agent.tools:
+        if isinstance(tool, VectorSearchQATool) and not isinstance(
+            tool, FakeVectorSearchQATool
+        ):
+            # construct() rather than validation, since the SDK's default agent_description is a tuple.
+            substitutes[id(tool)] = FakeVectorSearchQATool.construct(
+                **{
+                    field: getattr(tool, field)
+                    for field in VectorSearchQATool.__fields__
+                }
+            )
+    if not substitutes:
+        return agent.tools
+    tools = [substitutes.get(id(tool), tool) for tool in agent.tools]
+    agent.tools = tools
+    agent.output_parser.tools_lookup_dict = {tool.name: tool for tool in tools}
+    service.tools = tools
+    return tools
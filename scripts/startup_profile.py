@@ -0,0 +1,207 @@
+"""Report, record and check the import-time cost of each example package.
+
+Every request to a deployed package starts by importing its `api.py`, so import time is paid on every cold start.
+This script runs `python -X importtime -c "import api"` in each example folder and attributes the time to the
+modules `api.py` imports directly.
+
+The Steamship SDK's own agent machinery is imported first and reported separately as the baseline: every example
+needs it, and without doing so its cost would land on whichever module `api.py` happens to import first.
+
+Usage (from the repository root):
+
+    python scripts/startup_profile.py            # print a report
+    python scripts/startup_profile.py --record   # save budgets to scripts/import_budgets.json
+    python scripts/startup_profile.py --check    # exit non-zero if any module exceeds its budget
+
+Each example is imported `--runs` times, and each module's median time is reported, recorded and checked: a single
+slow or lucky import moves neither a budget nor a check. The baseline's median is recorded too, and a check on a machine
+where the baseline takes longer scales the budgets up to match, so that a busy machine doesn't fail the check.
+
+Run `--check` after changing imports; if an increase is intended, re-run `--record` and commit the new budgets.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BUDGETS_PATH = os.path.join(REPO_ROOT, "scripts", "import_budgets.json")
+
+EXAMPLES = [
+    "ai-character-with-dynamic-prompt",
+    "ai-character-with-stable-diffusion",
+    "ai-character-with-voice",
+    "dog-trainer",
+    "question-answering-bot",
+]
+
+BASELINE_MODULE = "steamship.agents.service.agent_service"
+"""Imported before `api` so that the SDK's shared cost isn't attributed to an example's own modules."""
+
+BASELINE_KEY = "(baseline) " + BASELINE_MODULE
+"""Key under which the cost of importing BASELINE_MODULE is reported, and its median recorded without headroom."""
+
+TOTAL_KEY = "(total)"
+"""Key under which the incremental cost of importing `api` is reported."""
+
+HEADROOM_RATIO = 1.5
+HEADROOM_MS = 5.0
+"""Recorded budgets are `median * HEADROOM_RATIO + HEADROOM_MS`, so that timing noise doesn't fail the check.
+
+The ratio absorbs a slower machine; the fixed headroom, the jitter that dominates modules taking a few milliseconds.
+"""
+
+UNBUDGETED_MODULE_MS = 5.0
+"""A direct import with no recorded budget fails the check if it costs more than this."""
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)\s*$")
+
+
+def parse_importtime(stderr: str) -> List[Tuple[int, str, float]]:
+    """Return (depth, module, cumulative milliseconds) for each line of `-X importtime` output."""
+    entries = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            depth = len(match.group(3)) // 2
+            entries.append((depth, match.group(4), int(match.group(2)) / 1000))
+    return entries
+
+
+def profile_once(example: str) -> Dict[str, float]:
+    """Import `api` once in a fresh interpreter and return the cost of each of its direct imports, in ms."""
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            f"import {BASELINE_MODULE}; import api",
+        ],
+        cwd=os.path.join(REPO_ROOT, example),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {example}/api.py failed:\n{result.stderr}")
+
+    costs: Dict[str, float] = {}
+    # Children are printed before their parent, so collect depth-1 entries until `api` itself closes the list.
+    children: Dict[str, float] = {}
+    for depth, module, cumulative_ms in parse_importtime(result.stderr):
+        if depth == 1:
+            children[module] = cumulative_ms
+        elif depth == 0:
+            if module == "api":
+                costs.update(children)
+                costs[TOTAL_KEY] = cumulative_ms
+            elif module == BASELINE_MODULE:
+                costs[BASELINE_KEY] = cumulative_ms
+            children = {}
+    return costs
+
+
+def profile(example: str, runs: int) -> Dict[str, float]:
+    """Return the median of `runs` measurements for each module.
+
+    The fastest run would make budgets recorded on a quiet machine too tight to pass on a busy one.
+    """
+    samples: Dict[str, List[float]] = {}
+    for _ in range(runs):
+        for module, ms in profile_once(example).items():
+            samples.setdefault(module, []).append(ms)
+    return {module: statistics.median(times) for module, times in samples.items()}
+
+
+def print_report(example: str, costs: Dict[str, float]):
+    print(f"\n{example}")
+    for module, ms in sorted(costs.items(), key=lambda item: -item[1]):
+        print(f"  {ms:9.1f} ms  {module}")
+
+
+def check(
+    example: str, costs: Dict[str, float], budgets: Dict[str, float]
+) -> List[str]:
+    """Return a description of every module in `costs` that is over budget, scaled by how much slower the baseline
+    imported than when the budgets were recorded."""
+    scale = 1.0
+    if budgets.get(BASELINE_KEY) and costs.get(BASELINE_KEY):
+        scale = max(1.0, costs[BASELINE_KEY] / budgets[BASELINE_KEY])
+    scaled = f" (scaled by {scale:.2f} for a slower baseline)" if scale > 1 else ""
+    failures = []
+    for module, ms in costs.items():
+        if module == BASELINE_KEY:
+            continue
+        budget = budgets.get(module)
+        if budget is None and ms > UNBUDGETED_MODULE_MS * scale:
+            failures.append(
+                f"{example}: {module} takes {ms:.1f} ms but has no budget (limit for new imports is "
+                f"{UNBUDGETED_MODULE_MS * scale:.1f} ms{scaled})"
+            )
+        elif budget is not None and ms > budget * scale:
+            failures.append(
+                f"{example}: {module} takes {ms:.1f} ms, over its budget of {budget * scale:.1f} ms{scaled}"
+            )
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--record", action="store_true", help="Save budgets from this run."
+    )
+    mode.add_argument(
+        "--check", action="store_true", help="Fail if a module is over budget."
+    )
+    parser.add_argument(
+        "--runs", type=int, default=9, help="Imports per example; the median is kept."
+    )
+    parser.add_argument(
+        "examples", nargs="*", default=EXAMPLES, help="Example folders to profile."
+    )
+    args = parser.parse_args()
+
+    budgets = {}
+    if os.path.exists(BUDGETS_PATH):
+        with open(BUDGETS_PATH, "r") as f:
+            budgets = json.load(f)
+
+    failures = []
+    for example in args.examples:
+        costs = profile(example, args.runs)
+        print_report(example, costs)
+        if args.record:
+            budgets[example] = {
+                module: round(
+                    ms if module == BASELINE_KEY else ms * HEADROOM_RATIO + HEADROOM_MS,
+                    1,
+                )
+                for module, ms in sorted(costs.items())
+            }
+        elif args.check:
+            failures.extend(check(example, costs, budgets.get(example, {})))
+
+    if args.record:
+        with open(BUDGETS_PATH, "w") as f:
+            json.dump(budgets, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nRecorded budgets in {os.path.relpath(BUDGETS_PATH, REPO_ROOT)}")
+
+    if failures:
+        print("\nImport budget exceeded:")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+    if args.check:
+        print("\nAll imports are within budget.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())